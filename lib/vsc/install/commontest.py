@@ -34,15 +34,27 @@ Running python setup.py test will pick this up and do its magic
 @author: Stijn De Weirdt (Ghent University)
 """
 
+import ast
+import functools
+import hashlib
+import json
 import optparse
 import os
 import pprint
 import re
+import resource
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
 import pkg_resources
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from pkg_resources import parse_version
 from prospector.run import Prospector
 from prospector.config import ProspectorConfig
+from prospector.tools import TOOLS
 
 from distutils import log
 from vsc.install.ci import (
@@ -57,8 +69,8 @@ from vsc.install.ci import (
     parse_vsc_ci_cfg,
     ENABLE_GITHUB_ACTIONS,
 )
-from vsc.install.headers import check_header
-from vsc.install.shared_setup import vsc_setup
+from vsc.install.headers import HeaderChecker, HeaderDigests
+from vsc.install.shared_setup import JsonCache, vsc_setup
 from vsc.install.testing import TestCase
 
 prospector_version = pkg_resources.get_distribution("prospector").version
@@ -155,28 +167,170 @@ PROSPECTOR_IGNORE_PATHS = []
 # prospector ignore paths defaults
 PROSPECTOR_IGNORE_PATHS_DEFAULTS = ["build"]
 
+# codes of messages that depend on other files than the checked one and the modules it imports
+# (when any of these is whitelisted, ProspectorCache checks all files again when any file changed)
+PROSPECTOR_CROSS_FILE_CODES = [
+    "duplicate-code",
+    "cyclic-import",
+]
+
+# only run the prospector tools and pylint checks that can report messages that match PROSPECTOR_WHITELIST
+# (see prospector_check_set)
+PROSPECTOR_MINIMAL_CHECKS = False
+
+# first letters of the codes of the messages of prospector tools (pylint reports the message symbols),
+# used to determine which tools are needed for the whitelisted codes (see prospector_check_set)
+PROSPECTOR_TOOL_CODES = {
+    "pycodestyle": ("E", "W", "C"),
+    "pep8": ("E", "W", "C"),
+    "pyflakes": ("F",),
+    "mccabe": ("MC",),
+}
+
+# linters of CommonTest.test_prospector
+LINT_BACKEND_PROSPECTOR = "prospector"
+LINT_BACKEND_RUFF = "ruff"
+
+# environment variable with the number of processes to run prospector with in CommonTest (see run_prospector)
+VSC_INSTALL_PROSPECTOR_JOBS = "VSC_INSTALL_PROSPECTOR_JOBS"
+
+# prospector can check a list of files (and not only one directory)
+PROSPECTOR_MULTIPLE_PATHS = parse_version(prospector_version) >= parse_version("1.6.0")
+
 
 def prospector_ignore_paths_add(path):
     """Add a path that should be ignored by prospector"""
     PROSPECTOR_IGNORE_PATHS.append(path)
 
 
-def run_prospector(base_dir, clear_ignore_patterns=False):
-    """Run prospector and apply white/blacklists to the results"""
-    orig_expand_default = optparse.HelpFormatter.expand_default
+def pylint_message_definitions():
+    """Return list of tuples with the symbol and the message template of all (default) pylint messages"""
+    # pylint is a dependency of prospector
+    from pylint.lint import PyLinter  # pylint: disable=import-outside-toplevel
 
-    log.info("Using prosector version %s", prospector_version)
+    linter = PyLinter()
+    linter.load_default_plugins()
+    store = linter.msgs_store
+    if hasattr(store, "messages"):
+        definitions = store.messages
+    else:
+        definitions = store._messages_definitions.values()  # pylint: disable=protected-access
+    return [(definition.symbol, definition.msg) for definition in definitions]
+
+
+@functools.lru_cache()
+def _prospector_check_set(whitelist):
+    """Determine the check set for the tuple of whitelist patterns, see prospector_check_set"""
+    definitions = pylint_message_definitions()
+    known_symbols = {symbol for symbol, _ in definitions}
+    # patterns that are not the code of a message can only match the text of messages
+    text_patterns = [
+        pattern
+        for pattern in whitelist
+        if pattern not in known_symbols and not re.fullmatch(r"[A-Z]+\d+", pattern)
+    ]
 
+    classifier = MessageClassifier(whitelist)
+    symbols = sorted({
+        symbol
+        for symbol, msg in definitions
+        # the text of a message with placeholders (e.g. a variable name) might match any text pattern
+        if classifier.match(symbol, msg) or (text_patterns and "%" in msg.replace("%%", ""))
+    })
+
+    tools = set(PROSPECTOR_TOOL_CODES)
+    if not text_patterns:
+        # only codes: a tool is needed for codes that start with its letters,
+        # any other uppercase code might be of any tool
+        needed = set()
+        for code in whitelist:
+            if re.fullmatch(r"[A-Z]+\d+", code):
+                letters = re.match(r"[A-Z]+", code).group(0)
+                matches = [tool for tool, prefixes in PROSPECTOR_TOOL_CODES.items() if letters in prefixes]
+                needed.update(matches or PROSPECTOR_TOOL_CODES)
+        tools = needed
+
+    skip = sorted(set(PROSPECTOR_TOOL_CODES) - tools)
+    if not symbols:
+        skip.append("pylint")
+    return symbols, skip
+
+
+def prospector_check_set():
+    """
+    Return tuple with the symbols of the pylint messages that can match PROSPECTOR_WHITELIST
+    and the prospector tools that can not report messages that match it.
+
+    Whitelist patterns that are codes (pylint symbols, or codes like E501 of the other tools) only need the
+    checks of those codes (the tools are based on PROSPECTOR_TOOL_CODES). The other patterns are matched
+    with the text of the messages: they need the pylint checks with a matching message template, and
+    the checks of which the message has placeholders (which might be filled in with matching text,
+    e.g. the name of a variable), and all other tools. So the verdicts are the same as with all checks.
+    """
+    return _prospector_check_set(tuple(PROSPECTOR_WHITELIST))
+
+
+def prospector_argv(base_dir, paths=None):
+    """Return the prospector commandline (incl. fake program name) to check base_dir (or only the files paths)"""
     ignore_dirs = ",".join(PROSPECTOR_IGNORE_PATHS + PROSPECTOR_IGNORE_PATHS_DEFAULTS)
-    sys.argv = ["fakename"]
-    sys.argv.extend(PROSPECTOR_OPTIONS + ["--ignore-paths", ignore_dirs])
+    argv = ["fakename"]
+    argv.extend(PROSPECTOR_OPTIONS + ["--ignore-paths", ignore_dirs])
     log.debug("Prospector ignoring paths: %s", ignore_dirs)
 
     if PROSPECTOR_USE_LIBS:
-        sys.argv.extend(["--uses", ",".join(PROSPECTOR_USE_LIBS)])
+        argv.extend(["--uses", ",".join(PROSPECTOR_USE_LIBS)])
 
-    # add/set REPO_BASE_DIR as positional path
-    sys.argv.append(base_dir)
+    if PROSPECTOR_MINIMAL_CHECKS:
+        _, skip = prospector_check_set()
+        for tool in skip:
+            if tool in TOOLS:
+                argv.extend(["--without-tool", tool])
+
+    if paths:
+        argv.extend(paths)
+    else:
+        # add/set REPO_BASE_DIR as positional path
+        argv.append(base_dir)
+    return argv
+
+
+# message.as_dict() has been removed after prospector 1.8.0
+# same for location.as_dict()
+# mimic old behaviour
+def prospector_message_as_dict(message):
+    """Return dict with source, code, location (see prospector_location_as_dict) and message of prospector message"""
+    if hasattr(message, "as_dict"):
+        return message.as_dict()
+    else:
+        return {
+            "source": message.source,
+            "code": message.code,
+            "location": prospector_location_as_dict(message.location),
+            "message": message.message,
+        }
+
+
+def prospector_location_as_dict(location):
+    """Return dict with path, module, function, line and character of prospector message location"""
+    if hasattr(location, "as_dict"):
+        return location.as_dict()
+    else:
+        return {
+            "path": location.path,
+            "module": location.module,
+            "function": location.function,
+            "line": location.line,
+            "character": location.character,
+        }
+
+
+def prospector_messages(base_dir, clear_ignore_patterns=False, paths=None):
+    """Run prospector on base_dir (or only on the files paths in base_dir), return all messages as dicts"""
+    orig_expand_default = optparse.HelpFormatter.expand_default
+
+    log.info("Using prosector version %s", prospector_version)
+
+    sys.argv = prospector_argv(base_dir, paths=paths)
     log.debug("prospector commandline %s", sys.argv)
 
     config = ProspectorConfig()
@@ -197,59 +351,31 @@ def run_prospector(base_dir, clear_ignore_patterns=False):
         config.profile.ignore_patterns.append(append_pattern)
         config.ignores.append(re.compile(append_pattern))
 
-    # Enable pylint Python3 compatibility tests:
-    config.profile.pylint["options"]["enable"] = "python3"
+    if PROSPECTOR_MINIMAL_CHECKS:
+        # only the pylint checks of messages that can match the whitelist
+        # (prospector sets enable before disable, so disable=all would also disable those)
+        symbols, _ = prospector_check_set()
+        options = config.profile.pylint["options"]
+        options["disable"] = ",".join(sorted({symbol for symbol, _ in pylint_message_definitions()} - set(symbols)))
+        options["enable"] = ",".join(symbols)
+    else:
+        # Enable pylint Python3 compatibility tests:
+        config.profile.pylint["options"]["enable"] = "python3"
     log.debug("prospector argv = %s", sys.argv)
     log.debug("prospector profile from config = %s", vars(config.profile))
 
     prospector.execute()
     log.debug("prospector profile form prospector = %s", vars(prospector.config.profile))
 
-    # map yields a generator object in Python 3, but since we want to iterate over the whitelist/blacklist
-    # multiple times, we need to make sure it's a list (since you can only iterate once over a generator)
-    blacklist = list(map(re.compile, PROSPECTOR_BLACKLIST))
-    whitelist = list(map(re.compile, PROSPECTOR_WHITELIST))
-
-    failures = []
-
-    # message.as_dict() has been removed after prospector 1.8.0
-    # same for location.as_dict()
-    # mimic old behaviour
-    def prospector_message_as_dict(message):
-        if hasattr(message, "as_dict"):
-            return message.as_dict()
-        else:
-            return {
-                "source": message.source,
-                "code": message.code,
-                "location": prospector_location_as_dict(message.location),
-                "message": message.message,
-            }
-
-    def prospector_location_as_dict(location):
-        if hasattr(location, "as_dict"):
-            return location.as_dict()
-        else:
-            return {
-                "path": location.path,
-                "module": location.module,
-                "function": location.function,
-                "line": location.line,
-                "character": location.character,
-            }
-
+    messages = []
     for msg in prospector.get_messages():
         # example msg.as_dict():
         #  {'source': 'pylint', 'message': 'Missing function docstring', 'code': 'missing-docstring',
         #   'location': {'function': 'TestHeaders.test_check_header.lgpl', 'path': u'headers.py',
         #                'line': 122, 'character': 8, 'module': 'headers'}}
-        log.debug("prospector message %s", prospector_message_as_dict(msg))
-
-        if any([bool(reg.search(msg.code) or reg.search(msg.message)) for reg in blacklist]):
-            continue
-
-        if any([bool(reg.search(msg.code) or reg.search(msg.message)) for reg in whitelist]):
-            failures.append(prospector_message_as_dict(msg))
+        message = prospector_message_as_dict(msg)
+        log.debug("prospector message %s", message)
+        messages.append(message)
 
     # The following is still the case in 3.6. seems to be fixed in 3.9:
     # There is some ugly monkeypatch code in pylint
@@ -259,9 +385,563 @@ def run_prospector(base_dir, clear_ignore_patterns=False):
     if sys.version_info < (3, 9):
         optparse.HelpFormatter.expand_default = orig_expand_default
 
+    return messages
+
+
+class MessageClassifier:
+    """
+    Match the code or the message of prospector messages with a list of regex patterns
+    (like PROSPECTOR_BLACKLIST and PROSPECTOR_WHITELIST)
+
+    A message matches if any pattern is found in its code or in its message. Plain codes (like E501 or
+    unused-import) are looked up in a set first, all other patterns are combined in one regex
+    (except patterns with groups or flags, which are searched one by one),
+    and the verdict is cached per code and message.
+    """
+
+    def __init__(self, patterns):
+        """Classifier for the list of regex patterns"""
+        regs = [re.compile(pattern) for pattern in patterns]
+        self.codes = {reg.pattern for reg in regs if re.fullmatch(r"[\w-]+", reg.pattern)}
+
+        # groups and (inline) flags can not be combined
+        default_flags = re.compile("").flags
+        separate = [reg for reg in regs if reg.groups or reg.flags != default_flags]
+        combined = [reg.pattern for reg in regs if reg not in separate]
+        self.combined = re.compile("|".join(f"(?:{pattern})" for pattern in combined)) if combined else None
+        self.separate = separate
+
+        self._verdicts = {}
+
+    def search(self, txt):
+        """Return if any of the patterns is found in txt"""
+        if self.combined is not None and self.combined.search(txt):
+            return True
+        return any(reg.search(txt) for reg in self.separate)
+
+    def match(self, code, message):
+        """Return if any of the patterns is found in code or in message"""
+        key = (code, message)
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            verdict = code in self.codes or self.search(code) or self.search(message)
+            self._verdicts[key] = verdict
+        return verdict
+
+
+def filter_prospector_messages(messages):
+    """Apply white/blacklists to the prospector messages (as dicts), return the failures"""
+    blacklist = MessageClassifier(PROSPECTOR_BLACKLIST)
+    whitelist = MessageClassifier(PROSPECTOR_WHITELIST)
+
+    failures = []
+    for msg in messages:
+        if blacklist.match(msg["code"], msg["message"]):
+            continue
+
+        if whitelist.match(msg["code"], msg["message"]):
+            failures.append(msg)
+
     return failures
 
 
+def run_prospector(base_dir, clear_ignore_patterns=False, cache=None, jobs=1):
+    """
+    Run prospector and apply white/blacklists to the results
+
+    cache is the filename of a ProspectorCache, to only check the files that changed since the previous run
+    jobs is the number of processes to run prospector with (see parallel_prospector_messages)
+    """
+    if cache is None:
+        messages = parallel_prospector_messages(base_dir, clear_ignore_patterns=clear_ignore_patterns, jobs=jobs)
+    else:
+        messages = ProspectorCache(cache).messages(base_dir, clear_ignore_patterns=clear_ignore_patterns, jobs=jobs)
+
+    return filter_prospector_messages(messages)
+
+
+def prospector_cross_file_checks():
+    """Return if any of the PROSPECTOR_CROSS_FILE_CODES is whitelisted"""
+    whitelist = list(map(re.compile, PROSPECTOR_WHITELIST))
+    return any(reg.search(code) for reg in whitelist for code in PROSPECTOR_CROSS_FILE_CODES)
+
+
+def prospector_shards(paths, jobs):
+    """
+    Split the files paths in (at most) jobs shards of about the same total size
+
+    Return list of sorted lists of paths
+    """
+    shards = [[] for _ in range(min(jobs, len(paths)))]
+    sizes = [0] * len(shards)
+    # biggest files first, each to the smallest shard
+    for size, path in sorted(((os.path.getsize(path), path) for path in paths), reverse=True):
+        idx = sizes.index(min(sizes))
+        shards[idx].append(path)
+        sizes[idx] += size
+    return [sorted(shard) for shard in shards]
+
+
+def _prospector_shard(base_dir, clear_ignore_patterns, paths):
+    """Run prospector on the files paths in base_dir in a worker process, see parallel_prospector_messages"""
+    return prospector_messages(base_dir, clear_ignore_patterns=clear_ignore_patterns, paths=paths)
+
+
+def _prospector_message_key(message):
+    """Sort key of prospector message (as dict): path, line, character, code and message"""
+    location = message["location"]
+    path = str(location["path"])
+    return (path, location["line"] or 0, location["character"] or 0, message["code"], message["message"])
+
+
+def parallel_prospector_messages(base_dir, clear_ignore_patterns=False, paths=None, jobs=1):
+    """
+    Run prospector on base_dir (or only on the files paths in base_dir), see prospector_messages
+
+    With more than one job, the files are split in shards (see prospector_shards) which are checked
+    by jobs worker processes, and the messages are sorted by path, line, character and code.
+    All files are checked by one process when checks that depend on other files are whitelisted
+    (see prospector_cross_file_checks), or when the prospector version can not check a list of files.
+    """
+    if jobs <= 1 or prospector_cross_file_checks() or not PROSPECTOR_MULTIPLE_PATHS:
+        return prospector_messages(base_dir, clear_ignore_patterns=clear_ignore_patterns, paths=paths)
+
+    all_paths = paths
+    if all_paths is None:
+        all_paths = [os.path.join(base_dir, fn) for fn in prospector_files(base_dir, clear_ignore_patterns)]
+    shards = prospector_shards(all_paths, jobs)
+    if len(shards) <= 1:
+        return prospector_messages(base_dir, clear_ignore_patterns=clear_ignore_patterns, paths=paths)
+
+    log.info("Running prospector on %s files in %s shards", len(all_paths), len(shards))
+
+    messages = {}
+    nshards = len(shards)
+    with ProcessPoolExecutor(max_workers=nshards) as pool:
+        shards_messages = pool.map(_prospector_shard, [base_dir] * nshards, [clear_ignore_patterns] * nshards, shards)
+        for shard_messages in shards_messages:
+            # messages that are not about the checked files (e.g. about the profile) are reported by every shard
+            messages.update((_prospector_message_key(message), message) for message in shard_messages)
+
+    return [messages[key] for key in sorted(messages)]
+
+
+def prospector_files(base_dir, clear_ignore_patterns=False):
+    """
+    Return sorted list of python files (relative to base_dir) checked by prospector (see prospector_messages),
+    skipping the ignored paths, hidden files and directories (unless clear_ignore_patterns) and virtualenvs
+    """
+    ignore_paths = [os.path.normpath(path) for path in PROSPECTOR_IGNORE_PATHS + PROSPECTOR_IGNORE_PATHS_DEFAULTS]
+
+    def ignored(rel_path):
+        if rel_path in ignore_paths or any(rel_path.startswith(path + os.path.sep) for path in ignore_paths):
+            return True
+        return not clear_ignore_patterns and os.path.basename(rel_path).startswith(".")
+
+    res = []
+    for root, dirs, files in os.walk(base_dir):
+        rel_root = os.path.relpath(root, base_dir)
+        dirs[:] = [
+            name
+            for name in dirs
+            if not ignored(os.path.normpath(os.path.join(rel_root, name)))
+            and not os.path.exists(os.path.join(root, name, "pyvenv.cfg"))
+        ]
+        for name in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            if name.endswith(".py") and not ignored(rel_path):
+                res.append(rel_path)
+    return sorted(res)
+
+
+def module_names(rel_path):
+    """
+    Return set with the possible names of the module of python file rel_path:
+    the dotted path and all its suffixes (e.g. lib.vsc.install.ci, vsc.install.ci, install.ci and ci)
+    """
+    parts = os.path.splitext(rel_path)[0].split(os.path.sep)
+    if parts[-1] == "__init__":
+        parts.pop(-1)
+    return {".".join(parts[idx:]) for idx in range(len(parts))}
+
+
+def module_imports(filename, rel_path):
+    """
+    Return sorted list with the names of all modules imported by python file filename (rel_path relative to the
+    base dir), incl. the parent packages and the names imported from modules (they might be modules themselves)
+    """
+    try:
+        tree = ast.parse(Path(filename).read_bytes())
+    except (OSError, SyntaxError, ValueError):
+        return []
+
+    package = [part for part in os.path.dirname(rel_path).split(os.path.sep) if part]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module.split(".") if node.module else []
+            if node.level:
+                # relative import
+                module = package[: len(package) - node.level + 1] + module
+            if module:
+                names.add(".".join(module))
+            names.update(".".join(module + [alias.name]) for alias in node.names if alias.name != "*")
+
+    # importing a module also imports its parent packages
+    res = set()
+    for name in names:
+        parts = name.split(".")
+        res.update(".".join(parts[: idx + 1]) for idx in range(len(parts)))
+    return sorted(res)
+
+
+class ProspectorCache(JsonCache):
+    """
+    Persistent cache (stored as JSON in filename) of the prospector messages of every python file
+
+    The cache is only used for the same prospector version, options, ignore paths, --uses libs and Python version.
+    Only the files with a different content digest are checked again, together with all files that (directly or
+    indirectly) import them, since e.g. no-member depends on the imported modules.
+    Messages that depend on files that are not imported (see PROSPECTOR_CROSS_FILE_CODES) can not be cached
+    per file: when they are whitelisted, all files are checked again when any file changed.
+    """
+
+    DESCRIPTION = "prospector cache"
+
+    @staticmethod
+    def key(base_dir, clear_ignore_patterns):
+        """Return the key of the cache: everything but the files that determines the prospector messages"""
+        return [
+            prospector_version,
+            PROSPECTOR_OPTIONS,
+            PROSPECTOR_IGNORE_PATHS + PROSPECTOR_IGNORE_PATHS_DEFAULTS,
+            PROSPECTOR_USE_LIBS,
+            PROSPECTOR_WHITELIST if PROSPECTOR_MINIMAL_CHECKS else None,
+            bool(clear_ignore_patterns),
+            list(sys.version_info[:3]),
+            os.path.abspath(base_dir),
+        ]
+
+    @staticmethod
+    def digest(filename):
+        """Return sha256 digest of the content of filename"""
+        return hashlib.sha256(Path(filename).read_bytes()).hexdigest()
+
+    def load(self, key):
+        """Return the cached files and other messages for key (None if there are none)"""
+        if self.data.get("key") != key:
+            return None
+        return self.data
+
+    def messages(self, base_dir, clear_ignore_patterns=False, jobs=1):
+        """
+        Return all prospector messages of base_dir (see prospector_messages), only checking the changed files
+        (with jobs processes, see parallel_prospector_messages)
+        """
+        key = self.key(base_dir, clear_ignore_patterns)
+        files = {
+            rel_path: {"digest": self.digest(os.path.join(base_dir, rel_path))}
+            for rel_path in prospector_files(base_dir, clear_ignore_patterns=clear_ignore_patterns)
+        }
+
+        data = self.load(key)
+        todo = self.todo(base_dir, data, files)
+        if todo is None:
+            log.info("Checking all %s files with prospector", len(files))
+            data = {"key": key, "files": files, "other": []}
+            messages = parallel_prospector_messages(base_dir, clear_ignore_patterns=clear_ignore_patterns, jobs=jobs)
+        else:
+            log.info("Checking %s of %s files with prospector (cached: %s)", len(todo), len(files), self.filename)
+            cached = data["files"]
+            data = {"key": key, "files": files, "other": data["other"]}
+            for rel_path, entry in files.items():
+                if rel_path not in todo:
+                    entry["messages"] = cached[rel_path]["messages"]
+                if cached.get(rel_path, {}).get("digest") == entry["digest"]:
+                    entry["imports"] = cached[rel_path]["imports"]
+            messages = []
+            if todo:
+                paths = [os.path.join(base_dir, rel_path) for rel_path in sorted(todo)]
+                messages = parallel_prospector_messages(
+                    base_dir, clear_ignore_patterns=clear_ignore_patterns, paths=paths, jobs=jobs
+                )
+
+        for rel_path, entry in files.items():
+            if "messages" not in entry:
+                entry["messages"] = []
+            if "imports" not in entry:
+                entry["imports"] = module_imports(os.path.join(base_dir, rel_path), rel_path)
+
+        for message in messages:
+            path = str(message["location"]["path"])
+            rel_path = os.path.relpath(os.path.join(base_dir, path), base_dir)
+            if rel_path in files and (todo is None or rel_path in todo):
+                files[rel_path]["messages"].append(message)
+            elif todo is None:
+                # e.g. messages about the profile
+                data["other"].append(message)
+
+        self.data = data
+        self.save()
+
+        res = list(data["other"])
+        for entry in files.values():
+            res.extend(entry["messages"])
+        return res
+
+    def todo(self, base_dir, data, files):
+        """
+        Return set with the files to check, given the cached data and the current files (with their digest);
+        None if all files must be checked
+        """
+        if data is None:
+            return None
+
+        cached = data["files"]
+        changed = {
+            rel_path for rel_path, entry in files.items() if cached.get(rel_path, {}).get("digest") != entry["digest"]
+        }
+        removed = set(cached) - set(files)
+        if not changed and not removed:
+            return set()
+
+        if prospector_cross_file_checks():
+            log.info("Cross-file prospector checks are whitelisted, checking all files")
+            return None
+        if not PROSPECTOR_MULTIPLE_PATHS:
+            log.info("Prospector version %s can not check only the changed files", prospector_version)
+            return None
+
+        imports = {}
+        for rel_path in files:
+            if rel_path in changed:
+                imports[rel_path] = set(module_imports(os.path.join(base_dir, rel_path), rel_path))
+            else:
+                imports[rel_path] = set(cached[rel_path]["imports"])
+
+        # all files that (indirectly) import a changed or removed file
+        todo = set(changed)
+        names = set().union(*(module_names(rel_path) for rel_path in changed | removed))
+        while names:
+            dependents = {rel_path for rel_path in files if rel_path not in todo and imports[rel_path] & names}
+            todo.update(dependents)
+            names = set().union(*(module_names(rel_path) for rel_path in dependents))
+
+        return todo
+
+
+def ruff_binary(base_dir):
+    """Return the path of the ruff binary: ./ruff in base_dir (like in the Jenkinsfile) or ruff in $PATH"""
+    local = os.path.join(base_dir, "ruff")
+    if os.path.isfile(local) and os.access(local, os.X_OK):
+        return local
+    return shutil.which("ruff")
+
+
+def ruff_message_as_dict(diagnostic):
+    """Return dict like prospector_message_as_dict for ruff (JSON output) diagnostic"""
+    return {
+        "source": "ruff",
+        # syntax errors have no code
+        "code": diagnostic["code"] or "syntax-error",
+        "location": {
+            "path": diagnostic["filename"],
+            "module": None,
+            "function": None,
+            "line": diagnostic["location"]["row"],
+            # ruff columns start at 1
+            "character": diagnostic["location"]["column"] - 1,
+        },
+        "message": diagnostic["message"],
+    }
+
+
+def run_ruff(base_dir):
+    """
+    Run ruff on base_dir with the configuration of gen_ruff_toml, and apply the blacklist to the results
+
+    All (not blacklisted) diagnostics are failures, since the selected ruff rules mirror PROSPECTOR_WHITELIST.
+    Return the failures like run_prospector
+    """
+    ruff = ruff_binary(base_dir)
+    if ruff is None:
+        raise OSError(f"No ruff binary found in {base_dir} or $PATH")
+
+    # relative paths in the configuration are relative to its directory
+    fd, config = tempfile.mkstemp(dir=base_dir, prefix=".ruff.", suffix=".toml")
+    try:
+        with os.fdopen(fd, "w", encoding="utf8") as fh:
+            fh.write(gen_ruff_toml())
+        cmd = [ruff, "check", "--config", config, "--output-format", "json", "--exit-zero", "--no-cache", base_dir]
+        log.info("Running ruff: %s", cmd)
+        out = subprocess.check_output(cmd, cwd=base_dir, universal_newlines=True)
+    finally:
+        os.remove(config)
+
+    messages = [ruff_message_as_dict(diagnostic) for diagnostic in json.loads(out)]
+    blacklist = MessageClassifier(PROSPECTOR_BLACKLIST)
+    return [msg for msg in messages if not blacklist.match(msg["code"], msg["message"])]
+
+
+# module settings that are passed to the child process of an IsolatedProspector
+PROSPECTOR_SETTINGS = [
+    "PROSPECTOR_BLACKLIST",
+    "PROSPECTOR_CROSS_FILE_CODES",
+    "PROSPECTOR_IGNORE_PATHS",
+    "PROSPECTOR_IGNORE_PATHS_DEFAULTS",
+    "PROSPECTOR_MINIMAL_CHECKS",
+    "PROSPECTOR_OPTIONS",
+    "PROSPECTOR_USE_LIBS",
+    "PROSPECTOR_WHITELIST",
+]
+
+# code run by the child process of an IsolatedProspector (the request is read from the first line of stdin)
+ISOLATED_PROSPECTOR_CODE = """
+import json, os, sys
+request = json.loads(sys.stdin.readline())
+# only the result goes to stdout, anything else that is printed goes to stderr
+result = os.fdopen(os.dup(1), 'w', encoding='utf8')
+os.dup2(2, 1)
+sys.path[:0] = request['sys_path']
+from vsc.install.commontest import isolated_prospector_main
+isolated_prospector_main(request, result)
+"""
+
+
+def isolated_prospector_main(request, result):
+    """
+    Run prospector in the child process of an IsolatedProspector for request (dict with the run_prospector
+    arguments and the module settings), write the failures as JSON to file object result
+    """
+    module = sys.modules[__name__]
+    for name, value in request["settings"].items():
+        setattr(module, name, value)
+
+    failures = run_prospector(**request["kwargs"])
+    # recent prospector versions use pathlib paths
+    json.dump(failures, result, default=str)
+    result.close()
+
+
+class IsolatedProspector:
+    """
+    Run prospector (see run_prospector) in a child Python process, so it does not modify the state
+    (like sys.argv) of this process, and can run while this process does something else
+
+    The child process is killed as soon as it takes longer than timeout seconds (wall-clock time, from the start;
+    also when nobody is waiting for it yet), and can use no more than memory bytes of (virtual) memory
+    (None is no limit).
+    """
+
+    # code run by the child process
+    CODE = ISOLATED_PROSPECTOR_CODE
+
+    def __init__(self, base_dir, clear_ignore_patterns=False, cache=None, jobs=1, timeout=None, memory=None):
+        """Prospector run like run_prospector, with timeout and memory limit"""
+        self.kwargs = {
+            "base_dir": base_dir,
+            "clear_ignore_patterns": clear_ignore_patterns,
+            "cache": cache,
+            "jobs": jobs,
+        }
+        self.timeout = timeout
+        self.memory = memory
+        self.proc = None
+        self.stdout = None
+        self.stderr = None
+        self.timer = None
+        self.expired = False
+
+    def _limit(self):
+        """Limit the memory of the child process"""
+        resource.setrlimit(resource.RLIMIT_AS, (self.memory, self.memory))
+
+    def _expire(self):
+        """Kill the child process when the timeout expired (run by the timer thread)"""
+        if self.proc.poll() is None:
+            log.error("Isolated prospector did not finish in %s seconds, killing it", self.timeout)
+            self.expired = True
+            self.proc.kill()
+
+    def start(self):
+        """Start the child process (and the timer that kills it on timeout), return self"""
+        request = {
+            "sys_path": sys.path,
+            "kwargs": self.kwargs,
+            "settings": {name: globals()[name] for name in PROSPECTOR_SETTINGS},
+        }
+        # the output is only read at the end, so the child process never blocks on a full pipe
+        self.stdout = tempfile.TemporaryFile()
+        self.stderr = tempfile.TemporaryFile()
+        cmd = [sys.executable, "-c", self.CODE]
+        log.info("Starting isolated prospector for %s", self.kwargs["base_dir"])
+        self.proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=self.stdout,
+            stderr=self.stderr,
+            preexec_fn=None if self.memory is None else self._limit,
+            universal_newlines=True,
+        )
+        try:
+            self.proc.stdin.write(json.dumps(request) + "\n")
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            # the child process died already (e.g. by the memory limit), wait reports how
+            log.warn("Isolated prospector exited before reading its request")
+        if self.timeout is not None:
+            self.timer = threading.Timer(self.timeout, self._expire)
+            self.timer.daemon = True
+            self.timer.start()
+        return self
+
+    def wait(self):
+        """
+        Wait for the child process to finish, return the failures (like run_prospector)
+
+        Raises subprocess.TimeoutExpired when the timeout was exceeded,
+        and subprocess.CalledProcessError (with the end of stderr as output) when the child process failed
+        """
+        try:
+            self.proc.wait()
+            if self.timer is not None:
+                self.timer.cancel()
+                # the timer might be killing the child process right now
+                self.timer.join()
+            if self.expired:
+                raise subprocess.TimeoutExpired(self.proc.args, self.timeout)
+
+            if self.proc.returncode:
+                self.stderr.seek(0)
+                err = self.stderr.read().decode("utf8", "replace")
+                raise subprocess.CalledProcessError(self.proc.returncode, self.proc.args, output=err[-10000:])
+
+            self.stdout.seek(0)
+            out = self.stdout.read().decode("utf8")
+        finally:
+            self.kill()
+
+        return json.loads(out)
+
+    def kill(self):
+        """Kill the child process (if it is still running) and clean up"""
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.stdout.close()
+        self.stderr.close()
+
+
+def run_prospector_isolated(base_dir, clear_ignore_patterns=False, cache=None, jobs=1, timeout=None, memory=None):
+    """Run prospector in a child process (see IsolatedProspector), return the failures like run_prospector"""
+    isolated = IsolatedProspector(base_dir, clear_ignore_patterns, cache, jobs, timeout=timeout, memory=memory)
+    return isolated.start().wait()
+
+
 def check_autogenerated_ci_config_file(testcase_instance, ci_cfg_fn, expected_contents):
     """Test whether specified CI configuration file is in place, and was auto-generated by vsc-install."""
 
@@ -306,15 +986,62 @@ class CommonTest(TestCase):
 
     CHECK_HEADER = True
 
+    # linter of test_prospector: LINT_BACKEND_PROSPECTOR or LINT_BACKEND_RUFF (see run_ruff)
+    LINT_BACKEND = LINT_BACKEND_PROSPECTOR
+
+    # run prospector in a child process (see IsolatedProspector), started before the tests of the class,
+    # with a timeout (in seconds) and memory limit (in bytes)
+    PROSPECTOR_ISOLATED = False
+    PROSPECTOR_TIMEOUT = None
+    PROSPECTOR_MEMORY = None
+
+    _isolated_prospector = None
+
+    @classmethod
+    def setUpClass(cls):
+        """Start the isolated prospector, so it runs during the other tests"""
+        super().setUpClass()
+        if cls.PROSPECTOR_ISOLATED and cls.LINT_BACKEND == LINT_BACKEND_PROSPECTOR:
+            setup = vsc_setup()
+            cls._isolated_prospector = IsolatedProspector(
+                setup.REPO_BASE_DIR,
+                timeout=cls.PROSPECTOR_TIMEOUT,
+                memory=cls.PROSPECTOR_MEMORY,
+                **cls._prospector_kwargs(setup),
+            ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the isolated prospector (when test_prospector did not run)"""
+        if cls._isolated_prospector is not None:
+            cls._isolated_prospector.kill()
+            cls._isolated_prospector = None
+        super().tearDownClass()
+
+    @staticmethod
+    def _prospector_kwargs(setup):
+        """Return the cache and jobs arguments of run_prospector for vsc_setup instance setup"""
+        cache = None
+        if setup.cache is not None:
+            cache = os.path.join(setup.cache_dir(), "prospector.json")
+        return {"cache": cache, "jobs": int(os.environ.get(VSC_INSTALL_PROSPECTOR_JOBS, 1))}
+
     def setUp(self):
         """Cleanup after running a test."""
         self.orig_sys_argv = sys.argv
         self.setup = vsc_setup()
+        # one header checker for all files of the project
+        self.header_checker = HeaderChecker(setup=self.setup)
+        if self.setup.cache is not None:
+            self.header_checker.digests = HeaderDigests(os.path.join(self.setup.cache_dir(), "headers.json"))
         super().setUp()
 
     def tearDown(self):
         """Cleanup after running a test."""
         sys.argv = self.orig_sys_argv
+        # only (re)write the header digests when a test checked headers that were not known yet
+        if self.header_checker.digests is not None and self.header_checker.digests.changed:
+            self.header_checker.digests.save()
         super().tearDown()
 
     def _import(self, pkg):
@@ -330,13 +1057,14 @@ class CommonTest(TestCase):
 
     def test_import_packages(self):
         """Try to import each namespace"""
+        package_files = self.setup.files_in_packages()["packages"]
         for pkg in self.setup.generate_packages(extra=self.EXTRA_PKGS, exclude=self.EXCLUDE_PKGS):
             self._import(pkg)
 
             if self.CHECK_HEADER:
-                for fun in self.setup.files_in_packages()["packages"][pkg]:
+                for fun in package_files[pkg]:
                     self.assertFalse(
-                        check_header(os.path.join(self.setup.REPO_BASE_DIR, fun), script=False, write=False),
+                        self.header_checker.check(os.path.join(self.setup.REPO_BASE_DIR, fun), script=False),
                         msg=f"check_header of {fun}",
                     )
 
@@ -355,14 +1083,26 @@ class CommonTest(TestCase):
 
             if self.CHECK_HEADER:
                 self.assertFalse(
-                    check_header(os.path.join(self.setup.REPO_BASE_DIR, scr), script=True, write=False),
+                    self.header_checker.check(os.path.join(self.setup.REPO_BASE_DIR, scr), script=True),
                     msg=f"check_header of {scr}",
                 )
 
     def test_prospector(self):
         """Test prospector failures"""
+        if self.LINT_BACKEND == LINT_BACKEND_RUFF:
+            failures = run_ruff(self.setup.REPO_BASE_DIR)
+            self.assertFalse(failures, f"ruff failures: {pprint.pformat(failures)}")
+            return
+        if self.LINT_BACKEND != LINT_BACKEND_PROSPECTOR:
+            raise ValueError(f"Unknown LINT_BACKEND {self.LINT_BACKEND}")
 
-        failures = run_prospector(self.setup.REPO_BASE_DIR)
+        isolated = self.__class__._isolated_prospector
+        if isolated is not None:
+            # started in setUpClass
+            self.__class__._isolated_prospector = None
+            failures = isolated.wait()
+        else:
+            failures = run_prospector(self.setup.REPO_BASE_DIR, **self._prospector_kwargs(self.setup))
         self.assertFalse(failures, f"prospector failures: {pprint.pformat(failures)}")
 
     def test_jenkinsfile(self):
@@ -0,0 +1,93 @@
+#
+# Copyright 2026-2026 Ghent University
+#
+# This file is part of vsc-install,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/vsc-install
+#
+# vsc-install is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-install is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-install. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Read the paths tracked in a git index file, without running git
+
+This is used by vsc_setup to discover the files of a repository (see VSC_INSTALL_DISCOVERY),
+it is not part of the self-contained setup.py and is only imported when needed.
+"""
+
+import os
+import re
+import struct
+
+from pathlib import Path
+
+
+def git_index_files(index):
+    """
+    Return the sorted list of paths (relative to the repository, / separated) tracked in the git index file index
+
+    This is a minimal pure Python reader of the index format (versions 2, 3 and 4),
+    see https://git-scm.com/docs/index-format. Submodules (gitlinks) are skipped.
+    """
+    data = Path(index).read_bytes()
+    signature, version, count = struct.unpack(">4sLL", data[:12])
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"Unsupported git index {index} (signature {signature}, version {version})")
+
+    # sha256 repositories have longer object names
+    hash_size = 20
+    config = os.path.join(os.path.dirname(index), "config")
+    if os.path.isfile(config):
+        if re.search(r"^\s*objectformat\s*=\s*sha256\s*$", Path(config).read_text(encoding="utf8"), re.M | re.I):
+            hash_size = 32
+
+    gitlink = 0o160000
+    res = []
+    pos = 12
+    path = b""
+    for _ in range(count):
+        start = pos
+        mode = struct.unpack(">L", data[pos + 24 : pos + 28])[0]
+        pos += 40 + hash_size
+        flags = struct.unpack(">H", data[pos : pos + 2])[0]
+        pos += 2
+        if version >= 3 and flags & 0x4000:
+            # extended flags
+            pos += 2
+
+        if version == 4:
+            # path is prefix compressed: varint with the number of bytes to strip from the previous path
+            strip = data[pos] & 0x7F
+            while data[pos] & 0x80:
+                pos += 1
+                strip = ((strip + 1) << 7) | (data[pos] & 0x7F)
+            pos += 1
+            end = data.index(b"\0", pos)
+            path = path[: len(path) - strip] + data[pos:end]
+            pos = end + 1
+        else:
+            end = data.index(b"\0", pos)
+            path = data[pos:end]
+            # entries are padded with 1 to 8 nul bytes to a multiple of 8 bytes
+            pos = start + ((end - start) // 8 + 1) * 8
+
+        # skip submodules and the higher stages of merge conflicts
+        if mode & 0o170000 != gitlink and not flags & 0x3000:
+            res.append(path.decode("utf8", "surrogateescape"))
+
+    return res
@@ -26,52 +26,143 @@
 """
 Generate and verify headers from scripts and modules
 
-This module has a very primitive main routine:
+Use a HeaderChecker to check many files of a project.
+
+This module has a main routine:
     REPO_BASE_DIR=$PWD python -m vsc.install.headers path/to/file [script_or_not]
 
     Will write the header to the file as it is supposed to be
     (the optional script or not is a simple 1 or 0).
 
+    REPO_BASE_DIR=$PWD python -m vsc.install.headers --repo [--check|--fix] [--jobs N] [--changed-since REF] [--cache]
+                                                     [--json]
+
+    Will check (or fix) the headers of all files in the packages and all scripts of the repo
+    (or only those changed since git REF), using N processes.
+    Exits with non-zero exitcode when headers are different (or could not be checked).
+    With --cache, files that are known to have a correct header (based on their content digest) are skipped.
+    With --json, the result of every file is reported as a line of JSON (see HeaderChecker.report).
+
+    REPO_BASE_DIR=$PWD python -m vsc.install.headers --sdist dist/name-version.tar.gz [--json]
+
+    Will check the headers of all package files and scripts in the sdist tarball, without extracting it.
+
     REPO_BASE_DIR=$PWD assumes you run this from the base repo
 
 @author: Stijn De Weirdt (Ghent University)
 """
 
+import argparse
+import collections
 import difflib
+import hashlib
+import itertools
+import json
 import os
 import re
+import shutil
+import subprocess
 import sys
+import tarfile
+import tempfile
+import time
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import date
-from vsc.install.shared_setup import SHEBANG_BIN_BASH, SHEBANG_ENV_PYTHON, log, vsc_setup
+from vsc.install.shared_setup import (
+    DEFAULT_LIB_DIR,
+    SHEBANG_BIN_BASH,
+    SHEBANG_ENV_PYTHON,
+    SHEBANG_STRIPPED_ENV_PYTHON,
+    JsonCache,
+    log,
+    vsc_setup,
+)
 
 HEADER_REGEXP = re.compile(r'\A(.*?)^(?:\'\'\'|"""|### END OF HEADER)', re.M | re.S)
+# begin of the line that ends the header (see HEADER_REGEXP)
+HEADER_END_MARKERS = (b"'''", b'"""', b"### END OF HEADER")
+# warn when the end of the header is not in the first bytes of a file (None is no limit), see read_header_block
+HEADER_MAX_SIZE = 64 * 1024
+# above this number of different lines, nicediff compares the lines by position (ndiff is too slow)
+NICEDIFF_MAX_NDIFF_LINES = 2000
 ENCODING_REGEXP = re.compile(r"^(\s*#\s*.*?coding[:=]\s*([-\w.]+).*).*$", re.M)  # PEP0263, 1st or 2nd line
 
 
-def nicediff(txta, txtb, offset=5):
+def nicediff(txta, txtb, offset=5, limit=None):
     """
     generate unified diff style output
         ndiff has nice indicators what is different, but prints the whole content
             each line that is interesting starts with non-space
         unified diff only prints changes and some offset around it
 
+    limit is the maximum number of lines to return (None is no limit)
+
     return list with diff (one per line) (not a generator like ndiff or unified_diff)
     """
-    diff = list(difflib.ndiff(txta.splitlines(1), txtb.splitlines(1)))
-    different_idx = [idx for idx, line in enumerate(diff) if not line.startswith(" ")]
-    res_idx = []
-    # very bruteforce
-    for didx in different_idx:
-        for idx in range(max(didx - offset, 0), min(didx + offset, len(diff) - 1)):
-            if idx not in res_idx:
-                res_idx.append(idx)
-    res_idx.sort()
-    # insert linenumbers too? what are the linenumbers in ndiff?
-    newdiff = [diff[idx] for idx in res_idx]
+    return list(itertools.islice(iter_nicediff(txta, txtb, offset=offset), limit))
 
-    return newdiff
+
+def iter_nicediff(txta, txtb, offset=5):
+    """
+    Generate the nicediff lines of txta and txtb (see nicediff): the changed lines with offset lines around them
+
+    Lines are only compared when needed (so stopping early saves work), the common begin and end are not diffed,
+    and when more than NICEDIFF_MAX_NDIFF_LINES lines are different, they are compared by position
+    instead of with ndiff.
+    """
+    linesa = txta.splitlines(True)
+    linesb = txtb.splitlines(True)
+
+    # common begin and end
+    begin = 0
+    common = min(len(linesa), len(linesb))
+    while begin < common and linesa[begin] == linesb[begin]:
+        begin += 1
+    end = 0
+    while end < common - begin and linesa[-1 - end] == linesb[-1 - end]:
+        end += 1
+    enda = len(linesa) - end
+    endb = len(linesb) - end
+
+    if enda - begin + endb - begin > NICEDIFF_MAX_NDIFF_LINES:
+        diff = _positional_diff(linesa[begin:enda], linesb[begin:endb])
+    else:
+        diff = difflib.ndiff(linesa[begin:enda], linesb[begin:endb])
+
+    lines = itertools.chain(
+        ("  " + line for line in linesa[max(begin - offset, 0) : begin]),
+        diff,
+        ("  " + line for line in linesa[enda : enda + offset]),
+    )
+
+    # keep the last offset unchanged lines, in case a change follows
+    before = collections.deque(maxlen=offset)
+    after = 0
+    for line in lines:
+        if not line.startswith(" "):
+            yield from before
+            before.clear()
+            yield line
+            after = offset
+        elif after:
+            yield line
+            after -= 1
+        elif offset:
+            before.append(line)
+
+
+def _positional_diff(linesa, linesb):
+    """Generate ndiff style lines, comparing the lines of linesa and linesb at the same position"""
+    for linea, lineb in itertools.zip_longest(linesa, linesb):
+        if linea == lineb:
+            yield "  " + linea
+            continue
+        if linea is not None:
+            yield "- " + linea
+        if lineb is not None:
+            yield "+ " + lineb
 
 
 # tools to determine current header
@@ -79,7 +170,38 @@ def nicediff(txta, txtb, offset=5):
 # allow easy tool to fixup headers
 
 
-def get_header(filename, script=False):
+def read_header_block(filename, max_size=HEADER_MAX_SIZE):
+    """
+    Read filename line by line up to (and incl.) the line that ends the header
+
+    When the end of the header is not in the first max_size bytes (None is no limit),
+    a warning is logged and the rest of the file is read too
+    (a larger header must not be mistaken for a missing one, or fixing it would add a second header).
+
+    Return tuple with the bytes read and the size of the header (the bytes before the line that ends it),
+    or empty bytes and 0 when the end of the header was not found
+    """
+    with open(filename, "rb") as fh:
+        return _read_header_block(fh, max_size, name=filename)
+
+
+def _read_header_block(fh, max_size, name=None):
+    """Read the header block from binary file object fh (of file name), see read_header_block"""
+    size = 0
+    lines = []
+    for line in iter(fh.readline, b""):
+        lines.append(line)
+        if line.startswith(HEADER_END_MARKERS):
+            return b"".join(lines), size
+        size += len(line)
+        if max_size is not None and size >= max_size:
+            log.warn("End of header of %s not found in the first %s bytes, reading the whole file", name, max_size)
+            max_size = None
+
+    return b"", 0
+
+
+def get_header(filename, script=False, max_size=HEADER_MAX_SIZE):
     """
     Given filename, retrieve header.
     If script is true, retrieve the shebang
@@ -89,13 +211,33 @@ def get_header(filename, script=False):
         magic comment '### END OF HEADER' at begin of line
     Anything can be part of the header, does not require starting # or something like that
 
+    The end of the header is looked for in the first max_size bytes of the file first (None is no limit),
+    see read_header_block; when the end is not found, there is no header.
+
     Return tuple: first element is header, 2nd element shebang if script
     """
+    header, shebang, _ = _read_header(filename, script, max_size)
+    return header, shebang
 
+
+def _read_header(filename, script, max_size):
+    """
+    Retrieve header (and shebang if script) of filename, see get_header
+
+    Return tuple with header, shebang and the size in bytes of both in the file
+    """
     if not os.path.isfile(filename):
         raise ValueError(f"get_header filename {filename} not found")
 
-    txt = Path(filename).read_text(encoding="utf8")
+    block, size = read_header_block(filename, max_size=max_size)
+    header, shebang = _split_header(block, filename, script)
+    return header, shebang, size
+
+
+def _split_header(block, filename, script):
+    """Return tuple with header and shebang (if script) from the header block (see read_header_block) of filename"""
+    # universal newlines, like reading the file as text
+    txt = block.decode("utf8").replace("\r\n", "\n").replace("\r", "\n")
 
     blocks = HEADER_REGEXP.split(txt)
     if len(blocks) == 1:
@@ -118,6 +260,63 @@ def get_header(filename, script=False):
     return header, shebang
 
 
+class LicenseHeaders:
+    """
+    Registry of license headers
+
+    The template of a license is looked up and filled in once per organisation (see institute_details),
+    and the header is rendered once per project name, url and copyright years.
+    The rendered header is also available as bytes with its digest, to compare headers by digest.
+    """
+
+    # fields of the templates that are filled in when rendering
+    FIELDS = ("beginyear", "endyear", "name", "url")
+
+    def __init__(self):
+        """Start with empty caches"""
+        self._organisations = {}
+        self._templates = {}
+        self._headers = {}
+        self._headers_bytes = {}
+
+    def organisation(self, url):
+        """Return the organisation (see institute_details) of url"""
+        if url not in self._organisations:
+            organisation = next((org for org in institute_details if org in url.lower()), None)
+            if organisation is None:
+                raise ValueError(f"Unable to find a known github organization in url {url}")
+            self._organisations[url] = organisation
+        return self._organisations[url]
+
+    def template(self, license_name, url):
+        """Return the template of license_name, with the details of the organisation in url filled in"""
+        key = (license_name, self.organisation(url))
+        if key not in self._templates:
+            template_name = f"{license_name.replace('+', '_plus_')}_TEMPLATE"
+            template = globals().get(template_name, None)
+            if template is None:
+                raise ValueError(f"gen_license_header cannot find template name {template_name}")
+            fields = {field: f"{{{field}}}" for field in self.FIELDS}
+            self._templates[key] = template.format(**fields, **institute_details[key[1]])
+        return self._templates[key]
+
+    def render(self, license_name, name, url, beginyear, endyear):
+        """Return the license header of license_name for project name with url and copyright years"""
+        key = (license_name, name, url, beginyear, endyear)
+        if key not in self._headers:
+            template = self.template(license_name, url)
+            self._headers[key] = template.format(beginyear=beginyear, endyear=endyear, name=name, url=url)
+        return self._headers[key]
+
+    def render_bytes(self, license_name, name, url, beginyear, endyear):
+        """Return tuple with the license header (see render) as (utf8) bytes and its sha256 digest"""
+        key = (license_name, name, url, beginyear, endyear)
+        if key not in self._headers_bytes:
+            header = self.render(*key).encode("utf8")
+            self._headers_bytes[key] = (header, hashlib.sha256(header).hexdigest())
+        return self._headers_bytes[key]
+
+
 def gen_license_header(license_name, **kwargs):
     """
     Create an appropriate license header for this project
@@ -129,22 +328,8 @@ def gen_license_header(license_name, **kwargs):
         name: project name
         url: project url
     """
-    template_name = f"{license_name.replace('+', '_plus_')}_TEMPLATE"
-    template = globals().get(template_name, None)
-    if template is None:
-        raise ValueError(f"gen_license_header cannot find template name {template_name}")
-
-    found = False
-    for github_organ, details in institute_details.items():
-        if github_organ in kwargs.get("url", "").lower():
-            kwargs.update(details)
-            found = True
-            break
-
-    if not found:
-        raise ValueError(f"Unable to find a known github organization in url {kwargs.get('url')}")
-
-    return template.format(**kwargs)
+    url = kwargs.get("url", "")
+    return LICENSE_HEADERS.render(license_name, kwargs["name"], url, kwargs["beginyear"], kwargs["endyear"])
 
 
 def _this_year():
@@ -172,123 +357,605 @@ def begin_end_from_header(header):
     return beginyear, endyear
 
 
-def _write(filename, content):
-    """Simple wrapper around Path().write_text() for unittesting"""
-    Path(filename).write_text(content, encoding="utf8")
-
+def _write(filename, header, offset):
+    """
+    Replace the first offset bytes of filename with header (bytes)
 
-def check_header(filename, script=False, write=False):
+    The new file is written to a temporary file in the same directory (with the remainder of the file
+    copied as is), which then atomically replaces filename, so an interrupted write never truncates it.
     """
-    Given filename, extract the header, verify it
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix=".vsc-header.")
+    try:
+        with os.fdopen(fd, "wb") as new_fh, open(filename, "rb") as fh:
+            new_fh.write(header)
+            fh.seek(offset)
+            shutil.copyfileobj(fh, new_fh)
+        shutil.copymode(filename, tmp)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class HeaderDigests(JsonCache):
+    """
+    Persistent cache (stored as JSON in filename) of the files with a correct header
 
-    if script: treat first line as shebang
-    if write: adapt file to new header
+    For each file, the size, mtime and content digest are stored, together with the inputs of the
+    expected header (license, name, url, year and script or not) and the digest of the license header
+    it was checked against (see LicenseHeaders.render_bytes). A file with the same inputs, the same
+    license header digest and the same size and mtime or the same content digest still has a correct header.
+    """
 
-    If the header contains line '### External compatible license',
-    one assumes the license is correct and should not be controlled by check_header
+    DESCRIPTION = "header digests"
+
+    @staticmethod
+    def digest(filename):
+        """Return sha256 digest of the content of filename"""
+        return hashlib.sha256(Path(filename).read_bytes()).hexdigest()
+
+    def unchanged(self, filename, inputs, header_digest):
+        """
+        Check if filename is known to have a correct header for the expected header inputs,
+        header_digest returns the digest of the expected license header for a copyright beginyear
+        (so e.g. a changed license template is checked again)
+        """
+        entry = self.data.get(os.path.abspath(filename))
+        if entry is None or entry["inputs"] != inputs:
+            return False
+        header = entry.get("header")
+        if header is not None and header[1] != header_digest(header[0]):
+            return False
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if entry["stat"] != [stat.st_mtime_ns, stat.st_size]:
+            if stat.st_size != entry["stat"][1] or self.digest(filename) != entry["digest"]:
+                return False
+            # same content, e.g. touched or checked out again
+            entry["stat"] = [stat.st_mtime_ns, stat.st_size]
+            self.changed = True
+
+        log.info("Header of %s is unchanged", filename)
+        return True
+
+    def add(self, filename, inputs, header=None):
+        """
+        Record that filename has a correct header for the expected header inputs,
+        header is the copyright beginyear and the digest of the license header (None for an external license)
+        """
+        stat = os.stat(filename)
+        self.data[os.path.abspath(filename)] = {
+            "inputs": inputs,
+            "header": header,
+            "stat": [stat.st_mtime_ns, stat.st_size],
+            "digest": self.digest(filename),
+        }
+        self.changed = True
+
+
+class HeaderChecker:
+    """
+    Check (and fix) the headers of many files of one project
 
-    Return if header is different from expected or not
+    The project name, url and license are determined once (on first use),
+    and the license headers are rendered once per copyright years (see LicenseHeaders).
+    With digests (a HeaderDigests instance), files that are known to have a correct header are skipped.
     """
 
-    header, orig_shebang = get_header(filename, script=script)
-    header_end_pos = len(header)
+    def __init__(self, setup=None, project=None, digests=None):
+        """
+        setup is the vsc_setup instance of the project (a new one is created when needed)
+        project is the (already determined) project value of another HeaderChecker
+        digests is a HeaderDigests instance
+        """
+        self.setup = setup
+        self._project = project
+        self.digests = digests
+
+    @property
+    def project(self):
+        """Return tuple with license name and (templating) data with name and url of the project"""
+        if self._project is None:
+            if self.setup is None:
+                self.setup = vsc_setup()
+            # version is irrelevant
+            name_url = self.setup.get_name_url(version="ALL_VERSIONS")
+            license_name, _ = self.setup.get_license()
+            self._project = (license_name, {"name": name_url["name"], "url": name_url["url"]})
+        return self._project
+
+    def license_header(self, beginyear, endyear):
+        """Return the license header of the project with copyright from beginyear to endyear"""
+        license_name, data = self.project
+        return LICENSE_HEADERS.render(license_name, data["name"], data["url"], beginyear, endyear)
+
+    def digest_inputs(self, script):
+        """Return the inputs of the expected header of a (script) file, to store with its digest"""
+        license_name, data = self.project
+        return [license_name, data["name"], data["url"], _this_year(), bool(script)]
+
+    def header_digest(self, beginyear):
+        """Return the digest of the license header of the project with copyright from beginyear to this year"""
+        license_name, data = self.project
+        return LICENSE_HEADERS.render_bytes(license_name, data["name"], data["url"], beginyear, _this_year())[1]
+
+    def digest_header(self, details):
+        """Return the header to store with the digest of a file with a correct header, checked with details"""
+        if details.get("years") is None:
+            # external compatible license
+            return None
+        beginyear = details["years"][0]
+        return [beginyear, self.header_digest(beginyear)]
+
+    def check(self, filename, script=False, write=False, details=None):
+        """
+        Given filename, extract the header, verify it
+
+        if script: treat first line as shebang
+        if write: adapt file to new header
+        details is an optional dict that is updated with the details of the check (see report)
+
+        If the header contains line '### External compatible license',
+        one assumes the license is correct and should not be controlled by check
+
+        Return if header is different from expected or not
+        """
+        if details is None:
+            details = {}
+
+        if self.digests is None:
+            return self._check(filename, script, write, details)
+
+        inputs = self.digest_inputs(script)
+        if self.digests.unchanged(filename, inputs, self.header_digest):
+            details["cached"] = True
+            return False
+
+        changed = self._check(filename, script, write, details)
+        if not changed:
+            self.digests.add(filename, inputs, self.digest_header(details))
+        return changed
 
-    changed = False
+    def report(self, filename, script=False, write=False):
+        """
+        Check (and fix if write) the header of filename, see check
+
+        Return dict (that can be serialised to JSON) with
+            file, script: filename and script or not
+            status: unchanged, changed, fixed (with write) or error
+            changed: if header is different from expected or not (None on error)
+            error: the error message (None if no error)
+            cached: header is known to be correct (see digests), the header details are not determined
+            shebang: dict with the found and the expected shebang (None if not a script)
+            external: if the header is an external compatible license (which is not checked)
+            license, years: license and copyright begin- and endyear of the expected header
+            diff: dict with the number of removed and added lines of the header
+            time: the time it took in seconds
+        """
+        return self._report(filename, script, write, lambda details: self.check(filename, script, write, details))
+
+    def report_member(self, name, fh, script=False):
+        """
+        Check the header of a file that is not on disk (e.g. a member of a tarball) named name,
+        read from binary file object fh (only up to the end of the header)
+
+        Python scripts may have the shebang as rewritten by vsc_sdist_rpm.
+
+        Return dict like report
+        """
+        return self._report(name, script, False, lambda details: self._check_member(name, fh, script, details))
+
+    def _report(self, filename, script, write, check):
+        """Return dict with the report (see report) of function check, which is passed the details to update"""
+        start = time.time()
+        res = {
+            "file": filename,
+            "script": bool(script),
+            "status": None,
+            "changed": None,
+            "error": None,
+            "cached": False,
+            "shebang": None,
+            "external": False,
+            "license": None,
+            "years": None,
+            "diff": None,
+        }
+        try:
+            res["changed"] = check(res)
+        except Exception as err:
+            res["status"] = "error"
+            res["error"] = f"{err.__class__.__name__}: {err}"
+        else:
+            if res["changed"]:
+                res["status"] = "fixed" if write else "changed"
+            else:
+                res["status"] = "unchanged"
+        res["time"] = time.time() - start
+        return res
 
-    shebang = None
-    if script:
-        # scripts must have an appropriate shebang
-        shebang = orig_shebang
-        file_ext = os.path.splitext(filename)[1]
-        log.info(f"Shebang found in {filename} (ext: {file_ext}): {shebang}")
-
-        if file_ext == ".py":
-            if shebang != SHEBANG_ENV_PYTHON:
-                log.info(
-                    "Wrong shebang for Python script %s: found '%s', should be '%s'",
+    def _check(self, filename, script, write, details):
+        """Check (and fix if write) the header of filename, see check"""
+        header, orig_shebang, header_size = _read_header(filename, script, HEADER_MAX_SIZE)
+
+        changed, new_header = self._compare(filename, header, orig_shebang, script, details)
+
+        if write and changed and new_header is not None:
+            log.info("write enabled and different header. Going to modify file %s", filename)
+            # only the header is replaced, the remainder of the file is kept as is
+            _write(filename, new_header.encode("utf8"), header_size)
+
+        # return different or not
+        return changed
+
+    def _check_member(self, name, fh, script, details):
+        """Check the header of name read from fh, see report_member"""
+        block, _ = _read_header_block(fh, HEADER_MAX_SIZE, name=name)
+        header, orig_shebang = _split_header(block, name, script)
+        changed, _ = self._compare(name, header, orig_shebang, script, details, rpm=True)
+        return changed
+
+    def _compare(self, filename, header, orig_shebang, script, details, rpm=False):
+        """
+        Compare header and shebang (if script) of filename with the expected ones, see check
+        if rpm: accept the python shebang as rewritten by vsc_sdist_rpm
+
+        Return tuple with different or not and the new header (None if the header must be left as-is)
+        """
+        found_shebang = orig_shebang
+        if rpm and script and orig_shebang == SHEBANG_STRIPPED_ENV_PYTHON:
+            # undo the shebang rewrite of vsc_sdist_rpm
+            orig_shebang = SHEBANG_ENV_PYTHON
+
+        changed = False
+
+        shebang = None
+        if script:
+            # scripts must have an appropriate shebang
+            shebang = orig_shebang
+            file_ext = os.path.splitext(filename)[1]
+            log.info(f"Shebang found in {filename} (ext: {file_ext}): {shebang}")
+
+            if file_ext == ".py":
+                if shebang != SHEBANG_ENV_PYTHON:
+                    log.info(
+                        "Wrong shebang for Python script %s: found '%s', should be '%s'",
+                        filename,
+                        shebang,
+                        SHEBANG_ENV_PYTHON,
+                    )
+                    shebang = SHEBANG_ENV_PYTHON
+
+            elif file_ext in [".sh", ""]:
+                if shebang != SHEBANG_BIN_BASH:
+                    log.info(
+                        "Wrong shebang for shell script %s: found '%s', should be '%s'",
+                        filename,
+                        shebang,
+                        SHEBANG_BIN_BASH,
+                    )
+                    shebang = SHEBANG_BIN_BASH
+
+            else:
+                log.warn(
+                    "Don't know expected shebang based on extension '%s' for script '%s', assuming it's OK...",
+                    file_ext,
                     filename,
-                    shebang,
-                    SHEBANG_ENV_PYTHON,
                 )
+
+            changed = shebang != orig_shebang
+
+        if orig_shebang is not None:
+            if "python" in shebang and shebang != SHEBANG_ENV_PYTHON:
+                log.info("python in shebang, forcing env python (header modified)")
+                changed = True
                 shebang = SHEBANG_ENV_PYTHON
 
-        elif file_ext in [".sh", ""]:
-            if shebang != SHEBANG_BIN_BASH:
-                log.info(
-                    "Wrong shebang for shell script %s: found '%s', should be '%s'", filename, shebang, SHEBANG_BIN_BASH
-                )
-                shebang = SHEBANG_BIN_BASH
+        if script:
+            details["shebang"] = {"found": found_shebang, "expected": shebang}
+
+        if re.search(r"^### External compatible license\s*$", header, re.M):
+            log.info("Header is an external compatible license. Leaving the header as-is.")
+            details["external"] = True
+            return changed, None
 
+        # begin and endyear from copyright rule
+        beginyear, endyear = begin_end_from_header(header)
+        details["license"] = self.project[0]
+        details["years"] = [beginyear, endyear]
+
+        # reconstruct original header, incl. shebang (if any)
+        if orig_shebang:
+            orig_header = orig_shebang + "\n" + header
         else:
-            log.warn(
-                "Don't know expected shebang based on extension '%s' for script '%s', assuming it's OK...",
-                file_ext,
-                filename,
-            )
+            orig_header = header
+
+        # generate header like it should be
+        gen_header = self.license_header(beginyear, endyear)
 
-        changed = shebang != orig_shebang
+        # force encoding?
+        reg_enc = ENCODING_REGEXP.search(header)
+        if reg_enc:
+            enc_line = reg_enc.group(1) + "\n"  # matches full line, but not newline
+            gen_header = enc_line + gen_header
 
-    if orig_shebang is not None:
-        # original position
-        header_end_pos += 1 + len(orig_shebang)  # 1 is from splitted newline
+        # compose header like it should be, incl. shebang
+        if shebang:
+            new_header = shebang + "\n" + gen_header
+        else:
+            new_header = gen_header
 
-        if "python" in shebang and shebang != SHEBANG_ENV_PYTHON:
-            log.info("python in shebang, forcing env python (header modified)")
+        diff = []
+        if orig_header != new_header:
+            diff = nicediff(orig_header, new_header)
+            log.info("Diff orig_header vs new_header for %s\n", filename + "".join(diff))
             changed = True
-            shebang = SHEBANG_ENV_PYTHON
+        details["diff"] = {
+            "removed": len([line for line in diff if line.startswith("- ")]),
+            "added": len([line for line in diff if line.startswith("+ ")]),
+        }
 
-    if re.search(r"^### External compatible license\s*$", header, re.M):
-        log.info("Header is an external compatible license. Leaving the header as-is.")
-        return changed
+        return changed, new_header
 
-    # genheader
-    # version is irrelevant
-    setup = vsc_setup()
-    name_url = setup.get_name_url(version="ALL_VERSIONS")
-    license_name, _ = setup.get_license()
-
-    # begin and endyear from copyright rule
-    beginyear, endyear = begin_end_from_header(header)
-
-    data = {
-        "beginyear": beginyear,
-        "endyear": endyear,
-        "name": name_url["name"],
-        "url": name_url["url"],
-    }
-
-    # reconstruct original header, incl. shebang (if any)
-    if orig_shebang:
-        orig_header = orig_shebang + "\n" + header
+
+def check_header(filename, script=False, write=False):
+    """
+    Given filename, extract the header, verify it
+    (to check many files of a project, use a HeaderChecker instance)
+
+    if script: treat first line as shebang
+    if write: adapt file to new header
+
+    Return if header is different from expected or not
+    """
+    return HeaderChecker().check(filename, script=script, write=write)
+
+
+def repo_files(setup):
+    """
+    Return sorted list of tuples with the filename (relative to REPO_BASE_DIR) and script or not
+    of all files in the packages and all scripts of the repo of vsc_setup instance setup
+    """
+    res = [(fn, False) for files in setup.files_in_packages()["packages"].values() for fn in files]
+    res.extend((fn, True) for fn in setup.generate_scripts())
+    return sorted(res)
+
+
+# HeaderChecker of a report_files worker process
+_worker_checker = None
+
+
+def _init_worker(project):
+    """Initialise a report_files worker process with a HeaderChecker for project"""
+    global _worker_checker
+    _worker_checker = HeaderChecker(project=project)
+
+
+def _report_file(filename, script, write, checker=None):
+    """Report about the header of filename (see HeaderChecker.report) with checker (default: the one of the worker)"""
+    if checker is None:
+        checker = _worker_checker
+    return checker.report(filename, script=script, write=write)
+
+
+def report_files(files, write=False, jobs=1, checker=None):
+    """
+    Check (and fix if write) the headers of files, a list of tuples with the filename and script or not,
+    using jobs worker processes
+
+    Generates the reports (see HeaderChecker.report) as soon as they are available, in the order of files
+    """
+    if checker is None:
+        checker = HeaderChecker()
+
+    if jobs <= 1 or len(files) <= 1:
+        for filename, script in files:
+            yield _report_file(filename, script, write, checker=checker)
     else:
-        orig_header = header
+        yield from _report_files_parallel(files, write, jobs, checker)
+
+    if checker.digests is not None and checker.digests.changed:
+        checker.digests.save()
+
+
+def check_files(files, write=False, jobs=1, checker=None):
+    """
+    Check (and fix if write) the headers of files, see report_files
 
-    # generate header like it should be
-    gen_header = gen_license_header(license_name, **data)
+    Generates the results as tuples with filename, changed (None on error)
+    and error message (None if no error), in the order of files
+    """
+    for report in report_files(files, write=write, jobs=jobs, checker=checker):
+        yield report["file"], report["changed"], report["error"]
 
-    # force encoding?
-    reg_enc = ENCODING_REGEXP.search(header)
-    if reg_enc:
-        enc_line = reg_enc.group(1) + "\n"  # matches full line, but not newline
-        gen_header = enc_line + gen_header
 
-    # compose header like it should be, incl. shebang
-    if shebang:
-        new_header = shebang + "\n" + gen_header
+def _report_files_parallel(files, write, jobs, checker):
+    """
+    Check the headers of files with jobs worker processes, see report_files
+    The digests of checker are only used in this (parent) process.
+    """
+    digests = checker.digests
+    todo = files
+    if digests is not None:
+        todo = [
+            (fn, script)
+            for fn, script in files
+            if not digests.unchanged(fn, checker.digest_inputs(script), checker.header_digest)
+        ]
+
+    results = iter([])
+    pool = None
+    if todo:
+        # determine the project details once, instead of in every worker
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(checker.project,))
+        filenames, scripts = zip(*todo)
+        chunksize = max(1, len(todo) // (jobs * 4))
+        results = pool.map(_report_file, filenames, scripts, [write] * len(todo), chunksize=chunksize)
+
+    try:
+        todo = set(todo)
+        for filename, script in files:
+            if (filename, script) not in todo:
+                # known correct header
+                yield checker.report(filename, script=script, write=write)
+                continue
+
+            report = next(results)
+            if digests is not None and report["changed"] is False:
+                digests.add(filename, checker.digest_inputs(script), checker.digest_header(report))
+            yield report
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def changed_files(base_dir, ref):
+    """
+    Return set of files (relative to base_dir) that were changed since git ref
+    (incl. uncommitted changes and untracked files)
+    """
+    res = set()
+    for cmd in (["diff", "--name-only", "--relative", ref, "--"], ["ls-files", "--others", "--exclude-standard"]):
+        out = subprocess.check_output(["git", *cmd], cwd=base_dir, universal_newlines=True)
+        res.update(os.path.normpath(line) for line in out.splitlines() if line)
+    return res
+
+
+def sdist_member_script(name):
+    """
+    Determine if member name of an sdist tarball (see vsc_sdist) is a script or a package file
+
+    Return True for scripts (in the bin dir), False for python files in the lib dir
+    and None for other files (which have no header to check)
+    """
+    # strip the top level directory name-version
+    parts = name.split("/")[1:]
+    if len(parts) == 2 and parts[0] == "bin" and not parts[1].startswith("."):
+        return True
+    if len(parts) > 1 and parts[0] == DEFAULT_LIB_DIR and parts[-1].endswith(".py"):
+        return False
+    return None
+
+
+def report_sdist(tarball, checker=None):
+    """
+    Check the headers of the package files and scripts in sdist tarball (see vsc_sdist and vsc_sdist_rpm)
+
+    The tarball is read sequentially (and not extracted), only up to the end of the header of each member.
+
+    Generates the reports (see HeaderChecker.report_member), in the order of the members in the tarball
+    """
+    if checker is None:
+        checker = HeaderChecker()
+
+    with tarfile.open(tarball, "r|*") as tar:
+        for member in tar:
+            script = sdist_member_script(member.name) if member.isfile() else None
+            if script is None:
+                continue
+            fh = tar.extractfile(member)
+            yield checker.report_member(member.name, fh, script=script)
+
+
+def main(args=None):
+    """
+    Main function: check (and fix) the headers of the given files or of all files in the repo
+
+    Return the exitcode: 0 if all headers are as expected (or were fixed), 1 if not (or on errors)
+    """
+    parser = argparse.ArgumentParser(prog="python -m vsc.install.headers", description=__doc__.split("\n")[1])
+    parser.add_argument("files", nargs="*", help="files to fix (the optional last argument 1 or 0 is script or not)")
+    parser.add_argument("--repo", action="store_true", help="all files in the packages and all scripts of the repo")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--check", action="store_true", help="only check the headers (default with --repo)")
+    mode.add_argument("--fix", action="store_true", help="fix the headers (default for files)")
+    parser.add_argument("--sdist", metavar="TARBALL", help="check the files in sdist TARBALL (without extracting)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="number of processes (default: %(default)s)")
+    parser.add_argument("--changed-since", metavar="REF", help="with --repo, only files changed since git REF")
+    parser.add_argument("--json", action="store_true", help="report the result of every file as a line of JSON")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="skip files with a known correct header (default when the vsc-install cache is enabled)",
+    )
+    opts = parser.parse_args(args)
+
+    threshold = None
+    if opts.json:
+        # only JSON on stdout
+        threshold = log.set_threshold(log.WARN)
+
+    try:
+        return _main(parser, opts)
+    finally:
+        if threshold is not None:
+            log.set_threshold(threshold)
+
+
+def _main(parser, opts):
+    """Check (and fix) the headers of the files selected with the parsed options opts, return the exitcode"""
+    setup = vsc_setup()
+    checker = HeaderChecker(setup=setup)
+    if opts.cache or setup.cache is not None:
+        checker.digests = HeaderDigests(os.path.join(setup.cache_dir(), "headers.json"))
+
+    if opts.sdist:
+        if opts.repo or opts.files or opts.changed_since or opts.fix:
+            parser.error("--sdist takes no files and can not fix")
+        reports = report_sdist(opts.sdist, checker=checker)
+        write = False
+    elif opts.repo:
+        if opts.files:
+            parser.error("--repo takes no files")
+        files = repo_files(setup)
+        if opts.changed_since:
+            changed = changed_files(setup.REPO_BASE_DIR, opts.changed_since)
+            files = [(fn, script) for fn, script in files if os.path.normpath(fn) in changed]
+        files = [(os.path.join(setup.REPO_BASE_DIR, fn), script) for fn, script in files]
+        write = opts.fix
+        reports = report_files(files, write=write, jobs=opts.jobs, checker=checker)
     else:
-        new_header = gen_header
+        if opts.changed_since:
+            parser.error("--changed-since requires --repo")
+        is_script = False
+        if opts.files and opts.files[-1] in ("0", "1"):
+            is_script = opts.files.pop(-1) == "1"
+        files = [(fn, is_script) for fn in opts.files]
+        write = not opts.check
+        reports = report_files(files, write=write, jobs=opts.jobs, checker=checker)
+
+    counts = _report(reports, write, opts)
+    if counts["error"] or (counts["changed"] and not write):
+        return 1
+    return 0
+
+
+def _report(reports, write, opts):
+    """Report about the header reports (see HeaderChecker.report) for the main function, return the counts"""
+    counts = {"changed": 0, "unchanged": 0, "error": 0}
+    for report in reports:
+        filename = report["file"]
+        if report["error"] is not None:
+            counts["error"] += 1
+            if not opts.json:
+                log.error("Failed to check header of %s: %s", filename, report["error"])
+        elif report["changed"]:
+            counts["changed"] += 1
+            if not opts.json:
+                print(f"{'fixed' if write else 'different'} header: {filename}")
+        else:
+            counts["unchanged"] += 1
 
-    if orig_header != new_header:
-        log.info("Diff orig_header vs new_header for %s\n", filename + "".join(nicediff(orig_header, new_header)))
-        changed = True
+        if opts.json:
+            print(json.dumps(report), flush=True)
 
-    if write and changed:
-        log.info("write enabled and different header. Going to modify file %s", filename)
-        wholetext = Path(filename).read_text(encoding="utf8")
-        _write(filename, new_header + wholetext[header_end_pos:])
+    if not opts.json:
+        print(", ".join(f"{cnt} {key}" for key, cnt in counts.items()))
 
-    # return different or not
-    return changed
+    return counts
 
 
 # mapping of the github organization to the details
@@ -306,6 +973,9 @@ institute_details = {
     },
 }
 
+# the registry of license headers used by gen_license_header
+LICENSE_HEADERS = LicenseHeaders()
+
 #
 # Only template headers below
 #
@@ -380,15 +1050,4 @@ ARR_TEMPLATE = """#
 """
 
 if __name__ == "__main__":
-    args = sys.argv[1:]
-    try:
-        is_script = int(args[-1]) == 1
-    except (IndexError, ValueError):
-        is_script = False
-
-    if is_script:
-        args.pop(-1)
-
-    for fn in args:
-        log.info(f"Going to check_header for file {fn} (is_script={is_script})")
-        check_header(fn, script=is_script, write=True)
+    sys.exit(main())
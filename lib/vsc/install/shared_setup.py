@@ -33,14 +33,19 @@ Shared module for vsc software setup
 import sys
 import glob
 import hashlib
+import importlib
+import collections
 import inspect
 import json
 import os
 import shutil
 import traceback
 import re
+import zlib
 import builtins
 
+from concurrent.futures import ThreadPoolExecutor
+
 MAX_SETUPTOOLS_VERSION_INFINITE = "72.0"  # current limit due to removal of test command
 MAX_SETUPTOOLS_VERSION_PY312 = "70.0"
 MAX_SETUPTOOLS_VERSION_PY39 = "54.0"  # el9 ships 53.X
@@ -73,6 +78,7 @@ import setuptools.dist  # noqa:E402
 import setuptools.command.test  # noqa:E402
 
 from distutils import log  # also for setuptools # noqa:E402
+from distutils.errors import DistutilsError, DistutilsOptionError  # noqa:E402
 
 from pathlib import Path  # noqa:E402
 
@@ -117,9 +123,15 @@ if not hasattr(builtins, "__test_filter"):
             "module": None,
             "function": None,
             "allowmods": [],
+            "shard": None,
+            "shard_bins": {},
         },
     )
 
+# timing records of the tests, test module imports and setups (see VscTestCommand test-timing option)
+if not hasattr(builtins, "__test_timing"):
+    setattr(builtins, "__test_timing", {"enabled": False, "records": []})
+
 # Keep this for legacy reasons, setuptools didn't used to be a requirement
 has_setuptools = True
 
@@ -191,8 +203,23 @@ REGEXP_REMOVE_SUFFIX = re.compile(r"(\.(?:py|sh|pl))$")
 # if we ever want to install the package elsewhere.
 EXTRA_SDIST_FILES = ["setup.py"]
 
+# environment variable to set the number of threads used to scan the repository tree
+#    (listing directories concurrently helps on network filesystems like NFS or GPFS)
+VSC_INSTALL_DISCOVERY_WORKERS = "VSC_INSTALL_DISCOVERY_WORKERS"
+# environment variable to select how the files of the repository are discovered
+#    walk: scan the lib and bin directories (default)
+#    git: use the files tracked in the git index (falls back to walk when there is no git index, e.g. in an sdist)
+VSC_INSTALL_DISCOVERY = "VSC_INSTALL_DISCOVERY"
+DISCOVERY_WALK = "walk"
+DISCOVERY_GIT = "git"
+# environment variable to enable the persistent discovery cache (set to 1),
+#    which is shared by the setup.py invocations (e.g. egg_info, test, install in one tox run)
+VSC_INSTALL_CACHE = "VSC_INSTALL_CACHE"
+
 # Put unittests under this directory
 DEFAULT_TEST_SUITE = "test"
+# default seconds to wait for a shared test queue to be filled, or for all its results
+TEST_QUEUE_TIMEOUT = 3600
 DEFAULT_LIB_DIR = "lib"
 
 URL_GH_HPCUGENT = "https://github.com/hpcugent/%(name)s"
@@ -318,6 +345,374 @@ def _read(source, read_lines=False):
     return text
 
 
+def scan_dir(path):
+    """
+    List the directory path using os.scandir, reusing the file type information of the entries
+
+    Returns tuple with sorted list of subdirectory names, sorted list of other names
+    and list of subdirectory names that are symlinks
+    """
+    dirs, files, links = [], [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                dirs.append(entry.name)
+                if entry.is_symlink():
+                    links.append(entry.name)
+            else:
+                files.append(entry.name)
+    return sorted(dirs), sorted(files), links
+
+
+def scan_tree(top, prune=None, workers=1):
+    """
+    os.walk-like generator based on os.scandir, yields (root, dirs, files) tuples top-down (breadth first)
+
+    prune is an optional function with arguments root and directory name,
+        subdirectories for which it returns True are not reported nor descended into
+        (like with os.walk, the yielded dirs list can also be modified in-place)
+    workers is the number of threads used to list directories concurrently,
+        the tuples are yielded in the same order as with a single worker
+
+    Symlinks to directories are reported, but not descended into.
+    """
+
+    def listing(path):
+        """scan_dir that logs and ignores errors, like os.walk does"""
+        try:
+            return scan_dir(path)
+        except OSError as err:
+            log.warn("scan_tree failed to list %s: %s", path, err)
+            return None
+
+    executor = None
+    if workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(path):
+        """Start listing path in the threadpool (if any)"""
+        if executor is None:
+            return path, None
+        return path, executor.submit(listing, path)
+
+    try:
+        queue = collections.deque([submit(top)])
+        while queue:
+            root, future = queue.popleft()
+            found = listing(root) if future is None else future.result()
+            if found is None:
+                continue
+
+            dirs, files, links = found
+            if prune is not None:
+                dirs = [name for name in dirs if not prune(root, name)]
+
+            yield root, dirs, files
+
+            queue.extend(submit(os.path.join(root, name)) for name in dirs if name not in links)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class GitIgnore:
+    """
+    Compiled gitignore rules of a repository, including nested .gitignore files (loaded on demand)
+
+    Supports comments, escapes, negation (!), anchored patterns (with a /), directory patterns (trailing /),
+    the *, ? and [...] wildcards and **.
+    Paths are relative to the base directory, and use / as separator.
+    """
+
+    def __init__(self, base_dir):
+        """Load the .gitignore in base_dir"""
+        self.base_dir = base_dir
+        # gitignore filename -> mtime, to check if this instance is still up-to-date
+        self.signature = {}
+        # relative directory -> list of (compiled regex, negate, dir_only, anchored) tuples
+        self._rules = {}
+        # relative directory -> ignored or not
+        self._ignored_dirs = {}
+
+        self.lines = []
+        gitignore = os.path.join(base_dir, ".gitignore")
+        if os.path.isfile(gitignore):
+            self.lines = [line.strip() for line in _read(gitignore, read_lines=True)]
+            self.lines = [line for line in self.lines if line and not line.startswith("#")]
+
+    @staticmethod
+    def translate(pattern):
+        """Translate the gitignore glob pattern (without leading/trailing /) into a regex"""
+        res = []
+        idx = 0
+        while idx < len(pattern):
+            char = pattern[idx]
+            if pattern.startswith("**/", idx) and (idx == 0 or pattern[idx - 1] == "/"):
+                # leading or middle **/: zero or more directories
+                res.append("(?:.*/)?")
+                idx += 3
+                continue
+            elif pattern.startswith("**", idx) and idx + 2 == len(pattern) and (idx == 0 or pattern[idx - 1] == "/"):
+                # trailing /**: everything inside
+                res.append(".*")
+                idx += 2
+                continue
+            elif char == "*":
+                res.append("[^/]*")
+            elif char == "?":
+                res.append("[^/]")
+            elif char == "[":
+                end = pattern.find("]", idx + 2)
+                if end < 0:
+                    res.append(re.escape(char))
+                else:
+                    chars = pattern[idx + 1 : end]
+                    if chars[0] == "!":
+                        chars = "^" + chars[1:]
+                    res.append(f"[{chars}]")
+                    idx = end
+            elif char == "\\" and idx + 1 < len(pattern):
+                idx += 1
+                res.append(re.escape(pattern[idx]))
+            else:
+                res.append(re.escape(char))
+            idx += 1
+        return "".join(res)
+
+    @staticmethod
+    def parse(lines):
+        """Parse the lines of a .gitignore file, return list of (compiled regex, negate, dir_only, anchored) tuples"""
+        rules = []
+        for line in lines:
+            # trailing spaces are ignored unless escaped
+            line = re.sub(r"(?<!\\)\s+$", "", line)
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate or line.startswith("\\!") or line.startswith("\\#"):
+                line = line[1:]
+
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            # a pattern with a separator at the beginning or in the middle is relative to the .gitignore location
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+
+            regex = re.compile(GitIgnore.translate(line) + r"\Z", re.S)
+            rules.append((regex, negate, dir_only, anchored))
+        return rules
+
+    def rules(self, reldir):
+        """Return the rules of the .gitignore in directory reldir (relative to base_dir, '' for base_dir)"""
+        if reldir not in self._rules:
+            gitignore = os.path.join(self.base_dir, reldir, ".gitignore")
+            try:
+                self.signature[gitignore] = os.stat(gitignore).st_mtime_ns
+                self._rules[reldir] = self.parse(_read(gitignore, read_lines=True))
+            except OSError:
+                self.signature[gitignore] = None
+                self._rules[reldir] = []
+        return self._rules[reldir]
+
+    def _match(self, relpath, is_dir):
+        """
+        Check relpath against the rules of the .gitignore files in its parent directories (not the parents themselves)
+        is_dir is either a boolean or a function returning if relpath is a directory
+        Returns True (ignored), False (negated) or None (no match)
+        """
+        parts = relpath.split("/")
+        # the deepest .gitignore takes precedence
+        for depth in range(len(parts) - 1, -1, -1):
+            subpath = "/".join(parts[depth:])
+            for regex, negate, dir_only, anchored in reversed(self.rules("/".join(parts[:depth]))):
+                if not regex.match(subpath if anchored else parts[-1]):
+                    continue
+                if dir_only:
+                    if callable(is_dir):
+                        is_dir = is_dir()
+                    if not is_dir:
+                        continue
+                # last matching rule wins
+                return not negate
+        return None
+
+    def is_ignored(self, relpath, is_dir=None):
+        """
+        Check if relpath is ignored (also when one of its parent directories is ignored)
+
+        is_dir indicates if relpath is a directory; if None, it is only checked (on disk) when needed.
+        Paths outside base_dir are never ignored.
+        """
+        relpath = relpath.replace(os.path.sep, "/").strip("/")
+        if relpath in ("", ".") or relpath == ".." or relpath.startswith("../"):
+            return False
+
+        parent = relpath.rpartition("/")[0]
+        if parent and self.is_ignored_dir(parent):
+            return True
+
+        if is_dir is None:
+            is_dir = lambda: os.path.isdir(os.path.join(self.base_dir, relpath))
+        return bool(self._match(relpath, is_dir))
+
+    def is_ignored_dir(self, reldir):
+        """Memoized is_ignored for directories"""
+        if reldir not in self._ignored_dirs:
+            self._ignored_dirs[reldir] = self.is_ignored(reldir, is_dir=True)
+        return self._ignored_dirs[reldir]
+
+
+# compiled gitignore rules per repository base directory
+_GITIGNORES = {}
+
+
+def get_gitignore(base_dir):
+    """Return the (cached) GitIgnore instance for base_dir, recompiled if any of its .gitignore files changed"""
+    key = os.path.abspath(base_dir)
+    gitignore = _GITIGNORES.get(key)
+    if gitignore is None or _fvs("get_gitignore").tree_changed(gitignore.signature):
+        gitignore = GitIgnore(base_dir)
+        gitignore.rules("")
+        _GITIGNORES[key] = gitignore
+    return gitignore
+
+
+def git_index_path(repo_dir):
+    """Return the path of the git index of the repository in repo_dir (None if there is none)"""
+    git_dir = os.path.join(repo_dir, ".git")
+    if os.path.isfile(git_dir):
+        # worktrees and submodules have a .git file pointing to the actual git directory
+        reg = re.search(r"^gitdir:\s*(.*?)\s*$", _read(git_dir), re.M)
+        if not reg:
+            return None
+        git_dir = os.path.join(repo_dir, reg.group(1))
+
+    index = os.path.join(git_dir, "index")
+    if os.path.isfile(index):
+        return index
+    return None
+
+
+def git_index_files(index):
+    """
+    Return the sorted list of paths (relative to the repository, / separated) tracked in the git index file index,
+    see vsc.install.gitindex (which is only imported when needed)
+    """
+    from vsc.install.gitindex import git_index_files as read_git_index
+
+    return read_git_index(index)
+
+
+class JsonCache:
+    """
+    Persistent data (a dict) stored as JSON in filename, only read on first use
+
+    A missing or unreadable file is an empty cache (see empty), and so is data that is not valid (see valid).
+    Subclasses describe what is cached with DESCRIPTION (used in the log messages).
+    """
+
+    DESCRIPTION = "cache"
+    # indent of the JSON file (None is compact)
+    INDENT = None
+
+    def __init__(self, filename):
+        """Cache stored in filename (only read on first use)"""
+        self.filename = filename
+        self._data = None
+        # the data was modified since it was read or saved (set by the subclass that modifies it)
+        self.changed = False
+
+    @staticmethod
+    def empty():
+        """Return the data of an empty cache"""
+        return {}
+
+    @staticmethod
+    def valid(data):
+        """Check if the data read from filename can be used"""
+        return isinstance(data, dict)
+
+    @property
+    def data(self):
+        """The cached data, read from filename (empty when it is missing, unreadable or not valid)"""
+        if self._data is None:
+            self._data = self.empty()
+            try:
+                data = json.loads(_read(self.filename))
+            except (OSError, ValueError) as err:
+                if os.path.exists(self.filename):
+                    log.warn("Ignoring unreadable %s %s: %s", self.DESCRIPTION, self.filename, err)
+            else:
+                if self.valid(data):
+                    self._data = data
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        """Replace the cached data (write it with save)"""
+        self._data = value
+        self.changed = True
+
+    def save(self):
+        """Write the cache, atomically (a failure to write is not fatal)"""
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(tmp, "w", encoding="utf8") as fh:
+                # str of anything else, e.g. the pathlib paths of recent prospector versions
+                json.dump(self.data, fh, indent=self.INDENT, sort_keys=True, default=str)
+            os.replace(tmp, self.filename)
+            self.changed = False
+        except OSError as err:
+            log.warn("Failed to write %s %s: %s", self.DESCRIPTION, self.filename, err)
+
+
+class DiscoveryCache(JsonCache):
+    """
+    Persistent cache of discovery results (stored as JSON in filename)
+
+    Each entry has a section, a key and a signature (the mtimes of the files and directories
+    the result depends on, and the digests of small files like LICENSE, see vsc_setup.tree_signature);
+    an entry is only used when the key matches and the signature is still valid.
+    A cache of another vsc-install version is not used.
+    """
+
+    DESCRIPTION = "discovery cache"
+
+    @staticmethod
+    def empty():
+        """Return the data of an empty cache of this version"""
+        return {"version": VERSION}
+
+    @staticmethod
+    def valid(data):
+        """Check if the data read from filename is of this version"""
+        return isinstance(data, dict) and data.get("version") == VERSION
+
+    def get(self, section, key):
+        """
+        Return cached entry (dict with signature and value) of key in section
+        (None if not cached or no longer valid)
+        """
+        entry = self.data.get(section, {}).get(json.dumps(key))
+        if entry is None or _fvs("DiscoveryCache").tree_changed(entry["signature"]):
+            return None
+        log.info("Using cached %s from %s", section, self.filename)
+        return entry
+
+    def set(self, section, key, signature, value):
+        """Cache value of key in section, valid as long as signature does not change"""
+        self.data.setdefault(section, {})[json.dumps(key)] = {"signature": signature, "value": value}
+        self.save()
+
+
 # for sufficiently recent version of setuptools, we can hijack the 'get_egg_cache_dir' method
 # to control the .eggs directory being used
 if hasattr(setuptools.dist.Distribution, "get_egg_cache_dir"):
@@ -426,9 +821,35 @@ class vsc_setup:
         self.REPO_SCRIPTS_DIR = os.path.join(self.REPO_BASE_DIR, "bin")
         self.REPO_TEST_DIR = os.path.join(self.REPO_BASE_DIR, DEFAULT_TEST_SUITE)
 
-        self.package_files = self.files_in_packages()
+        self.discovery_workers = int(os.environ.get(VSC_INSTALL_DISCOVERY_WORKERS, 1))
+        self.discovery = os.environ.get(VSC_INSTALL_DISCOVERY, DISCOVERY_WALK)
+        if self.discovery not in (DISCOVERY_WALK, DISCOVERY_GIT):
+            raise ValueError(f"Unknown {VSC_INSTALL_DISCOVERY} value {self.discovery}")
+
+        # package index is built on first use, see files_in_packages
+        self._package_files = None
+        self._package_index = {}
+
+        self.cache = None
+        if os.environ.get(VSC_INSTALL_CACHE, "0") not in ("", "0"):
+            self.cache = DiscoveryCache(os.path.join(self.cache_dir(), "discovery.json"))
         self.private_repo = False
 
+    @property
+    def package_files(self):
+        """
+        The package/module index of this repository, as returned by files_in_packages.
+        Unless it is set explicitly (e.g. by prepare_rpm), it is (re)built lazily.
+        """
+        if self._package_files is None:
+            return self.files_in_packages()
+        return self._package_files
+
+    @package_files.setter
+    def package_files(self, value):
+        """Pin the package/module index (None to fall back to files_in_packages)"""
+        self._package_files = value
+
     @staticmethod
     def release_on_pypi(lic):
         """Given license lic, can/will we release on PyPI"""
@@ -454,6 +875,26 @@ class vsc_setup:
         if not os.path.isfile(filename):
             raise ValueError(f"cannot find file {filename} to get name from")
 
+        cache_key = [os.path.abspath(filename), version, license_name]
+        if self.cache is not None:
+            cached = self.cache.get("get_name_url", cache_key)
+            if cached is not None:
+                self.private_repo |= cached["value"]["private_repo"]
+                return cached["value"]["name_url"]
+
+        # also cache whether this repository is private
+        private_repo = self.private_repo
+        self.private_repo = False
+        keepers = self._get_name_url(filename, version, license_name)
+        if self.cache is not None:
+            value = {"name_url": keepers, "private_repo": self.private_repo}
+            signature = _fvs("get_name_url").tree_signature([filename], digests=[filename])
+            self.cache.set("get_name_url", cache_key, signature, value)
+        self.private_repo |= private_repo
+        return keepers
+
+    def _get_name_url(self, filename, version, license_name):
+        """Determine name and url from filename, see get_name_url"""
         txt = _read(filename)
 
         # First ones are from PKG-INFO
@@ -529,42 +970,48 @@ class vsc_setup:
             log.info("get_name_url returns %s", keepers)
             return keepers
 
-    def rel_gitignore(self, paths, base_dir=None):
+    def gitignore(self, base_dir=None):
         """
-        A list of paths, return list of relative paths to REPO_BASE_DIR,
-        filter with primitive gitignore
-        This raises an error when there is a .git directory but no .gitignore
+        Return the compiled gitignore rules (a GitIgnore instance) of base_dir (None if there is no .gitignore)
+        This raises an error when there is a .git directory but no .gitignore,
+        or when the .gitignore lacks some mandatory patterns
         """
         if not base_dir:
             base_dir = self.REPO_BASE_DIR
 
-        res = [os.path.relpath(p, base_dir) for p in paths]
-
-        # primitive gitignore
-        gitignore = os.path.join(base_dir, ".gitignore")
-        if os.path.isfile(gitignore):
-            all_patterns = [
-                line
-                for line in [line.strip() for line in _read(gitignore, read_lines=True)]
-                if line and not line.startswith("#")
-            ]
-
-            patterns = [line.replace("*", ".*") for line in all_patterns if line.startswith("*")]
-            reg = re.compile("^(" + "|".join(patterns) + ")$")
+        if os.path.isfile(os.path.join(base_dir, ".gitignore")):
+            gitignore = get_gitignore(base_dir)
 
             # check if we at least filter out .pyc files, since we're in a python project
-            if not all([reg.search(text) for text in [f"bla{pattern}" for pattern in GITIGNORE_PATTERNS]]):
+            if not all(gitignore.is_ignored(f"bla{pattern}", is_dir=False) for pattern in GITIGNORE_PATTERNS):
                 raise ValueError(f"{base_dir}/.gitignore does not contain these patterns: {GITIGNORE_PATTERNS}")
 
-            if not all(line in all_patterns for line in GITIGNORE_EXACT_PATTERNS):
+            if not all(line in gitignore.lines for line in GITIGNORE_EXACT_PATTERNS):
                 raise ValueError(
                     f"{base_dir}/.gitignore does not contain all following patterns: {GITIGNORE_EXACT_PATTERNS}"
                 )
 
-            res = [f for f in res if not reg.search(f)]
+            return gitignore
 
         elif os.path.isdir(os.path.join(base_dir, ".git")):
             raise ValueError(f"No .gitignore in git repo: {base_dir}")
+        return None
+
+    def rel_gitignore(self, paths, base_dir=None):
+        """
+        A list of paths, return list of relative paths to REPO_BASE_DIR,
+        filter with the gitignore rules
+        This raises an error when there is a .git directory but no .gitignore
+        """
+        if not base_dir:
+            base_dir = self.REPO_BASE_DIR
+
+        res = [os.path.relpath(p, base_dir) for p in paths]
+
+        gitignore = self.gitignore(base_dir=base_dir)
+        if gitignore is not None:
+            res = [f for f in res if not gitignore.is_ignored(f)]
+
         return res
 
     def files_in_packages(self, excluded_pkgs=None):
@@ -575,6 +1022,10 @@ class vsc_setup:
         If a directory exists matching a package but with no __init__.py,
         it is ignored unless the package (not the path!) is in the excluded_pkgs list
 
+        The result is memoized per REPO_LIB_DIR and excluded_pkgs, and is only rebuilt
+        when files or directories were added to or removed from the lib/ tree.
+        Do not modify the returned dict.
+
         Return dict  with key
             packages: a dict with key the package and value all files in the package directory
             modules: dict with key non=package module name and value the filename
@@ -582,32 +1033,184 @@ class vsc_setup:
         if excluded_pkgs is None:
             excluded_pkgs = []
 
+        key = (self.REPO_LIB_DIR, tuple(sorted(excluded_pkgs)))
+        cached = self._package_index.get(key)
+        if cached is not None and not _fvs("files_in_packages").tree_changed(cached[0]):
+            return cached[1]
+
+        cache_key = [self.discovery, self.REPO_BASE_DIR] + list(key)
+        cached = self.cache.get("files_in_packages", cache_key) if self.cache is not None else None
+        if cached is not None:
+            signature, res = cached["signature"], cached["value"]
+        else:
+            index = self.git_index()
+            if index is None:
+                signature, res = self._walk_packages(excluded_pkgs)
+            else:
+                signature, res = self._index_packages(index, excluded_pkgs)
+            if self.cache is not None:
+                self.cache.set("files_in_packages", cache_key, signature, res)
+
+        self._package_index[key] = (signature, res)
+        return res
+
+    def cache_dir(self):
+        """
+        Directory for the persistent caches of vsc-install,
+        in the Python version specific .eggs directory (which is ignored by git)
+        """
+        return os.path.join(self.REPO_BASE_DIR, f".eggs.py{sys.version_info[0]}{sys.version_info[1]}", "vsc-install")
+
+    def git_index(self):
+        """
+        Return the git index file to discover the repository files with (None to scan the filesystem instead)
+        """
+        if self.discovery != DISCOVERY_GIT:
+            return None
+
+        index = git_index_path(self.REPO_BASE_DIR)
+        if index is None:
+            # e.g. in an sdist, with PKG-INFO and without .git
+            log.info("No git index found in %s, scanning the filesystem instead", self.REPO_BASE_DIR)
+            return None
+
+        try:
+            importlib.import_module("vsc.install.gitindex")
+        except ImportError:
+            # e.g. the self-contained setup.py of vsc-install itself
+            log.info("No vsc.install.gitindex to read git index %s, scanning the filesystem instead", index)
+            return None
+        return index
+
+    def _index_packages(self, index, excluded_pkgs):
+        """
+        Build the files_in_packages result from the files tracked in the git index
+        (so there is no need to check the gitignore rules)
+
+        Returns tuple with the signature of the index file and the result
+        """
+        res = {"packages": {}, "modules": {}}
+
+        lib_dir = os.path.relpath(self.REPO_LIB_DIR, self.REPO_BASE_DIR).replace(os.path.sep, "/")
+        # relative directory -> tracked files in that directory
+        dirs = {lib_dir: []}
+        for path in git_index_files(index):
+            reldir, _, name = path.rpartition("/")
+            if not (reldir + "/").startswith(lib_dir + "/"):
+                continue
+            dirs.setdefault(reldir, []).append(name)
+            # register intermediate directories (without files) too
+            while reldir != lib_dir:
+                reldir = reldir.rpartition("/")[0]
+                if reldir in dirs:
+                    break
+                dirs[reldir] = []
+
+        for reldir in sorted(dirs):
+            root = os.path.join(self.REPO_BASE_DIR, *reldir.split("/"))
+            package = ".".join(reldir.split("/")[len(lib_dir.split("/")) :])
+            files = dirs[reldir]
+            if "__init__.py" in files or package in excluded_pkgs:
+                rel_root = os.path.join(*reldir.split("/"))
+                self._add_package(res, package, root, [os.path.join(rel_root, f) for f in files])
+
+        return _fvs("_index_packages").tree_signature([index]), res
+
+    def _add_package(self, res, package, root, rel_files):
+        """
+        Add package in directory root, with the rel_files (relative to REPO_BASE_DIR),
+        and its modules to the files_in_packages result res
+        """
+        # Force vsc shared packages/namespace
+        if "__init__.py" in [os.path.basename(f) for f in rel_files] and (
+            package == "vsc" or package.startswith("vsc.")
+        ):
+            init = _read(os.path.join(root, "__init__.py"))
+            if not re.search(r"^import\s+pkg_resources\n{1,3}pkg_resources.declare_namespace\(__name__\)$", init, re.M):
+                raise ValueError(
+                    f"vsc namespace packages do not allow non-shared namespace in dir {root}."
+                    "Fix with pkg_resources.declare_namespace"
+                )
+
+        res["packages"][package] = rel_files
+
+        # this is a package, all .py files are modules
+        for mod_fn in rel_files:
+            if not mod_fn.endswith(".py") or mod_fn.endswith("__init__.py"):
+                continue
+            modname = os.path.basename(mod_fn)[: -len(".py")]
+            res["modules"][f"{package}.{modname}"] = mod_fn
+
+    @staticmethod
+    def tree_signature(paths, digests=()):
+        """
+        Return dict with the mtime (in ns) of each of the paths (None if it does not exist);
+        for the (small) files in digests, the value is a list with the mtime and the sha256 digest of the file
+        """
+        signature = {}
+        for path in paths:
+            try:
+                signature[path] = os.stat(path).st_mtime_ns
+                if path in digests:
+                    signature[path] = [signature[path], hashlib.sha256(Path(path).read_bytes()).hexdigest()]
+            except OSError:
+                signature[path] = None
+        return signature
+
+    @staticmethod
+    def tree_changed(signature):
+        """
+        Check if any of the directories or files in signature (from tree_signature) was modified
+        The mtimes are checked first, the digests of files with unmodified mtimes are checked too
+        (e.g. a file that is rewritten within the mtime resolution, or copied with its mtime).
+        """
+        mtimes = {path: value[0] if isinstance(value, list) else value for path, value in signature.items()}
+        if _fvs("tree_changed").tree_signature(mtimes.keys()) != mtimes:
+            return True
+        digests = [path for path, value in signature.items() if isinstance(value, list)]
+        return _fvs("tree_changed").tree_signature(digests, digests=digests) != {
+            path: signature[path] for path in digests
+        }
+
+    def _walk_packages(self, excluded_pkgs):
+        """
+        Scan REPO_LIB_DIR and build the files_in_packages result
+        Ignored directories are not descended into, ignored files are skipped.
+
+        Returns tuple with the signature of all scanned directories and the result
+        """
         res = {"packages": {}, "modules": {}}
+        walked = [self.REPO_LIB_DIR]
+
+        # only get the gitignore rules when they are needed
+        gitignore = []
+
+        def ignored(relpath, is_dir):
+            """Check relpath (relative to REPO_BASE_DIR) against the gitignore rules"""
+            if not gitignore:
+                gitignore.append(self.gitignore())
+            return gitignore[0] is not None and gitignore[0].is_ignored(relpath, is_dir=is_dir)
+
+        def prune(root, name):
+            """Skip ignored subdirectories"""
+            return ignored(os.path.relpath(os.path.join(root, name), self.REPO_BASE_DIR), True)
+
         offset = len(self.REPO_LIB_DIR.split(os.path.sep))
-        for root, _, files in os.walk(self.REPO_LIB_DIR):
+
+        for root, dirs, files in scan_tree(self.REPO_LIB_DIR, prune=prune, workers=self.discovery_workers):
+            walked.extend(os.path.join(root, d) for d in dirs)
             package = ".".join(root.split(os.path.sep)[offset:])
             if "__init__.py" in files or package in excluded_pkgs:
-                # Force vsc shared packages/namespace
-                if "__init__.py" in files and (package == "vsc" or package.startswith("vsc.")):
-                    init = _read(os.path.join(root, "__init__.py"))
-                    if not re.search(
-                        r"^import\s+pkg_resources\n{1,3}pkg_resources.declare_namespace\(__name__\)$", init, re.M
-                    ):
-                        raise ValueError(
-                            f"vsc namespace packages do not allow non-shared namespace in dir {root}."
-                            "Fix with pkg_resources.declare_namespace"
-                        )
-
-                res["packages"][package] = self.rel_gitignore([os.path.join(root, f) for f in files])
-
-                # this is a package, all .py files are modules
-                for mod_fn in res["packages"][package]:
-                    if not mod_fn.endswith(".py") or mod_fn.endswith("__init__.py"):
-                        continue
-                    modname = os.path.basename(mod_fn)[: -len(".py")]
-                    res["modules"][f"{package}.{modname}"] = mod_fn
+                # relative paths are derived once per directory
+                rel_root = os.path.relpath(root, self.REPO_BASE_DIR)
+                rel_files = [os.path.join(rel_root, f) for f in files]
+                self._add_package(res, package, root, [f for f in rel_files if not ignored(f, False)])
 
-        return res
+        signature = _fvs("_walk_packages").tree_signature(walked)
+        if gitignore and gitignore[0] is not None:
+            # changes to the gitignore rules also change the result
+            signature.update(gitignore[0].signature)
+        return signature, res
 
     @staticmethod
     def find_extra_sdist_files():
@@ -882,6 +1485,30 @@ class vsc_setup:
                     res.addTest(ts)
         return res
 
+    @staticmethod
+    def shard_testsuites(testsuites):
+        """
+        (Recursive) filtering of (suites of) tests on the test shard:
+        tests of the test modules in the shard bins are in the shard of their module,
+        the others are assigned to a shard with a stable hash of their test id
+        """
+        test_filter = getattr(builtins, "__test_filter")
+        index, count = test_filter["shard"]
+
+        res = type(testsuites)()
+
+        for ts in testsuites:
+            # ts is either a test or testsuite of more tests
+            if isinstance(ts, TestSuite):
+                res.addTest(_fvs("shard_testsuites").shard_testsuites(ts))
+            else:
+                shard = test_filter["shard_bins"].get(type(ts).__module__)
+                if shard is None:
+                    shard = zlib.crc32(ts.id().encode("utf8")) % count
+                if shard == index:
+                    res.addTest(ts)
+        return res
+
     class VscScanningLoader(ScanningLoader):
         """The class to look for tests"""
 
@@ -889,6 +1516,24 @@ class vsc_setup:
 
         TEST_LOADER_MODULE = __name__
 
+        def loadTestsFromName(self, name, module=None):
+            """
+            Record the time to import test module name, when timing the tests
+            """
+            timing = getattr(builtins, "__test_timing")
+            if timing["enabled"] and module is None and name not in sys.modules:
+                from vsc.install.testrunner import add_timing_record, resource_usage
+
+                start = resource_usage()
+                try:
+                    __import__(name)
+                except ImportError:
+                    # not a module (e.g. module.function) or a broken one, that is up to the ScanningLoader
+                    pass
+                else:
+                    add_timing_record("import", name, start)
+            return ScanningLoader.loadTestsFromName(self, name, module)
+
         def loadTestsFromModule(self, module, pattern=None):  # pylint: disable=arguments-differ
             """
             Support test module and function name based filtering
@@ -940,6 +1585,10 @@ class vsc_setup:
                             test_filter["allowmods"].append(pm)
                 else:
                     res = type(testsuites)()
+
+            # res is None for a module that was already loaded
+            if test_filter["shard"] is not None and res is not None:
+                res = _fvs("loadTestsFromModule").shard_testsuites(res)
             return res
 
     class VscTestCommand(TestCommand):
@@ -952,10 +1601,22 @@ class vsc_setup:
             ("test-filterf=", "f", "Regex filter on test function names"),
             ("test-filterm=", "F", "Regex filter on test (sub)modules"),
             ("test-xmlrunner=", "X", "use XMLTestRunner with value as output name (e.g. test-reports)"),
+            ("test-jobs=", "j", "Number of forked worker processes to run the test modules in (default: 1)"),
+            ("test-shard=", None, "Only run shard INDEX/COUNT of the tests (INDEX from 1 to COUNT)"),
+            ("test-shard-durations=", None, "JSON file with the test module durations to balance the shards with"),
+            ("test-queue=", None, "Shared directory with a queue of test modules (e.g. to run tests on several nodes)"),
+            ("test-queue-coordinator", None, "Fill the test-queue, and merge the results of all its workers"),
+            ("test-queue-timeout=", None, f"Seconds to wait for the test-queue or its results ({TEST_QUEUE_TIMEOUT})"),
+            ("test-timing=", None, "Report the N slowest tests, test module imports and setups"),
+            ("test-timing-json=", None, "Write the timing of all tests, test module imports and setups to JSON file"),
+            ("test-history", None, "Append the test durations to the test history"),
+            ("test-history-dir=", None, "Directory with the test history (default: .eggs.pyXY/vsc-install)"),
+            ("test-regression=", None, "Report tests that took FACTOR times their median in the test history"),
         ]
 
         # You cannot use the _fvs here, so this cannot be modified by subclassing
         TEST_LOADER = "vsc.install.shared_setup:vsc_setup.VscScanningLoader"
+        TEST_RUNNER_TIMING = "vsc.install.testrunner:TimingTextTestRunner"
 
         def initialize_options(self):
             """
@@ -965,11 +1626,86 @@ class vsc_setup:
             self.test_filterm = None
             self.test_filterf = None
             self.test_xmlrunner = None
+            self.test_jobs = None
+            self.test_shard = None
+            self.test_shard_durations = None
+            self.test_queue = None
+            self.test_queue_coordinator = False
+            self.test_queue_timeout = None
+            self.test_timing = None
+            self.test_timing_json = None
+            self.test_history = False
+            self.test_history_dir = None
+            self.test_regression = None
             self.setupper = _fvs("VscTestCommand initialize_options")()
 
             self.test_loader = self.TEST_LOADER
             log.info(f"test_loader set to {self.test_loader}")
 
+        def finalize_options(self):
+            """
+            Check the number of test jobs, the test queue and the test shard (stored as 0-based index and count)
+            """
+            TestCommand.finalize_options(self)
+            self.test_jobs = self.number_option("test_jobs", int, 1)
+            if self.test_jobs < 1:
+                raise DistutilsOptionError(f"test-jobs must be at least 1, got {self.test_jobs}")
+
+            self.test_queue_timeout = self.number_option("test_queue_timeout", float, TEST_QUEUE_TIMEOUT)
+            if self.test_queue is None and self.test_queue_coordinator:
+                raise DistutilsOptionError("test-queue-coordinator requires test-queue")
+
+            self.test_timing = self.number_option("test_timing", int)
+
+            self.test_regression = self.number_option("test_regression", float)
+            if self.test_regression is not None and self.test_regression <= 1:
+                raise DistutilsOptionError(f"test-regression factor must be larger than 1, got {self.test_regression}")
+
+            if isinstance(self.test_shard, str):
+                reg = re.search(r"^\s*(\d+)\s*/\s*(\d+)\s*$", self.test_shard)
+                if not reg or not 1 <= int(reg.group(1)) <= int(reg.group(2)):
+                    raise DistutilsOptionError(
+                        f"test-shard must be INDEX/COUNT with 1 <= INDEX <= COUNT, got {self.test_shard}"
+                    )
+                self.test_shard = (int(reg.group(1)) - 1, int(reg.group(2)))
+            elif self.test_shard_durations is not None:
+                raise DistutilsOptionError("test-shard-durations requires test-shard")
+
+        def number_option(self, name, convert, default=None):
+            """Return the value of option name converted with convert (e.g. int), default when it is not set"""
+            value = getattr(self, name)
+            if value is None:
+                return default
+            try:
+                return convert(value)
+            except ValueError as err:
+                option = name.replace("_", "-")
+                raise DistutilsOptionError(f"{option} must be a number, got {value}") from err
+
+        def test_shard_bins(self):
+            """
+            Return dict with the shard (0-based) of each test module with a known duration in test_shard_durations,
+            with the longest modules assigned first, each to the shard with the lowest total duration so far.
+            All runs of the shards must use the same durations file, or tests might be skipped or run twice.
+            """
+            if self.test_shard_durations is None:
+                return {}
+
+            try:
+                durations = json.loads(_read(self.test_shard_durations))
+            except (OSError, ValueError) as err:
+                msg = f"Failed to read test durations from {self.test_shard_durations}: {err}"
+                raise DistutilsOptionError(msg) from err
+
+            count = self.test_shard[1]
+            loads = [0.0] * count
+            bins = {}
+            for mname, duration in sorted(durations.items(), key=lambda item: (-item[1], item[0])):
+                shard = loads.index(min(loads))
+                bins[mname] = shard
+                loads[shard] += duration
+            return bins
+
         def reload_modules(self, package, remove_only=False, own_modules=False):
             """
             Cleanup and restore package because we use
@@ -982,12 +1718,15 @@ class vsc_setup:
             If own_modules, only remove modules provided by this "repository"
             """
 
+            if own_modules:
+                own = self.setupper.files_in_packages()["modules"]
+
             def candidate(modulename):
                 """Select candidate modules to reload"""
                 module_in_package = modulename in (package,) or modulename.startswith(package + ".")
 
                 if own_modules:
-                    is_own_module = modulename in self.setupper.files_in_packages()["modules"]
+                    is_own_module = modulename in own
                 else:
                     is_own_module = True
 
@@ -1119,9 +1858,18 @@ class vsc_setup:
             getattr(builtins, "__test_filter").update({
                 "function": self.test_filterf,
                 "module": self.test_filterm,
+                "shard": self.test_shard,
+                "shard_bins": self.test_shard_bins(),
             })
 
+            history = self.test_history or self.test_regression is not None
+            timing = history or self.test_timing is not None or self.test_timing_json is not None
+            getattr(builtins, "__test_timing").update({"enabled": timing, "records": []})
+
             if self.test_xmlrunner is not None:
+                if self.test_jobs > 1 or self.test_queue is not None or timing:
+                    msg = "test-xmlrunner can't be combined with test-jobs, test-queue or test-timing"
+                    raise DistutilsOptionError(msg)
                 if not have_xmlrunner:
                     raise ValueError("test-xmlrunner requires xmlrunner module")
                 self.force_xmlrunner()
@@ -1136,7 +1884,35 @@ class vsc_setup:
                 __import__(DEFAULT_TEST_SUITE)
             self.reload_modules(DEFAULT_TEST_SUITE)
 
-            TestCommand.run_tests(self)
+            if timing and self.test_queue is None and self.test_jobs == 1:
+                if self.test_runner is not None:
+                    raise DistutilsOptionError("test-timing can't be combined with test-runner")
+                self.test_runner = self.TEST_RUNNER_TIMING
+
+            test_run = None
+            if timing or self.test_queue is not None or self.test_jobs > 1:
+                # not part of the self-contained setup.py, only imported when needed
+                from vsc.install.testrunner import VscTestRun
+
+                test_run = VscTestRun(self)
+
+            try:
+                if self.test_queue is not None or self.test_jobs > 1:
+                    if self.test_queue is not None:
+                        result = test_run.run_tests_queue()
+                    else:
+                        result = test_run.run_tests_parallel()
+                    if not result.wasSuccessful():
+                        msg = f"Test failed: {result}"
+                        self.announce(msg, log.ERROR)
+                        raise DistutilsError(msg)
+                else:
+                    TestCommand.run_tests(self)
+            finally:
+                if timing:
+                    test_run.report_test_timing()
+                if history:
+                    test_run.report_test_history()
 
             # cleanup any diretcories created
             for directory in cleanup:
@@ -1191,8 +1967,18 @@ class vsc_setup:
         Supports extra and/or exclude from add_and_remove
         """
         res = []
-        if os.path.isdir(self.REPO_SCRIPTS_DIR):
-            res = self.rel_gitignore(glob.glob(f"{self.REPO_SCRIPTS_DIR}/*"))
+        index = self.git_index()
+        if index is not None:
+            rel_scripts_dir = os.path.relpath(self.REPO_SCRIPTS_DIR, self.REPO_BASE_DIR)
+            prefix = rel_scripts_dir.replace(os.path.sep, "/") + "/"
+            # tracked files and directories directly in the scripts dir
+            names = {path[len(prefix) :].split("/")[0] for path in git_index_files(index) if path.startswith(prefix)}
+            res = [os.path.join(rel_scripts_dir, name) for name in sorted(names) if not name.startswith(".")]
+        elif os.path.isdir(self.REPO_SCRIPTS_DIR):
+            dirs, files, _ = scan_dir(self.REPO_SCRIPTS_DIR)
+            # like glob, skip hidden files
+            names = sorted(name for name in dirs + files if not name.startswith("."))
+            res = self.rel_gitignore([os.path.join(self.REPO_SCRIPTS_DIR, name) for name in names])
         res = _fvs("generate_scripts").add_and_remove(res, extra=extra, exclude=exclude)
         log.info("generated scripts list: %s", res)
         return res
@@ -1413,6 +2199,20 @@ class vsc_setup:
         if not os.path.exists(license_name):
             raise ValueError(f"LICENSE is missing (was looking for {license})")
 
+        if self.cache is not None:
+            cache_key = [os.path.abspath(license_name)]
+            cached = self.cache.get("get_license", cache_key)
+            if cached is not None:
+                return tuple(cached["value"])
+            res = self._get_license(license_name)
+            signature = _fvs("get_license").tree_signature([license_name], digests=[license_name])
+            self.cache.set("get_license", cache_key, signature, res)
+            return res
+
+        return self._get_license(license_name)
+
+    def _get_license(self, license_name):
+        """Determine the license from the license_name file, see get_license"""
         license_md5 = _fvs("get_license").get_md5sum(license_name)
         log.info("found license %s with md5sum %s", license_name, license_md5)
         lic_short = None
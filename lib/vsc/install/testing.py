@@ -79,7 +79,8 @@ class TestCase(OrigTestCase):
             else:
                 txtb = pprint.pformat(second)
 
-            diff = nicediff(txta, txtb, offset=self.DIFF_OFFSET)
+            # one line more than needed, to know whether the diff is truncated
+            diff = nicediff(txta, txtb, offset=self.DIFF_OFFSET, limit=self.ASSERT_MAX_DIFF + 1)
             if len(diff) > self.ASSERT_MAX_DIFF:
                 limit = f" (first {self.ASSERT_MAX_DIFF} lines)"
             else:
@@ -0,0 +1,593 @@
+#
+# Copyright 2026-2026 Ghent University
+#
+# This file is part of vsc-install,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/vsc-install
+#
+# vsc-install is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-install is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-install. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Run the tests of VscTestCommand (python setup.py test) in forked worker processes or from a shared test queue,
+and report the timing of the tests and their performance regressions compared with the test history
+
+This is not part of the self-contained setup.py, VscTestCommand only imports it when needed.
+"""
+
+import builtins
+import json
+import multiprocessing
+import os
+import queue
+import re
+import resource
+import socket
+import statistics
+import sys
+import time
+import traceback
+import unittest
+
+from distutils import log
+from distutils.errors import DistutilsError, DistutilsOptionError
+from pathlib import Path
+from vsc.install.shared_setup import JsonCache
+
+# seconds between the checks of a shared test queue (see VscTestCommand test-queue option)
+TEST_QUEUE_POLL_INTERVAL = 1
+# the baseline duration of a test is the median of (at most) this many earlier runs in the test history
+TEST_HISTORY_BASELINE_RUNS = 10
+# a test needs this many earlier runs in the test history before it can be flagged as a regression
+TEST_HISTORY_MIN_RUNS = 3
+# differences in duration (in seconds) that are this small are never a regression (but noise)
+TEST_REGRESSION_MIN_WALL = 0.05
+
+
+class RemoteTest:
+    """A test that ran in a --test-jobs worker process, as reported in the merged unittest result"""
+
+    def __init__(self, description):
+        self.description = description
+
+    def __str__(self):
+        return self.description
+
+    def id(self):
+        """Test id, as with unittest.TestCase"""
+        return self.description
+
+    def shortDescription(self):  # pylint: disable=invalid-name
+        """No docstring is available from the worker process (as with unittest.TestCase)"""
+        return None
+
+
+def resource_usage():
+    """Return the wall time, CPU time (user and system) and max RSS (in kB) of this process so far"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return time.time(), usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+def add_timing_record(kind, name, start):
+    """
+    Add the timing record of name since start (as returned by resource_usage) to the test timing records,
+    kind is test, import (of a test module) or setup (the fixtures before the first test of a test class)
+    """
+    end = resource_usage()
+    getattr(builtins, "__test_timing")["records"].append({
+        "kind": kind,
+        "name": name,
+        "wall": end[0] - start[0],
+        "cpu": end[1] - start[1],
+        "maxrss": end[2],
+        "maxrss_delta": end[2] - start[2],
+    })
+
+
+class TimingTestResultMixin:
+    """
+    Record the timing of each test, and of the fixtures before the first test of a test class.
+
+    unittest has no hook around setUpModule/setUpClass, so the setup of a test class is a heuristic:
+    the time between the previous test (or the start of the run) and the first test of the class,
+    which also includes the tearDownClass and tearDownModule of the test class before it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timing_class = None
+        self.timing_start = resource_usage()
+
+    def startTestRun(self):  # pylint: disable=invalid-name
+        """Start timing the setup of the first test class"""
+        super().startTestRun()
+        self.timing_start = resource_usage()
+
+    def startTest(self, test):  # pylint: disable=invalid-name
+        """Record the setup of a new test class, start timing the test"""
+        if test.__class__ is not self.timing_class:
+            self.timing_class = test.__class__
+            name = f"{self.timing_class.__module__}.{self.timing_class.__name__}"
+            add_timing_record("setup", name, self.timing_start)
+        self.timing_start = resource_usage()
+        super().startTest(test)
+
+    def stopTest(self, test):  # pylint: disable=invalid-name
+        """Record the test"""
+        super().stopTest(test)
+        add_timing_record("test", test.id(), self.timing_start)
+        self.timing_start = resource_usage()
+
+
+class TimingTestResult(TimingTestResultMixin, unittest.TestResult):
+    """TestResult with the timing of the tests"""
+
+
+class TimingTextTestResult(TimingTestResultMixin, unittest.TextTestResult):
+    """TextTestResult with the timing of the tests"""
+
+
+class TimingTextTestRunner(unittest.TextTestRunner):
+    """TextTestRunner with the timing of the tests"""
+
+    resultclass = TimingTextTestResult
+
+
+class ModuleDurations(JsonCache):
+    """The durations (in seconds) of the test modules in earlier runs (see VscTestRun.schedule_test_modules)"""
+
+    DESCRIPTION = "test durations"
+    # also used as test-shard-durations file
+    INDENT = 4
+
+
+class VscTestRun:
+    """
+    Run the tests of a VscTestCommand, with its (finalized) options
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+
+    def test_durations_filename(self):
+        """
+        File with the durations of the test modules in earlier runs
+        """
+        return os.path.join(self.cmd.setupper.cache_dir(), "test-durations.json")
+
+    def load_test_durations(self):
+        """
+        Return dict with the duration (in seconds) of the test modules in earlier runs
+        (empty if there are none or they are unreadable)
+        """
+        return ModuleDurations(self.test_durations_filename()).data
+
+    def save_test_durations(self, durations):
+        """
+        Add (or update) the durations of test modules to the ones of earlier runs,
+        atomically (a failure to write is not fatal)
+        """
+        cache = ModuleDurations(self.test_durations_filename())
+        cache.data.update(durations)
+        cache.save()
+
+    def test_modules(self):
+        """
+        Return the names of the test modules of the test suite (found like the ScanningLoader does),
+        without the ones that do not match the test-filterm regex.
+        A test suite that is not a package is a single test module.
+        """
+        suite = self.cmd.test_suite
+        try:
+            __import__(suite)
+        except ImportError:
+            pass
+        module = sys.modules.get(suite)
+        if module is None or not hasattr(module, "__path__"):
+            return [suite]
+
+        res = []
+
+        def scan(package, path):
+            for fn in sorted(os.listdir(path)):
+                if fn.endswith(".py") and fn != "__init__.py":
+                    res.append(f"{package}.{fn[:-3]}")
+                elif os.path.isfile(os.path.join(path, fn, "__init__.py")):
+                    scan(f"{package}.{fn}", os.path.join(path, fn))
+
+        scan(suite, module.__path__[0])
+
+        if self.cmd.test_filterm is not None:
+            res = [mname for mname in res if re.search(self.cmd.test_filterm, mname)]
+        return res
+
+    def schedule_test_modules(self):
+        """
+        Return the test modules, the ones that took longest in earlier runs first
+        (new ones, without a known duration, go first of all)
+        """
+        durations = self.load_test_durations()
+        return sorted(self.test_modules(), key=lambda mname: -durations.get(mname, float("inf")))
+
+    def run_test_module(self, mname):
+        """
+        Run the tests of test module mname (in a test-jobs worker process)
+        Returns dict with the duration and the (picklable) outcome
+        """
+        start = time.time()
+        timing = getattr(builtins, "__test_timing")
+        first_record = len(timing["records"])
+        result = TimingTestResult() if timing["enabled"] else unittest.TestResult()
+        try:
+            loader = self.cmd._resolve_as_ep(self.cmd.test_loader)  # pylint: disable=protected-access
+            tests = loader.loadTestsFromName(mname)
+            result.startTestRun()
+            tests.run(result)
+            result.stopTestRun()
+        except Exception:  # pylint: disable=broad-except
+            # e.g. the test module can't be imported
+            result.errors.append((RemoteTest(mname), traceback.format_exc()))
+
+        def outcomes(tests):
+            return [(str(test), info) for test, info in tests]
+
+        return {
+            "module": mname,
+            "duration": time.time() - start,
+            "testsRun": result.testsRun,
+            "failures": outcomes(result.failures),
+            "errors": outcomes(result.errors),
+            "skipped": outcomes(result.skipped),
+            "expectedFailures": outcomes(result.expectedFailures),
+            "unexpectedSuccesses": [str(test) for test in result.unexpectedSuccesses],
+            "timing": timing["records"][first_record:],
+        }
+
+    def test_worker(self, mnames, done, results=None):
+        """
+        Run the test modules mnames, put their outcome on the done queue
+        and write it to the results directory, if any (in a forked worker process)
+        """
+        for mname in mnames:
+            outcome = self.run_test_module(mname)
+            if results is not None:
+                filename = os.path.join(results, f"{mname}.json")
+                tmp = f"{filename}.{socket.gethostname()}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf8") as fh:
+                    json.dump(outcome, fh)
+                os.replace(tmp, filename)
+            done.put(outcome)
+
+    def run_test_workers(self, mnames, results=None):
+        """
+        Run the test modules from the iterator mnames in test_jobs forked worker processes.
+        The workers inherit the sys.path, modules and filters prepared by run_tests.
+        Returns the outcomes of the test modules, in the order they finished.
+        """
+        # no multiprocessing.Pool: its daemonic workers can't start the processes some tests need
+        ctx = multiprocessing.get_context("fork")
+        done = ctx.Queue()
+        workers = [
+            ctx.Process(target=self.test_worker, args=(mnames, done, results)) for _ in range(self.cmd.test_jobs)
+        ]
+        for worker in workers:
+            worker.start()
+
+        outcomes = []
+
+        def add_outcome(outcome):
+            outcomes.append(outcome)
+            log.info(
+                "Ran %s tests of %s in %.3fs (%s failures, %s errors)",
+                outcome["testsRun"],
+                outcome["module"],
+                outcome["duration"],
+                len(outcome["failures"]),
+                len(outcome["errors"]),
+            )
+
+        while any(worker.is_alive() for worker in workers):
+            try:
+                add_outcome(done.get(timeout=0.1))
+            except queue.Empty:
+                pass
+
+        # a worker can put its last outcome on the queue right before it exits
+        for worker in workers:
+            worker.join()
+        while True:
+            try:
+                add_outcome(done.get_nowait())
+            except queue.Empty:
+                break
+
+        self.save_test_durations({outcome["module"]: outcome["duration"] for outcome in outcomes})
+        return outcomes
+
+    @staticmethod
+    def merge_test_outcomes(outcomes, missing=None):
+        """
+        Return a unittest result with the merged outcomes of test modules,
+        with an error for each of the test modules in dict missing (with the reason as value)
+        """
+        result = unittest.TextTestRunner()._makeResult()
+        for outcome in outcomes:
+            getattr(builtins, "__test_timing")["records"].extend(outcome.get("timing", []))
+            result.testsRun += outcome["testsRun"]
+            for attr in ("failures", "errors", "skipped", "expectedFailures"):
+                getattr(result, attr).extend((RemoteTest(test), info) for test, info in outcome[attr])
+            result.unexpectedSuccesses.extend(RemoteTest(test) for test in outcome["unexpectedSuccesses"])
+
+        for mname, reason in sorted((missing or {}).items()):
+            result.errors.append((RemoteTest(mname), f"{reason}\n"))
+        return result
+
+    @staticmethod
+    def report_test_result(result, start, how):
+        """
+        Report the merged result like unittest does, the tests ran since start in the way described by how
+        """
+        result.printErrors()
+        result.stream.writeln(result.separator2)
+        result.stream.writeln(f"Ran {result.testsRun} tests in {time.time() - start:.3f}s {how}")
+        result.stream.writeln()
+        infos = [
+            f"{name}={len(getattr(result, attr))}"
+            for name, attr in [
+                ("failures", "failures"),
+                ("errors", "errors"),
+                ("skipped", "skipped"),
+                ("expected failures", "expectedFailures"),
+                ("unexpected successes", "unexpectedSuccesses"),
+            ]
+            if getattr(result, attr)
+        ]
+        status = "OK" if result.wasSuccessful() else "FAILED"
+        result.stream.writeln(f"{status} ({', '.join(infos)})" if infos else status)
+
+    def run_tests_parallel(self):
+        """
+        Run the test modules in test_jobs forked worker processes,
+        the ones that took longest in earlier runs (and the new ones) first.
+        Returns the merged unittest result (and reports it like unittest does).
+        """
+        start = time.time()
+        modules = self.schedule_test_modules()
+
+        todo = multiprocessing.get_context("fork").Queue()
+        for mname in modules + [None] * self.cmd.test_jobs:
+            todo.put(mname)
+        outcomes = self.run_test_workers(iter(todo.get, None))
+
+        # e.g. a test exited the worker process
+        missing = set(modules) - {outcome["module"] for outcome in outcomes}
+        result = self.merge_test_outcomes(
+            outcomes, dict.fromkeys(missing, "Test worker process exited unexpectedly")
+        )
+        self.report_test_result(result, start, f"with {self.cmd.test_jobs} jobs")
+        return result
+
+    def claim_test_modules(self, modules):
+        """
+        Yield the test modules (in order) that are claimed from the test queue,
+        by creating their lock file in the claims directory (which fails if another worker claimed it before)
+        """
+        for mname in modules:
+            try:
+                fd = os.open(os.path.join(self.cmd.test_queue, "claims", mname), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w") as fh:
+                fh.write(f"{socket.gethostname()} {os.getpid()}\n")
+            yield mname
+
+    def wait_for_test_queue(self, check):
+        """
+        Poll the test queue until check() is true, return False if that takes longer than test_queue_timeout
+        """
+        deadline = time.time() + self.cmd.test_queue_timeout
+        while not check():
+            if time.time() > deadline:
+                return False
+            time.sleep(max(0, min(TEST_QUEUE_POLL_INTERVAL, deadline - time.time())))
+        return True
+
+    def run_tests_queue(self):
+        """
+        Run the test modules of the queue in shared directory test_queue (e.g. for runs on several nodes):
+        the modules are claimed from the queue with lock files, and run in test_jobs forked worker processes
+        of each node, with the result of each module written in the queue.
+
+        The coordinator fills the queue (longest modules first, like run_tests_parallel),
+        also claims modules itself and merges the results of all modules when they're all done.
+        The other (worker) runs wait for the queue, and only report on the modules they ran themselves.
+        Returns the merged unittest result (and reports it like unittest does).
+        """
+        start = time.time()
+        modules_fn = os.path.join(self.cmd.test_queue, "modules.json")
+        results = os.path.join(self.cmd.test_queue, "results")
+
+        if self.cmd.test_queue_coordinator:
+            if os.path.exists(modules_fn):
+                msg = f"Test queue {self.cmd.test_queue} is already used, the coordinator needs a new one"
+                raise DistutilsOptionError(msg)
+            for subdir in ("claims", "results"):
+                os.makedirs(os.path.join(self.cmd.test_queue, subdir), exist_ok=True)
+            tmp = f"{modules_fn}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf8") as fh:
+                json.dump(self.schedule_test_modules(), fh, indent=4)
+            os.replace(tmp, modules_fn)
+            log.info("Filled test queue %s", self.cmd.test_queue)
+        elif not self.wait_for_test_queue(lambda: os.path.exists(modules_fn)):
+            raise DistutilsError(f"No test queue in {self.cmd.test_queue} after {self.cmd.test_queue_timeout}s")
+
+        modules = json.loads(Path(modules_fn).read_text(encoding="utf8"))
+        outcomes = self.run_test_workers(self.claim_test_modules(modules), results=results)
+
+        if not self.cmd.test_queue_coordinator:
+            result = self.merge_test_outcomes(outcomes)
+            self.report_test_result(result, start, f"from test queue {self.cmd.test_queue}")
+            return result
+
+        def result_fn(mname):
+            return os.path.join(results, f"{mname}.json")
+
+        if not self.wait_for_test_queue(lambda: all(os.path.exists(result_fn(mname)) for mname in modules)):
+            log.error(
+                "Not all test modules in queue %s have a result after %ss",
+                self.cmd.test_queue,
+                self.cmd.test_queue_timeout,
+            )
+
+        outcomes = []
+        missing = {}
+        for mname in modules:
+            try:
+                outcomes.append(json.loads(Path(result_fn(mname)).read_text(encoding="utf8")))
+            except (OSError, ValueError) as err:
+                claim = os.path.join(self.cmd.test_queue, "claims", mname)
+                owner = Path(claim).read_text(encoding="utf8").strip() if os.path.exists(claim) else None
+                missing[mname] = f"No result in test queue {self.cmd.test_queue} (claimed by {owner}): {err}"
+
+        result = self.merge_test_outcomes(outcomes, missing)
+        self.report_test_result(result, start, f"from test queue {self.cmd.test_queue} (all workers)")
+        return result
+
+    def report_test_timing(self):
+        """
+        Report the test-timing slowest tests, test module imports and setups,
+        and write all timing records to the test-timing-json file
+        """
+        records = getattr(builtins, "__test_timing")["records"]
+
+        if self.cmd.test_timing:
+            slowest = sorted(records, key=lambda record: record["wall"], reverse=True)[: self.cmd.test_timing]
+            log.info("Slowest %s tests, test module imports and setups:", len(slowest))
+            for record in slowest:
+                log.info(
+                    "%10.3fs wall %10.3fs cpu %10d kB maxrss (+%d kB) %-6s %s",
+                    record["wall"],
+                    record["cpu"],
+                    record["maxrss"],
+                    record["maxrss_delta"],
+                    record["kind"],
+                    record["name"],
+                )
+
+        if self.cmd.test_timing_json is not None:
+            try:
+                with open(self.cmd.test_timing_json, "w", encoding="utf8") as fh:
+                    json.dump(records, fh, indent=4)
+                log.info("Wrote %s test timing records to %s", len(records), self.cmd.test_timing_json)
+            except OSError as err:
+                log.error("Failed to write test timing to %s: %s", self.cmd.test_timing_json, err)
+
+    def test_history_filename(self):
+        """
+        File with the test history: a line of JSON with the test durations of each run
+        """
+        history_dir = self.cmd.test_history_dir or self.cmd.setupper.cache_dir()
+        return os.path.join(history_dir, "test-history.jsonl")
+
+    @staticmethod
+    def test_history_run():
+        """
+        Return the host and Python version of this run, the durations are only compared with those of the same
+        """
+        return {"host": socket.gethostname(), "python": f"{sys.version_info[0]}.{sys.version_info[1]}"}
+
+    def load_test_history(self):
+        """
+        Return the list of earlier runs in the test history, oldest first (unreadable lines are ignored)
+        """
+        history = []
+        try:
+            lines = Path(self.test_history_filename()).read_text(encoding="utf8").splitlines()
+        except OSError:
+            lines = []
+        for line in lines:
+            try:
+                run = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(run, dict) and isinstance(run.get("durations"), dict):
+                history.append(run)
+        return history
+
+    def append_test_history(self, durations):
+        """
+        Append a run with the durations (wall time in seconds per test id) to the test history
+        """
+        filename = self.test_history_filename()
+        run = dict(self.test_history_run(), time=time.time(), durations=durations)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # a single write of a line, in append mode
+            with open(filename, "a", encoding="utf8") as fh:
+                fh.write(json.dumps(run, sort_keys=True) + "\n")
+        except OSError as err:
+            log.warn("Failed to append to test history %s: %s", filename, err)
+
+    def test_regressions(self, durations, history):
+        """
+        Return the tests of which the duration is more than test_regression times its baseline:
+        the median duration in the last TEST_HISTORY_BASELINE_RUNS runs of the history on this host
+        (with this Python version). List of (test id, duration, baseline, number of runs), slowest first.
+        """
+        this_run = self.test_history_run()
+        runs = [run for run in history if all(run.get(key) == value for key, value in this_run.items())]
+        runs = runs[-TEST_HISTORY_BASELINE_RUNS:]
+
+        res = []
+        for test, duration in durations.items():
+            earlier = [run["durations"][test] for run in runs if test in run["durations"]]
+            if len(earlier) < TEST_HISTORY_MIN_RUNS:
+                continue
+            baseline = statistics.median(earlier)
+            if duration > self.cmd.test_regression * baseline and duration - baseline >= TEST_REGRESSION_MIN_WALL:
+                res.append((test, duration, baseline, len(earlier)))
+        return sorted(res, key=lambda regression: regression[1] / max(regression[2], 1e-6), reverse=True)
+
+    def report_test_history(self):
+        """
+        Report the tests that regressed compared with the test history (if test-regression is set),
+        and append the test durations of this run to the history
+        """
+        records = getattr(builtins, "__test_timing")["records"]
+        durations = {record["name"]: record["wall"] for record in records if record["kind"] == "test"}
+
+        if self.cmd.test_regression is not None:
+            regressions = self.test_regressions(durations, self.load_test_history())
+            for test, duration, baseline, runs in regressions:
+                log.warn(
+                    "Performance regression of test %s: %.3fs is %.1f times the median %.3fs of %s earlier runs",
+                    test,
+                    duration,
+                    duration / max(baseline, 1e-6),
+                    baseline,
+                    runs,
+                )
+            log.info(
+                "%s of %s tests regressed more than %s times in test history %s",
+                len(regressions),
+                len(durations),
+                self.cmd.test_regression,
+                self.test_history_filename(),
+            )
+
+        self.append_test_history(durations)
@@ -28,12 +28,21 @@ Tests for functionality in vsc.install.commentest
 
 @author: Kenneth Hoste (Ghent University)
 """
+import json
 import os
+import re
+import signal
+import subprocess
+import sys
+import time
+import unittest
 
 from pathlib import Path
 from unittest.mock import MagicMock, call
+from vsc.install.shared_setup import log
 from vsc.install.testing import TestCase
 
+from vsc.install import commontest
 from vsc.install.commontest import CommonTest, check_autogenerated_ci_config_file
 
 
@@ -110,3 +119,323 @@ class CommontestTest(TestCase):
 
         Path(test_fn + '.NOT_AUTOGENERATED_YET').write_text('https://github.com/hpcugent/vsc-install/issues/1234', encoding='utf8')
         check_ignore(True)
+
+    def test_prospector_cache(self):
+        """Test caching the prospector messages of every file"""
+        for name, txt in [('a.py', 'X = 1\n'), ('b.py', 'from a import X\n'), ('c.py', 'import os\n'),
+                          ('pkg/__init__.py', ''), ('pkg/d.py', 'from . import e\n'), ('pkg/e.py', ''),
+                          ('.hidden/f.py', ''), ('build/g.py', '')]:
+            os.makedirs(os.path.join(self.tmpdir, os.path.dirname(name)), exist_ok=True)
+            Path(os.path.join(self.tmpdir, name)).write_text(txt, encoding='utf8')
+
+        self.assertEqual(commontest.prospector_files(self.tmpdir),
+                         ['a.py', 'b.py', 'c.py', 'pkg/__init__.py', 'pkg/d.py', 'pkg/e.py'])
+        self.assertEqual(commontest.module_imports(os.path.join(self.tmpdir, 'pkg/d.py'), 'pkg/d.py'),
+                         ['pkg', 'pkg.e'])
+        self.assertEqual(commontest.module_names('pkg/__init__.py'), {'pkg'})
+
+        calls = []
+
+        def mocked_prospector_messages(base_dir, clear_ignore_patterns=False, paths=None):
+            """Return one message per checked file"""
+            calls.append(paths)
+            if paths is None:
+                paths = [os.path.join(base_dir, fn) for fn in commontest.prospector_files(base_dir)]
+            location = {'module': None, 'function': None, 'line': 1, 'character': 0}
+            return [{'source': 'pylint', 'code': 'unused-import', 'message': Path(path).read_text(encoding='utf8'),
+                     'location': dict(location, path=path)} for path in paths]
+
+        orig_prospector_messages = commontest.prospector_messages
+        orig_multiple_paths = commontest.PROSPECTOR_MULTIPLE_PATHS
+        commontest.prospector_messages = mocked_prospector_messages
+        commontest.PROSPECTOR_MULTIPLE_PATHS = True
+        try:
+            cache = os.path.join(self.tmpdir, 'cache', 'prospector.json')
+            failures = commontest.run_prospector(self.tmpdir, cache=cache)
+            self.assertEqual(calls, [None])
+            self.assertEqual(len(failures), 6)
+
+            # nothing changed, nothing is checked
+            self.assertEqual(commontest.run_prospector(self.tmpdir, cache=cache), failures)
+            self.assertEqual(calls, [None])
+
+            # changed files are checked again, with the files that import them
+            Path(os.path.join(self.tmpdir, 'a.py')).write_text('X = 2\n', encoding='utf8')
+            Path(os.path.join(self.tmpdir, 'pkg', 'e.py')).write_text('Y = 2\n', encoding='utf8')
+            new_failures = commontest.run_prospector(self.tmpdir, cache=cache)
+            expected = [os.path.join(self.tmpdir, fn) for fn in ['a.py', 'b.py', 'pkg/d.py', 'pkg/e.py']]
+            self.assertEqual(calls[-1], expected)
+            self.assertEqual(sorted(failure['message'] for failure in new_failures),
+                             ['', 'X = 2\n', 'Y = 2\n', 'from . import e\n', 'from a import X\n', 'import os\n'])
+
+            # all files are checked again with whitelisted cross-file checks
+            commontest.PROSPECTOR_WHITELIST.append('duplicate-code')
+            Path(os.path.join(self.tmpdir, 'c.py')).write_text('import sys\n', encoding='utf8')
+            commontest.run_prospector(self.tmpdir, cache=cache)
+            self.assertEqual(calls[-1], None)
+            commontest.PROSPECTOR_WHITELIST.remove('duplicate-code')
+
+            # other prospector options invalidate the cache
+            commontest.PROSPECTOR_USE_LIBS.append('celery')
+            commontest.run_prospector(self.tmpdir, cache=cache)
+            self.assertEqual(len(calls), 4)
+            self.assertEqual(calls[-1], None)
+        finally:
+            commontest.prospector_messages = orig_prospector_messages
+            commontest.PROSPECTOR_MULTIPLE_PATHS = orig_multiple_paths
+            if 'duplicate-code' in commontest.PROSPECTOR_WHITELIST:
+                commontest.PROSPECTOR_WHITELIST.remove('duplicate-code')
+            if 'celery' in commontest.PROSPECTOR_USE_LIBS:
+                commontest.PROSPECTOR_USE_LIBS.remove('celery')
+
+    def test_parallel_prospector(self):
+        """Test running prospector on shards of the files in parallel"""
+        for idx in range(10):
+            Path(os.path.join(self.tmpdir, f'mod{idx}.py')).write_text('#\n' * (idx + 1), encoding='utf8')
+        paths = [os.path.join(self.tmpdir, f'mod{idx}.py') for idx in range(10)]
+
+        shards = commontest.prospector_shards(paths, 3)
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sorted(sum(shards, [])), sorted(paths))
+        self.assertEqual([sum(os.path.getsize(path) for path in shard) for shard in shards], [38, 36, 36])
+        self.assertEqual(len(commontest.prospector_shards(paths[:2], 3)), 2)
+
+        def mocked_prospector_messages(base_dir, clear_ignore_patterns=False, paths=None):
+            """Return messages in reverse order per checked file, and a message about the profile"""
+            if paths is None:
+                paths = [os.path.join(base_dir, fn) for fn in commontest.prospector_files(base_dir)]
+            location = {'module': None, 'function': None, 'character': 0}
+            res = [{'source': 'profile-validator', 'code': 'unused-import', 'message': 'profile',
+                    'location': dict(location, path='.prospector.yaml', line=None)}]
+            for path in reversed(paths):
+                for line in [2, 1]:
+                    res.append({'source': 'pylint', 'code': 'unused-import', 'message': f'pid {os.getpid()}',
+                                'location': dict(location, path=path, line=line)})
+            return res
+
+        orig_prospector_messages = commontest.prospector_messages
+        orig_multiple_paths = commontest.PROSPECTOR_MULTIPLE_PATHS
+        commontest.prospector_messages = mocked_prospector_messages
+        commontest.PROSPECTOR_MULTIPLE_PATHS = True
+        try:
+            failures = commontest.run_prospector(self.tmpdir, jobs=4)
+            self.assertEqual(len(failures), 21)
+            self.assertEqual([(failure['location']['path'], failure['location']['line']) for failure in failures],
+                             [('.prospector.yaml', None)] + [(path, line) for path in sorted(paths) for line in [1, 2]])
+            # checked by worker processes
+            self.assertNotIn(f'pid {os.getpid()}', {failure['message'] for failure in failures})
+
+            # only one process with whitelisted cross-file checks
+            commontest.PROSPECTOR_WHITELIST.append('duplicate-code')
+            failures = commontest.run_prospector(self.tmpdir, jobs=4)
+            self.assertEqual(failures[0]['location']['path'], '.prospector.yaml')
+            self.assertEqual(failures[1]['location']['path'], paths[-1])
+            self.assertEqual({failure['message'] for failure in failures[1:]}, {f'pid {os.getpid()}'})
+        finally:
+            commontest.prospector_messages = orig_prospector_messages
+            commontest.PROSPECTOR_MULTIPLE_PATHS = orig_multiple_paths
+            if 'duplicate-code' in commontest.PROSPECTOR_WHITELIST:
+                commontest.PROSPECTOR_WHITELIST.remove('duplicate-code')
+
+    @staticmethod
+    def _classifier_messages(count):
+        """Return count prospector messages"""
+        codes = commontest.PROSPECTOR_WHITELIST + commontest.PROSPECTOR_BLACKLIST + ['missing-docstring', 'C0301']
+        texts = ['Unused import os', 'Locally disabling no-member', 'line too long (130/120)',
+                 "Redefining built-in 'reduce'", 'Using possibly undefined loop variable', 'nothing to see here']
+        return [{'code': codes[idx % len(codes)], 'message': f'{texts[idx % len(texts)]} {idx % 100}'}
+                for idx in range(count)]
+
+    @staticmethod
+    def _search_every_pattern(messages):
+        """Return the failures of messages, by searching every white/blacklist pattern"""
+        blacklist = list(map(re.compile, commontest.PROSPECTOR_BLACKLIST))
+        whitelist = list(map(re.compile, commontest.PROSPECTOR_WHITELIST))
+        expected = []
+        for msg in messages:
+            if any([bool(reg.search(msg['code']) or reg.search(msg['message'])) for reg in blacklist]):
+                continue
+            if any([bool(reg.search(msg['code']) or reg.search(msg['message'])) for reg in whitelist]):
+                expected.append(msg)
+        return expected
+
+    def test_message_classifier(self):
+        """Test classifying prospector messages, and compare with searching every pattern"""
+        classifier = commontest.MessageClassifier(['E501', 'unused-import', r'^W\d+', '(?i)locally disabling', '(a)'])
+        self.assertEqual(classifier.codes, {'E501', 'unused-import'})
+        self.assertTrue(classifier.match('E501', 'line too long'))
+        self.assertTrue(classifier.match('W291', 'trailing whitespace'))
+        self.assertTrue(classifier.match('no-member', 'found unused-import in message'))
+        self.assertTrue(classifier.match('I0011', 'Locally disabling something'))
+        self.assertTrue(classifier.match('foo', 'bar'))
+        self.assertFalse(classifier.match('E502', 'something else'))
+
+        messages = self._classifier_messages(1000)
+        expected = self._search_every_pattern(messages)
+        self.assertTrue(expected)
+        self.assertEqual(commontest.filter_prospector_messages(messages), expected)
+
+    @unittest.skipUnless(os.environ.get('VSC_INSTALL_BENCHMARK'), 'set $VSC_INSTALL_BENCHMARK to run benchmarks')
+    def test_message_classifier_benchmark(self):
+        """Compare the time to classify 100k prospector messages with searching every pattern"""
+        messages = self._classifier_messages(100000)
+        start = time.time()
+        expected = self._search_every_pattern(messages)
+        orig_time = time.time() - start
+
+        start = time.time()
+        failures = commontest.filter_prospector_messages(messages)
+        new_time = time.time() - start
+
+        log.info("Classifying %s messages: %.3fs (was %.3fs)", len(messages), new_time, orig_time)
+        self.assertEqual(failures, expected)
+        self.assertTrue(new_time < orig_time, f'classifying took {new_time}s, was {orig_time}s')
+
+    def test_prospector_check_set(self):
+        """Test determining the pylint checks and prospector tools that can report whitelisted messages"""
+        definitions = [
+            ('unused-import', 'Unused %s'),
+            ('missing-docstring', 'Missing %s docstring'),
+            ('undefined-variable', 'Undefined variable %r'),
+            ('undefined-loop-variable', 'Using possibly undefined loop variable %r'),
+            ('line-too-long', 'Line too long (%s/%s)'),
+            ('unnecessary-pass', 'Unnecessary pass statement'),
+        ]
+        orig_pylint_message_definitions = commontest.pylint_message_definitions
+        orig_whitelist = commontest.PROSPECTOR_WHITELIST[:]
+        commontest.pylint_message_definitions = lambda: definitions
+        commontest._prospector_check_set.cache_clear()
+        try:
+            commontest.PROSPECTOR_WHITELIST[:] = ['E501', 'unused-import', 'unnecessary-pass']
+            self.assertEqual(commontest.prospector_check_set(),
+                             (['unnecessary-pass', 'unused-import'], ['mccabe', 'pyflakes']))
+
+            commontest.PROSPECTOR_WHITELIST[:] = ['F811', 'MC0001', 'D100']
+            self.assertEqual(commontest.prospector_check_set(), ([], ['pylint']))
+
+            # text patterns can match the text of any message with placeholders, of any tool
+            symbols = ['line-too-long', 'missing-docstring', 'undefined-loop-variable', 'undefined-variable',
+                       'unused-import']
+            commontest.PROSPECTOR_WHITELIST[:] = ['E501', 'undefined']
+            self.assertEqual(commontest.prospector_check_set(), (symbols, []))
+            commontest.PROSPECTOR_WHITELIST[:] = [r'^E\d+', 'pass statement']
+            self.assertEqual(commontest.prospector_check_set(), (sorted(symbols + ['unnecessary-pass']), []))
+
+            commontest.PROSPECTOR_WHITELIST[:] = ['line-too-long']
+            commontest.PROSPECTOR_MINIMAL_CHECKS = True
+            argv = commontest.prospector_argv(self.tmpdir)
+            self.assertEqual(argv[-7:], ['--without-tool', 'mccabe', '--without-tool', 'pycodestyle',
+                                         '--without-tool', 'pyflakes', self.tmpdir])
+        finally:
+            commontest.pylint_message_definitions = orig_pylint_message_definitions
+            commontest.PROSPECTOR_WHITELIST[:] = orig_whitelist
+            commontest.PROSPECTOR_MINIMAL_CHECKS = False
+            commontest._prospector_check_set.cache_clear()
+
+    def test_prospector_minimal_checks_text_pattern(self):
+        """Test that a whitelist pattern that matches the text of a message has the same verdict with minimal checks"""
+        Path(os.path.join(self.tmpdir, 'frob.py')).write_text('"""Frob"""\nimport os as frobnicate\n',
+                                                             encoding='utf8')
+        orig_whitelist = commontest.PROSPECTOR_WHITELIST[:]
+        commontest._prospector_check_set.cache_clear()
+        try:
+            # matches the name of the import in the message of unused-import (and of pyflakes F401)
+            commontest.PROSPECTOR_WHITELIST[:] = ['frobnicate']
+            verdicts = []
+            for minimal in (False, True):
+                commontest.PROSPECTOR_MINIMAL_CHECKS = minimal
+                failures = commontest.filter_prospector_messages(commontest.prospector_messages(self.tmpdir))
+                verdicts.append(sorted((msg['code'], msg['location']['line']) for msg in failures))
+        finally:
+            commontest.PROSPECTOR_WHITELIST[:] = orig_whitelist
+            commontest.PROSPECTOR_MINIMAL_CHECKS = False
+            commontest._prospector_check_set.cache_clear()
+
+        self.assertTrue(('unused-import', 2) in verdicts[0], verdicts)
+        self.assertEqual(verdicts[1], verdicts[0])
+
+    def test_run_ruff(self):
+        """Test running ruff and mapping its diagnostics to failures"""
+        if commontest.ruff_binary(self.tmpdir) is None:
+            self.assertErrorRegex(OSError, 'No ruff binary found', commontest.run_ruff, self.tmpdir)
+
+        diagnostics = [
+            {'code': 'E501', 'message': 'Line too long (130 > 120)', 'filename': os.path.join(self.tmpdir, 'a.py'),
+             'location': {'row': 3, 'column': 121}},
+            {'code': None, 'message': 'SyntaxError: Expected an expression',
+             'filename': os.path.join(self.tmpdir, 'b.py'), 'location': {'row': 1, 'column': 5}},
+            {'code': 'F401', 'message': 'Useless suppression of unused-import', 'filename': os.path.join(self.tmpdir, 'c.py'),
+             'location': {'row': 1, 'column': 1}},
+        ]
+        # fake ruff, that reports the arguments and checks the configuration
+        ruff = os.path.join(self.tmpdir, 'ruff')
+        Path(ruff).write_text('\n'.join([
+            '#!/bin/bash',
+            'echo "$@" > "$(dirname "$0")/ruff.args"',
+            'grep -q "^line-length = 120$" "$3" || exit 2',
+            f"echo '{json.dumps(diagnostics)}'",
+        ]), encoding='utf8')
+        os.chmod(ruff, 0o755)
+        self.assertEqual(commontest.ruff_binary(self.tmpdir), ruff)
+
+        failures = commontest.run_ruff(self.tmpdir)
+        self.assertEqual(failures, [
+            {'source': 'ruff', 'code': 'E501', 'message': 'Line too long (130 > 120)',
+             'location': {'path': os.path.join(self.tmpdir, 'a.py'), 'module': None, 'function': None,
+                          'line': 3, 'character': 120}},
+            {'source': 'ruff', 'code': 'syntax-error', 'message': 'SyntaxError: Expected an expression',
+             'location': {'path': os.path.join(self.tmpdir, 'b.py'), 'module': None, 'function': None,
+                          'line': 1, 'character': 4}},
+        ])
+        args = Path(os.path.join(self.tmpdir, 'ruff.args')).read_text(encoding='utf8').split()
+        self.assertEqual(args[:2] + args[3:], ['check', '--config', '--output-format', 'json', '--exit-zero',
+                                               '--no-cache', self.tmpdir])
+        # the configuration is removed
+        self.assertFalse(os.path.exists(args[2]))
+        self.assertEqual(os.path.dirname(args[2]), self.tmpdir)
+
+    def test_isolated_prospector(self):
+        """Test running prospector in a child process"""
+        Path(os.path.join(self.tmpdir, 'mod.py')).write_text('"""Test module"""\nimport os\n', encoding='utf8')
+
+        orig_sys_argv = sys.argv[:]
+        isolated = commontest.IsolatedProspector(self.tmpdir, timeout=600).start()
+        failures = isolated.wait()
+        self.assertEqual(sys.argv, orig_sys_argv)
+        self.assertEqual([(failure['code'], Path(failure['location']['path'])) for failure in failures
+                          if failure['code'] == 'unused-import'],
+                         [('unused-import', Path(os.path.join(self.tmpdir, 'mod.py')))])
+
+        self.assertErrorRegex(subprocess.TimeoutExpired, 'isolated_prospector_main',
+                              commontest.run_prospector_isolated, self.tmpdir, timeout=0)
+
+        # the child process is killed on timeout, also when nobody is waiting for it yet
+        isolated = commontest.IsolatedProspector(self.tmpdir, timeout=1)
+        isolated.CODE = 'import time; time.sleep(600)'
+        isolated.start()
+        self.mock_stderr(True)
+        self.assertEqual(isolated.proc.wait(timeout=60), -signal.SIGKILL)
+        self.assertIn('did not finish in 1 seconds', self.get_stderr())
+        self.mock_stderr(False)
+        self.assertErrorRegex(subprocess.TimeoutExpired, 'sleep', isolated.wait)
+        isolated = commontest.IsolatedProspector(self.tmpdir, memory=20 * 1024 * 1024).start()
+        try:
+            isolated.wait()
+        except subprocess.CalledProcessError as err:
+            # fails with a MemoryError (or is unable to load a shared library)
+            self.assertTrue(err.returncode != 0)
+            self.assertIn('Traceback', err.output)
+        else:
+            self.fail('isolated prospector with memory limit should fail')
+
+        # a child process that exits without reading its (too large for the pipe) request fails, no broken pipe
+        isolated = commontest.IsolatedProspector(self.tmpdir, timeout=60)
+        isolated.CODE = 'import sys; sys.exit(3)'
+        isolated.kwargs['padding'] = 'x' * 10**6
+        self.mock_stderr(True)
+        isolated.start()
+        self.assertIn('Isolated prospector exited before reading its request', self.get_stderr())
+        self.mock_stderr(False)
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            isolated.wait()
+        self.assertEqual(ctx.exception.returncode, 3)
@@ -25,19 +25,30 @@
 #
 """Test headers"""
 import glob
+import hashlib
+import json
 import os
+import re
+import shutil
+import subprocess
+import tarfile
 
 from pathlib import Path
+from unittest.mock import patch
 
 import vsc.install.headers
 import vsc.install.shared_setup
-from vsc.install.headers import get_header, gen_license_header, begin_end_from_header, check_header
+from vsc.install.headers import get_header, gen_license_header, begin_end_from_header, check_header, HeaderChecker
+from vsc.install.headers import NICEDIFF_MAX_NDIFF_LINES, HeaderDigests, LicenseHeaders, LGPLv2_plus__TEMPLATE
+from vsc.install.headers import main, nicediff
+from vsc.install.headers import read_header_block, repo_files, sdist_member_script
 from vsc.install.shared_setup import KNOWN_LICENSES, log, vsc_setup
 
 from vsc.install.testing import TestCase
 
 orig_this_year = vsc.install.headers._this_year
 orig_write = vsc.install.headers._write
+orig_read_header_block = vsc.install.headers.read_header_block
 orig_get_license = vsc_setup.get_license
 
 
@@ -173,8 +184,9 @@ class TestHeaders(TestCase):
         # don't actually write, just compare with a .fixed file
         compares = []
 
-        def compare(filename, content):
+        def compare(filename, header, offset):
             log.info(f'mocked write does compare for {filename} ')
+            content = (header + Path(filename).read_bytes()[offset:]).decode('utf8')
             name = filename.replace('.check', '')
             compares.append(name)
             new_filename = filename.replace('.check', '.fixed')
@@ -207,3 +219,372 @@ class TestHeaders(TestCase):
                          msg='number of mocked writes/compares as expected')
         for ext in not_changed:
             self.assertFalse(ext in compares, msg=f'not changed {ext} not compared')
+
+    def test_header_checker(self):
+        """Test that HeaderChecker determines the project details only once"""
+
+        calls = []
+
+        class CountingSetup(vsc_setup):
+            def get_name_url(self, *args, **kwargs):
+                calls.append('get_name_url')
+                return super().get_name_url(*args, **kwargs)
+
+            def get_license(self, *args, **kwargs):
+                calls.append('get_license')
+                return super().get_license(*args, **kwargs)
+
+        vsc.install.headers._write = lambda *args: self.assertTrue(False, msg='no writes without write=True')
+
+        checker = HeaderChecker(setup=CountingSetup())
+        filenames = glob.glob(os.path.join(self.setup.REPO_TEST_DIR, 'headers', "*.check*"))
+        for filename in filenames:
+            self.assertEqual(checker.check(filename, script=True), check_header(filename, script=True),
+                             msg=f'HeaderChecker gives same result as check_header for {filename}')
+        self.assertEqual(calls, ['get_name_url', 'get_license'])
+
+        # same license header for same copyright years
+        self.assertTrue(checker.license_header(1234, 5678) is checker.license_header(1234, 5678))
+        self.assertEqual(checker.license_header(1234, 5678),
+                         gen_license_header('LGPLv2+', beginyear=1234, endyear=5678, name='vsc-install',
+                                            url='https://github.com/hpcugent/vsc-install'))
+
+    def _make_repo(self):
+        """Create a repo in tmpdir with correct and incorrect headers, return the correct header"""
+        vsc.install.headers._this_year = lambda: 2025
+
+        testdata = os.path.join(self.setup.REPO_TEST_DIR, 'testdata', 'vsc')
+        shutil.copytree(testdata, os.path.join(self.tmpdir, 'lib', 'vsc'), ignore=shutil.ignore_patterns('*.pyc'))
+        shutil.copy2(os.path.join(self.setup.REPO_TEST_DIR, 'setup', 'PKG-INFO'), self.tmpdir)
+        shutil.copy2(os.path.join(self.setup.REPO_BASE_DIR, 'LICENSE'), self.tmpdir)
+        os.makedirs(os.path.join(self.tmpdir, 'bin'))
+        header = HeaderChecker().license_header(2015, 2025)
+        Path(os.path.join(self.tmpdir, 'lib', 'vsc', 'test', 'mod.py')).write_text('"""\nNo header\n"""\n',
+                                                                                  encoding='utf8')
+        Path(os.path.join(self.tmpdir, 'bin', 'script.py')).write_text(f'#!/usr/bin/env python\n{header}"""\n"""\n',
+                                                                       encoding='utf8')
+        Path(os.path.join(self.tmpdir, 'bin', 'script.sh')).write_text(f'#!/bin/sh\n{header}### END OF HEADER\n',
+                                                                       encoding='utf8')
+        return header
+
+    def _set_repo_base_dir(self):
+        """Use tmpdir as $REPO_BASE_DIR for the rest of the test"""
+        patcher = patch.dict(os.environ, {'REPO_BASE_DIR': self.tmpdir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _main(self, args):
+        """Run main with args, return exitcode and stdout"""
+        self.mock_stdout(True)
+        exitcode = main(args)
+        txt = self.get_stdout()
+        self.mock_stdout(False)
+        return exitcode, txt
+
+    def test_main_repo(self):
+        """Test checking and fixing the headers of all files of a repo"""
+        header = self._make_repo()
+
+        self._set_repo_base_dir()
+        self.assertEqual(repo_files(vsc_setup()), [
+            ('bin/script.py', True),
+            ('bin/script.sh', True),
+            ('lib/vsc/__init__.py', False),
+            ('lib/vsc/test/__init__.py', False),
+            ('lib/vsc/test/mod.py', False),
+        ])
+
+        for jobs in ['1', '2']:
+            exitcode, txt = self._main(['--repo', '--check', '--jobs', jobs])
+            self.assertEqual(exitcode, 1, msg=f'different headers with {jobs} jobs')
+            self.assertEqual(re.findall('^different header: (.*)$', txt, re.M),
+                             [os.path.join(self.tmpdir, fn) for fn in ['bin/script.sh', 'lib/vsc/test/mod.py']])
+            self.assertTrue(txt.endswith('2 changed, 3 unchanged, 0 error\n'), msg=txt)
+
+        exitcode, _ = self._main(['--repo', '--fix', '-j', '2'])
+        self.assertEqual(exitcode, 0)
+        self.assertTrue(Path(os.path.join(self.tmpdir, 'bin', 'script.sh')).read_text(encoding='utf8')
+                        .startswith(f'#!/bin/bash\n{header}'))
+
+        exitcode, txt = self._main(['--repo', '--check'])
+        self.assertEqual(exitcode, 0)
+        self.assertTrue(txt.endswith('0 changed, 5 unchanged, 0 error\n'), msg=txt)
+
+        # errors are reported
+        exitcode, txt = self._main(['--check', os.path.join(self.tmpdir, 'nosuchfile')])
+        self.assertEqual(exitcode, 1)
+        self.assertTrue(txt.endswith('0 changed, 0 unchanged, 1 error\n'), msg=txt)
+
+    def test_header_digests(self):
+        """Test skipping files with a known correct header"""
+        self._make_repo()
+        digests = HeaderDigests(os.path.join(self.tmpdir, 'cache', 'headers.json'))
+        checker = HeaderChecker(digests=digests)
+        correct = os.path.join(self.tmpdir, 'lib', 'vsc', '__init__.py')
+        wrong = os.path.join(self.tmpdir, 'lib', 'vsc', 'test', 'mod.py')
+
+        self.assertFalse(checker.check(correct))
+        self.assertTrue(checker.check(wrong))
+        self.assertEqual(list(digests.data), [correct], msg='only files with correct header are recorded')
+        self.assertTrue(digests.changed)
+        digests.save()
+        self.assertFalse(digests.changed)
+
+        def read_header_block(*args, **kwargs):
+            raise AssertionError('header is checked again')
+
+        try:
+            vsc.install.headers.read_header_block = read_header_block
+            digests = HeaderDigests(digests.filename)
+            checker = HeaderChecker(digests=digests)
+            self.assertFalse(checker.check(correct))
+            self.assertFalse(digests.changed, msg='nothing to save')
+            # same content, other mtime
+            os.utime(correct, ns=(0, 0))
+            self.assertFalse(checker.check(correct))
+            self.assertTrue(digests.changed, msg='new mtime is recorded')
+            # other expected header inputs
+            self.assertErrorRegex(AssertionError, 'checked again', checker.check, correct, script=True)
+            vsc.install.headers._this_year = lambda: 2026
+            self.assertErrorRegex(AssertionError, 'checked again', checker.check, correct)
+            vsc.install.headers._this_year = lambda: 2025
+            # other license template (e.g. a new vsc-install version)
+            with patch.object(vsc.install.headers, 'LICENSE_HEADERS', LicenseHeaders()):
+                with patch.object(vsc.install.headers, 'LGPLv2_plus__TEMPLATE', LGPLv2_plus__TEMPLATE + '#\n'):
+                    self.assertErrorRegex(AssertionError, 'checked again', checker.check, correct)
+            self.assertFalse(checker.check(correct))
+            # other content
+            Path(correct).write_text(Path(correct).read_text(encoding='utf8').replace('Ghent', 'Gent'),
+                                     encoding='utf8')
+            self.assertErrorRegex(AssertionError, 'checked again', checker.check, correct)
+        finally:
+            vsc.install.headers.read_header_block = orig_read_header_block
+
+        self.assertTrue(checker.check(correct))
+
+    def test_main_changed_since(self):
+        """Test checking the headers of changed files only, with the digest cache"""
+        self._make_repo()
+
+        def git(*args):
+            subprocess.check_output(['git', '-C', self.tmpdir, '-c', 'user.name=test', '-c', 'user.email=test@test',
+                                     *args], stderr=subprocess.STDOUT)
+
+        Path(os.path.join(self.tmpdir, '.gitignore')).write_text('*.py[co]\n*~\n.eggs*\n', encoding='utf8')
+        git('init', '-q')
+        git('add', '.gitignore', 'lib', 'bin')
+        git('commit', '-q', '-m', 'init')
+
+        self._set_repo_base_dir()
+        exitcode, txt = self._main(['--repo', '--changed-since', 'HEAD'])
+        self.assertEqual(exitcode, 0)
+        self.assertTrue(txt.endswith('0 changed, 0 unchanged, 0 error\n'), msg=txt)
+
+        # modified and untracked files
+        Path(os.path.join(self.tmpdir, 'bin', 'script.py')).write_text('"""\n"""\n', encoding='utf8')
+        new = os.path.join(self.tmpdir, 'lib', 'vsc', 'test', 'new.py')
+        shutil.copy2(os.path.join(self.tmpdir, 'lib', 'vsc', '__init__.py'), new)
+        exitcode, txt = self._main(['--repo', '--changed-since', 'HEAD', '--cache', '-j', '2'])
+        self.assertEqual(exitcode, 1)
+        self.assertTrue(txt.endswith('1 changed, 1 unchanged, 0 error\n'), msg=txt)
+        digests = HeaderDigests(os.path.join(vsc_setup().cache_dir(), 'headers.json'))
+        self.assertEqual(list(digests.data), [new])
+
+        # unchanged files are skipped, also with several jobs
+        exitcode, txt = self._main(['--repo', '--cache', '-j', '2'])
+        self.assertEqual(exitcode, 1)
+        self.assertTrue(txt.endswith('3 changed, 3 unchanged, 0 error\n'), msg=txt)
+        self.assertTrue(re.search('^INFO: Header of .*/new.py is unchanged', txt, re.M), msg=txt)
+
+        self.assertErrorRegex(SystemExit, '2', self._main, ['--changed-since', 'HEAD', 'some/file'])
+
+    def test_get_header_max_size(self):
+        """Test that get_header only reads the start of a file, unless the header is larger"""
+        filename = os.path.join(self.tmpdir, 'big.py')
+        header = '#\n# header\n#\n'
+        Path(filename).write_text(header + '"""\ndocstring\n"""\n' + 'a = 1\n' * 100000, encoding='utf8')
+        self.mock_stderr(True)
+        self.assertEqual(get_header(filename), (header, None))
+        self.assertEqual(get_header(filename, max_size=None), (header, None))
+        self.assertEqual(self.get_stderr(), '')
+        # end of header not in first 10 bytes: the rest of the file is read too
+        self.assertEqual(get_header(filename, max_size=10), (header, None))
+        warning = f'WARN: End of header of {filename} not found in the first 10 bytes'
+        self.assertTrue(self.get_stderr().startswith(warning), msg=self.get_stderr())
+        self.mock_stderr(False)
+
+        # end of header after max size is not mistaken for a missing header
+        Path(filename).write_text('#\n' * 100000 + '### END OF HEADER\n', encoding='utf8')
+        self.mock_stderr(True)
+        self.assertEqual(get_header(filename), ('#\n' * 100000, None))
+        self.assertTrue(self.get_stderr().startswith('WARN: End of header'), msg=self.get_stderr())
+        self.mock_stderr(False)
+        self.assertEqual(get_header(filename, max_size=None), ('#\n' * 100000, None))
+        for max_size in (200000, 200002, None):
+            block, size = read_header_block(filename, max_size=max_size)
+            self.assertEqual(size, 200000)
+            self.assertTrue(block.endswith(b'#\n### END OF HEADER\n'))
+
+        # no end of header at all
+        Path(filename).write_text('a = 1\n' * 100000, encoding='utf8')
+        self.mock_stderr(True)
+        self.assertEqual(read_header_block(filename, max_size=10), (b'', 0))
+        self.mock_stderr(False)
+
+        # windows line endings
+        Path(filename).write_bytes(b'#!/bin/bash\r\n# header\r\n### END OF HEADER\r\necho\r\n')
+        self.assertEqual(get_header(filename, script=True), ('# header\n', '#!/bin/bash'))
+
+    def test_write(self):
+        """Test replacing the header of a file"""
+        filename = os.path.join(self.tmpdir, 'script.sh')
+        Path(filename).write_bytes(b'#!/bin/sh\n# old\n### END OF HEADER\r\necho \xff\r\n')
+        os.chmod(filename, 0o750)
+
+        vsc.install.headers._write(filename, b'#!/bin/bash\n# new\n', len(b'#!/bin/sh\n# old\n'))
+        self.assertEqual(Path(filename).read_bytes(), b'#!/bin/bash\n# new\n### END OF HEADER\r\necho \xff\r\n',
+                         msg='remainder is kept as is')
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o750)
+
+        # original is untouched (and temporary file is removed) on failure
+        self.assertErrorRegex(TypeError, '', vsc.install.headers._write, filename, 'not bytes', 0)
+        self.assertEqual(Path(filename).read_bytes(), b'#!/bin/bash\n# new\n### END OF HEADER\r\necho \xff\r\n')
+        self.assertEqual(os.listdir(self.tmpdir), ['script.sh'])
+
+        # check with write only replaces the header
+        self.assertTrue(check_header(filename, script=True, write=True))
+        self.assertTrue(Path(filename).read_bytes().endswith(b'#\n### END OF HEADER\r\necho \xff\r\n'))
+        self.assertFalse(check_header(filename, script=True, write=True))
+
+    def test_nicediff(self):
+        """Test nicediff"""
+        txta = ''.join(f'line {idx}\n' for idx in range(20))
+        txtb = txta.replace('line 10\n', 'line ten\n')
+        self.assertEqual(nicediff(txta, txtb, offset=2),
+                         ['  line 8\n', '  line 9\n', '- line 10\n', '+ line ten\n', '  line 11\n',
+                          '  line 12\n'])
+        self.assertEqual(nicediff(txta, txtb, offset=0), ['- line 10\n', '+ line ten\n'])
+        self.assertEqual(nicediff(txta, txta), [])
+        self.assertEqual(nicediff(txta, txtb, offset=2, limit=3), ['  line 8\n', '  line 9\n', '- line 10\n'])
+
+        # overlapping context of changes is merged, changes at begin and end
+        txtb = txtb.replace('line 12\n', '').replace('line 0\n', 'first\n') + 'last\n'
+        self.assertEqual(nicediff(txta, txtb, offset=2),
+                         ['- line 0\n', '+ first\n', '  line 1\n', '  line 2\n',
+                          '  line 8\n', '  line 9\n', '- line 10\n', '+ line ten\n', '  line 11\n',
+                          '- line 12\n', '  line 13\n', '  line 14\n',
+                          '  line 18\n', '  line 19\n', '+ last\n'])
+
+        # big differences are compared by position
+        txta = ''.join(f'line {idx}\n' for idx in range(NICEDIFF_MAX_NDIFF_LINES + 2))
+        txtb = ''.join(f'other {idx}\n' for idx in range(NICEDIFF_MAX_NDIFF_LINES))
+        diff = nicediff(txta, txtb)
+        self.assertEqual(diff[:4], ['- line 0\n', '+ other 0\n', '- line 1\n', '+ other 1\n'])
+        last = NICEDIFF_MAX_NDIFF_LINES
+        self.assertEqual(diff[-2:], [f'- line {last}\n', f'- line {last + 1}\n'])
+
+    def test_license_headers(self):
+        """Test the registry of license headers"""
+        registry = LicenseHeaders()
+        url = 'https://github.com/hpcugent/projectname'
+        header = registry.render('LGPLv2+', 'projectname', url, 1234, 5678)
+        self.assertEqual(header, gen_license_header('LGPLv2+', name='projectname', url=url, beginyear=1234,
+                                                    endyear=5678))
+        self.assertTrue(registry.render('LGPLv2+', 'projectname', url, 1234, 5678) is header)
+        registry.render('LGPLv2+', 'otherproject', 'https://github.com/hpcugent/otherproject', 2000, 2025)
+        registry.render('LGPLv2+', 'vubproject', 'https://github.com/vub-hpc/vubproject', 2000, 2025)
+        self.assertEqual(sorted(registry._templates), [('LGPLv2+', 'hpcugent'), ('LGPLv2+', 'vub')],
+                         msg='one template per license and organisation')
+
+        # the template is only looked up once per license and organisation
+        with patch.object(vsc.install.headers, 'LGPLv2_plus__TEMPLATE', 'other template'):
+            self.assertEqual(registry.render('LGPLv2+', 'projectname', url, 1234, 5679)[:14], '#\n# Copyright ')
+            self.assertEqual(LicenseHeaders().render('LGPLv2+', 'projectname', url, 1234, 5679), 'other template')
+
+        header_bytes, digest = registry.render_bytes('LGPLv2+', 'projectname', url, 1234, 5678)
+        self.assertEqual(header_bytes, header.encode('utf8'))
+        self.assertEqual(digest, hashlib.sha256(header_bytes).hexdigest())
+        self.assertNotEqual(digest, registry.render_bytes('LGPLv2+', 'projectname', url, 1234, 5679)[1])
+
+        self.assertErrorRegex(ValueError, 'cannot find template name NOSUCH_TEMPLATE', registry.render,
+                              'NOSUCH', 'projectname', url, 1234, 5678)
+        self.assertErrorRegex(ValueError, 'Unable to find a known github organization in url https://example.com',
+                              gen_license_header, 'LGPLv2+', name='projectname', url='https://example.com',
+                              beginyear=1234, endyear=5678)
+
+    def test_main_json(self):
+        """Test reporting about the headers as JSON lines"""
+        self._make_repo()
+
+        self._set_repo_base_dir()
+        for jobs in ['1', '2']:
+            exitcode, txt = self._main(['--repo', '--json', '-j', jobs])
+            self.assertEqual(exitcode, 1)
+            reports = [json.loads(line) for line in txt.splitlines()]
+            self.assertEqual([(rep['file'][len(self.tmpdir) + 1:], rep['status']) for rep in reports], [
+                ('bin/script.py', 'unchanged'),
+                ('bin/script.sh', 'changed'),
+                ('lib/vsc/__init__.py', 'unchanged'),
+                ('lib/vsc/test/__init__.py', 'unchanged'),
+                ('lib/vsc/test/mod.py', 'changed'),
+            ])
+            script = reports[1]
+            self.assertEqual(script['shebang'], {'found': '#!/bin/sh', 'expected': '#!/bin/bash'})
+            self.assertEqual(script['years'], [2015, 2025])
+            self.assertEqual(script['license'], 'LGPLv2+')
+            self.assertEqual(script['diff'], {'removed': 1, 'added': 1})
+            self.assertTrue(script['time'] >= 0)
+            self.assertEqual(reports[4]['shebang'], None)
+            self.assertEqual(reports[4]['years'], [2025, 2025])
+            self.assertEqual(reports[4]['diff'], {'removed': 0, 'added': 25})
+
+        exitcode, txt = self._main(['--json', os.path.join(self.tmpdir, 'nosuchfile')])
+        self.assertEqual(exitcode, 1)
+        report = json.loads(txt)
+        self.assertEqual(report['status'], 'error')
+        self.assertTrue(report['error'].startswith('ValueError: get_header filename'))
+
+    def test_main_sdist(self):
+        """Test checking the headers of the files in an sdist tarball"""
+        header = self._make_repo()
+        # shebang as rewritten by vsc_sdist_rpm
+        Path(os.path.join(self.tmpdir, 'bin', 'rpm.py')).write_text(f'#!/usr/bin/python-stripped-env\n{header}"""\n',
+                                                                    encoding='utf8')
+        Path(os.path.join(self.tmpdir, 'bin', 'wrong.py')).write_text(f'#!/usr/bin/python\n{header}"""\n',
+                                                                      encoding='utf8')
+        tarball = os.path.join(self.tmpdir, 'vsc-test-1.0.tar.gz')
+        with tarfile.open(tarball, 'w:gz') as tar:
+            for name in ['PKG-INFO', 'bin', 'lib']:
+                tar.add(os.path.join(self.tmpdir, name), arcname=f'vsc-test-1.0/{name}')
+
+        self.assertEqual(sdist_member_script('vsc-test-1.0/bin/script.sh'), True)
+        self.assertEqual(sdist_member_script('vsc-test-1.0/lib/vsc/test/mod.py'), False)
+        self.assertEqual(sdist_member_script('vsc-test-1.0/PKG-INFO'), None)
+        self.assertEqual(sdist_member_script('vsc-test-1.0/external_dist_only/shared_setup.py'), None)
+
+        self._set_repo_base_dir()
+        exitcode, txt = self._main(['--sdist', tarball, '--json'])
+        self.assertEqual(exitcode, 1)
+        reports = sorted((json.loads(line) for line in txt.splitlines()), key=lambda rep: rep['file'])
+        self.assertEqual([(rep['file'], rep['script'], rep['status']) for rep in reports], [
+            ('vsc-test-1.0/bin/rpm.py', True, 'unchanged'),
+            ('vsc-test-1.0/bin/script.py', True, 'unchanged'),
+            ('vsc-test-1.0/bin/script.sh', True, 'changed'),
+            ('vsc-test-1.0/bin/wrong.py', True, 'changed'),
+            ('vsc-test-1.0/lib/vsc/__init__.py', False, 'unchanged'),
+            ('vsc-test-1.0/lib/vsc/test/__init__.py', False, 'unchanged'),
+            ('vsc-test-1.0/lib/vsc/test/mod.py', False, 'changed'),
+        ])
+        self.assertEqual(reports[0]['shebang'], {'found': '#!/usr/bin/python-stripped-env',
+                                                 'expected': '#!/usr/bin/env python'})
+        self.assertEqual(reports[3]['shebang'], {'found': '#!/usr/bin/python', 'expected': '#!/usr/bin/env python'})
+
+        exitcode, txt = self._main(['--sdist', tarball])
+        self.assertEqual(exitcode, 1)
+        self.assertTrue(txt.endswith('3 changed, 4 unchanged, 0 error\n'), msg=txt)
+
+        # the tarball is not modified
+        self.mock_stderr(True)
+        self.assertErrorRegex(SystemExit, '2', main, ['--sdist', tarball, '--fix'])
+        self.assertIn('--sdist takes no files and can not fix', self.get_stderr())
+        self.mock_stderr(False)
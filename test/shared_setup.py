@@ -25,15 +25,27 @@
 #
 """Test shared_setup"""
 
+import builtins
+import io
+import json
+import multiprocessing
+import multiprocessing.queues
 import os
+import queue
 import re
+import setuptools.dist
+import shutil
+import subprocess
 import sys
 
+from distutils.errors import DistutilsOptionError
 from pathlib import Path
-from vsc.install import shared_setup
+from unittest.mock import patch
+from vsc.install import gitindex, shared_setup
 from vsc.install.shared_setup import action_target, vsc_setup, _fvs
 
 from vsc.install.testing import TestCase
+from vsc.install.testrunner import TimingTextTestRunner, VscTestRun
 
 
 class TestSetup(TestCase):
@@ -146,6 +158,668 @@ class TestSetup(TestCase):
         base_dir = os.path.dirname(os.path.realpath(__file__))
         self.assertEqual(self.setup.rel_gitignore(['testdata'], base_dir=base_dir), ['../testdata'])
 
+    def test_gitignore(self):
+        """Test the GitIgnore rules"""
+        Path(os.path.join(self.tmpdir, '.gitignore')).write_text('\n'.join([
+            '# comment',
+            '*.py[cod]',
+            '*~',
+            '.eggs*',
+            'build/',
+            '/top_only.txt',
+            'doc/*.html',
+            '**/logs/',
+            'deep/**',
+            '*.log',
+            '!keep.log',
+            '\\#hash',
+            'trailing   ',
+            '',
+        ]), encoding='utf8')
+        for path in ['build', 'sub/build', 'logs', 'a/logs', 'nested/local']:
+            os.makedirs(os.path.join(self.tmpdir, path))
+        Path(os.path.join(self.tmpdir, 'nested', '.gitignore')).write_text('*.txt\n!keep.pyc\n/local/\n',
+                                                                           encoding='utf8')
+
+        gitignore = shared_setup.GitIgnore(self.tmpdir)
+        self.assertEqual(gitignore.lines[:3], ['*.py[cod]', '*~', '.eggs*'])
+
+        ignored = [
+            'x.pyc', 'sub/x.pyo', 'x~', '.eggs.py39', 'build', 'sub/build', 'sub/build/file.py', 'top_only.txt',
+            'doc/index.html', 'a/logs', 'logs', 'deep/x', 'deep/x/y', 'x.log', 'sub/x.log', '#hash', 'trailing',
+            'nested/x.txt', 'nested/local', 'nested/local/x.py',
+        ]
+        not_ignored = [
+            'x.py', 'sub/top_only.txt', 'doc/sub/index.html', 'a/logs.py', 'deep', 'keep.log', 'sub/keep.log',
+            'nested/keep.pyc', 'x.txt', 'local', 'sub/local', '../outside.pyc',
+        ]
+        for path in ignored:
+            self.assertTrue(gitignore.is_ignored(path), msg=f'{path} is ignored')
+        for path in not_ignored:
+            self.assertFalse(gitignore.is_ignored(path), msg=f'{path} is not ignored')
+
+        # directory patterns only match directories
+        self.assertFalse(gitignore.is_ignored('build', is_dir=False))
+        self.assertFalse(gitignore.is_ignored('a/logs', is_dir=False))
+        # nothing below an ignored directory can be re-included
+        self.assertTrue(gitignore.is_ignored('build/keep.log'))
+
+        # compiled rules are cached per repository, until a .gitignore changes
+        cached = shared_setup.get_gitignore(self.tmpdir)
+        self.assertTrue(shared_setup.get_gitignore(self.tmpdir) is cached)
+        self.assertTrue(cached.is_ignored('nested/x.txt'))
+        Path(os.path.join(self.tmpdir, 'nested', '.gitignore')).write_text('*.cfg\n', encoding='utf8')
+        os.utime(os.path.join(self.tmpdir, 'nested', '.gitignore'), ns=(0, 0))
+        new = shared_setup.get_gitignore(self.tmpdir)
+        self.assertFalse(new is cached)
+        self.assertFalse(new.is_ignored('nested/x.txt'))
+        self.assertTrue(new.is_ignored('nested/x.cfg'))
+
+    def test_files_in_packages_gitignore(self):
+        """Test that ignored directories and files are skipped by files_in_packages"""
+        libdir = os.path.join(self.tmpdir, 'lib')
+        shutil.copytree(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testdata', 'vsc'),
+                        os.path.join(libdir, 'vsc'))
+        os.makedirs(os.path.join(libdir, 'vsc', 'test', 'ignored'))
+        for fn in ['vsc/test/ignored/__init__.py', 'vsc/test/mod.py', 'vsc/test/mod.pyc', 'vsc/test/skip.me']:
+            Path(os.path.join(libdir, fn)).write_text('', encoding='utf8')
+        Path(os.path.join(self.tmpdir, '.gitignore')).write_text('*.py[co]\n*~\n.eggs*\nignored/\n',
+                                                                 encoding='utf8')
+        Path(os.path.join(libdir, 'vsc', '.gitignore')).write_text('*.me\n', encoding='utf8')
+
+        setup = vsc_setup()
+        setup.REPO_BASE_DIR = self.tmpdir
+        setup.REPO_LIB_DIR = libdir
+        res = setup.files_in_packages()
+        self.assertEqual(sorted(res['packages']), ['vsc', 'vsc.test'])
+        self.assertEqual(sorted(res['packages']['vsc.test']), ['lib/vsc/test/__init__.py', 'lib/vsc/test/mod.py'])
+
+    def test_git_index(self):
+        """Test discovery of files_in_packages and scripts from the git index"""
+        libdir = os.path.join(self.tmpdir, 'lib')
+        shutil.copytree(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testdata', 'vsc'),
+                        os.path.join(libdir, 'vsc'))
+        os.makedirs(os.path.join(self.tmpdir, 'bin'))
+        for fn in ['lib/vsc/test/mod.py', 'lib/vsc/test/untracked.py', 'bin/script.py', 'bin/.hidden']:
+            Path(os.path.join(self.tmpdir, fn)).write_text('', encoding='utf8')
+        Path(os.path.join(self.tmpdir, '.gitignore')).write_text('*.py[co]\n*~\n.eggs*\n', encoding='utf8')
+
+        def git(*args):
+            subprocess.check_output(['git', '-C', self.tmpdir] + list(args), stderr=subprocess.STDOUT)
+
+        git('init', '-q')
+        git('add', 'lib/vsc', 'bin')
+        git('rm', '-q', '--cached', 'lib/vsc/test/untracked.py')
+
+        setup = vsc_setup()
+        setup.REPO_BASE_DIR = self.tmpdir
+        setup.REPO_LIB_DIR = libdir
+        setup.REPO_SCRIPTS_DIR = os.path.join(self.tmpdir, 'bin')
+        setup.discovery = shared_setup.DISCOVERY_GIT
+
+        index = setup.git_index()
+        self.assertEqual(index, os.path.join(self.tmpdir, '.git', 'index'))
+        tracked = gitindex.git_index_files(index)
+        self.assertEqual(shared_setup.git_index_files(index), tracked)
+        self.assertTrue('lib/vsc/test/mod.py' in tracked)
+        self.assertFalse('lib/vsc/test/untracked.py' in tracked)
+
+        res = setup.files_in_packages()
+        self.assertEqual(sorted(res['packages']), ['vsc', 'vsc.test'])
+        self.assertEqual(sorted(res['packages']['vsc.test']), ['lib/vsc/test/__init__.py', 'lib/vsc/test/mod.py'])
+        self.assertEqual(res['modules'], {'vsc.test.mod': 'lib/vsc/test/mod.py'})
+        self.assertEqual(setup.generate_scripts(), ['bin/script.py'])
+
+        # same result as the filesystem walk, with the untracked file removed
+        os.remove(os.path.join(libdir, 'vsc', 'test', 'untracked.py'))
+        walk_setup = vsc_setup()
+        walk_setup.REPO_BASE_DIR = self.tmpdir
+        walk_setup.REPO_LIB_DIR = libdir
+        walk = walk_setup.files_in_packages()
+        self.assertEqual(res['modules'], walk['modules'])
+        self.assertEqual({k: sorted(v) for k, v in res['packages'].items()},
+                         {k: sorted(v) for k, v in walk['packages'].items()})
+
+        # prefix compressed paths in index version 4
+        git('update-index', '--index-version', '4')
+        self.assertEqual(gitindex.git_index_files(index), tracked)
+
+        # without the git index reader (e.g. the self-contained setup.py), the filesystem is scanned
+        with patch.dict(sys.modules, {'vsc.install.gitindex': None}):
+            self.assertEqual(setup.git_index(), None)
+
+        # no git index: fall back to scanning the filesystem
+        shutil.rmtree(os.path.join(self.tmpdir, '.git'))
+        self.assertEqual(setup.git_index(), None)
+        self.assertEqual(sorted(setup.files_in_packages()['packages']), ['vsc', 'vsc.test'])
+
+    def test_json_cache(self):
+        """Test the persistent JSON data of the caches"""
+        cache_fn = os.path.join(self.tmpdir, 'cache', 'data.json')
+        cache = shared_setup.JsonCache(cache_fn)
+        self.assertEqual(cache.data, {}, msg='missing cache is empty')
+        cache.data['path'] = Path('/some/path')
+        cache.save()
+        self.assertEqual(shared_setup.JsonCache(cache_fn).data, {'path': '/some/path'})
+
+        for txt in ['[1, 2]', 'not json']:
+            Path(cache_fn).write_text(txt, encoding='utf8')
+            self.mock_stderr(True)
+            self.assertEqual(shared_setup.JsonCache(cache_fn).data, {})
+            stderr = self.get_stderr()
+            self.mock_stderr(False)
+            self.assertEqual('Ignoring unreadable cache' in stderr, txt == 'not json', stderr)
+
+        # a failure to write is not fatal
+        cache = shared_setup.JsonCache(os.path.join(cache_fn, 'sub', 'data.json'))
+        self.mock_stderr(True)
+        cache.save()
+        stderr = self.get_stderr()
+        self.mock_stderr(False)
+        self.assertTrue(re.search(r'^WARN: Failed to write cache .*/sub/data.json: ', stderr, re.M), stderr)
+
+        # a stale discovery cache (of another version) is empty
+        Path(cache_fn).write_text(json.dumps({'version': '0.0.1', 'section': {}}), encoding='utf8')
+        self.assertEqual(shared_setup.DiscoveryCache(cache_fn).data, {'version': shared_setup.VERSION})
+
+    def test_discovery_cache(self):
+        """Test the persistent discovery cache"""
+        libdir = os.path.join(self.tmpdir, 'lib')
+        shutil.copytree(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testdata', 'vsc'),
+                        os.path.join(libdir, 'vsc'))
+        git_config = os.path.join(self.tmpdir, 'git_config')
+        shutil.copy2(os.path.join(self.setup.REPO_TEST_DIR, 'setup', 'git_config_1'), git_config)
+        shutil.copy2(os.path.join(self.setup.REPO_BASE_DIR, 'LICENSE'), self.tmpdir)
+
+        self.assertEqual(self.setup.cache, None, msg='cache is disabled by default')
+        os.environ['VSC_INSTALL_CACHE'] = '1'
+        self.assertTrue(isinstance(vsc_setup().cache, shared_setup.DiscoveryCache))
+        del os.environ['VSC_INSTALL_CACHE']
+
+        cache_fn = os.path.join(self.tmpdir, 'cache', 'discovery.json')
+
+        def new_setup():
+            setup = vsc_setup()
+            setup.REPO_BASE_DIR = self.tmpdir
+            setup.REPO_LIB_DIR = libdir
+            setup.cache = shared_setup.DiscoveryCache(cache_fn)
+            return setup
+
+        setup = new_setup()
+        res = setup.files_in_packages()
+        name_url = setup.get_name_url(filename=git_config, version='0.1.2')
+        lic = setup.get_license()
+        self.assertEqual(lic[0], 'LGPLv2+')
+        self.assertTrue(os.path.isfile(cache_fn))
+
+        # a new instance (e.g. the next setup.py invocation) uses the cached results
+        orig_walk_packages = vsc_setup._walk_packages
+        orig_get_name_url = vsc_setup._get_name_url
+        orig_get_license = vsc_setup._get_license
+
+        def fail(*args, **kwargs):
+            raise AssertionError('cached result is not used')
+
+        try:
+            vsc_setup._walk_packages = fail
+            vsc_setup._get_name_url = fail
+            vsc_setup._get_license = fail
+            setup = new_setup()
+            self.assertEqual(setup.files_in_packages(), res)
+            self.assertEqual(setup.get_name_url(filename=git_config, version='0.1.2'), name_url)
+            self.assertEqual(setup.get_license(), lic)
+            self.assertTrue(setup.private_repo, msg='private repo (git@ remote) is also cached')
+        finally:
+            vsc_setup._walk_packages = orig_walk_packages
+            vsc_setup._get_name_url = orig_get_name_url
+            vsc_setup._get_license = orig_get_license
+
+        # changes that keep the mtime of the small files are detected by their digest
+        license_fn = os.path.join(self.tmpdir, 'LICENSE')
+        for src, dest in [(os.path.join(self.setup.REPO_TEST_DIR, 'setup', 'git_config_2'), git_config),
+                          (os.path.join(self.setup.REPO_BASE_DIR, 'known_licenses', 'GPLv2'), license_fn)]:
+            mtime = os.stat(dest).st_mtime_ns
+            shutil.copy(src, dest)
+            os.utime(dest, ns=(mtime, mtime))
+        setup = new_setup()
+        setup.get_name_url(filename=git_config, version='0.1.2')
+        self.assertFalse(setup.private_repo, msg='https remote of the changed git config')
+        self.assertEqual(setup.get_license()[0], 'GPLv2')
+
+        # changes invalidate the cached results
+        Path(os.path.join(libdir, 'vsc', 'test', 'mod.py')).write_text('', encoding='utf8')
+        os.utime(git_config, ns=(0, 0))
+        setup = new_setup()
+        self.assertEqual(sorted(setup.files_in_packages()['modules']), ['vsc.test.mod'])
+        self.assertEqual(setup.get_name_url(filename=git_config, version='0.1.3')['download_url'],
+                         'https://github.com/hpcugent/vsc-install/archive/0.1.3.tar.gz')
+
+        # unreadable cache is ignored
+        Path(cache_fn).write_text('garbage', encoding='utf8')
+        self.assertEqual(new_setup().get_license()[0], 'GPLv2')
+
+    def test_test_jobs(self):
+        """Test running the test modules in parallel worker processes"""
+        suite = os.path.join(self.tmpdir, 'vsctestjobs')
+        os.makedirs(os.path.join(suite, 'sub'))
+        pids_fn = os.path.join(self.tmpdir, 'pids')
+        test_tpl = '\n'.join([
+            'import os',
+            'import unittest',
+            'class Test(unittest.TestCase):',
+            '    def test_pid(self):',
+            f'        open("{pids_fn}", "a").write(str(os.getpid()) + " ")',
+            '%s',
+            '',
+        ])
+        modules = {
+            '__init__': '',
+            'mod_ok': test_tpl % '    @unittest.skip("not now")\n    def test_skip(self):\n        pass',
+            'mod_fail': test_tpl % '    def test_fail(self):\n        self.assertEqual(1, 2)',
+            'mod_broken': 'import nosuchmodule',
+            'sub/__init__': '',
+            'sub/mod_sub': test_tpl % '    def test_sub(self):\n        pass',
+        }
+        for name, txt in modules.items():
+            Path(os.path.join(suite, f'{name}.py')).write_text(txt, encoding='utf8')
+        Path(os.path.join(suite, 'README')).write_text('not a test', encoding='utf8')
+
+        # the filters of the test run that runs this test
+        test_filter = getattr(builtins, '__test_filter')
+        orig_test_filter = test_filter.copy()
+        test_filter.update({'module': None, 'function': None, 'shard': None})
+
+        sys.path.insert(0, self.tmpdir)
+        try:
+            cmd = vsc_setup.VscTestCommand(setuptools.dist.Distribution())
+            cmd.test_suite = 'vsctestjobs'
+            for jobs, msg in [('0', 'test-jobs must be at least 1, got 0'), ('many', 'test-jobs must be a number')]:
+                cmd.test_jobs = jobs
+                self.assertErrorRegex(DistutilsOptionError, msg, cmd.finalize_options)
+            cmd.test_jobs = '3'
+            cmd.finalize_options()
+            cmd.setupper.REPO_BASE_DIR = self.tmpdir
+            self.assertEqual(cmd.test_jobs, 3)
+            test_run = VscTestRun(cmd)
+
+            all_modules = ['vsctestjobs.mod_broken', 'vsctestjobs.mod_fail', 'vsctestjobs.mod_ok',
+                           'vsctestjobs.sub.mod_sub']
+            self.assertEqual(test_run.test_modules(), all_modules)
+            cmd.test_filterm = 'mod_(ok|sub)'
+            self.assertEqual(test_run.test_modules(), ['vsctestjobs.mod_ok', 'vsctestjobs.sub.mod_sub'])
+            cmd.test_filterm = None
+
+            # longest test modules (in earlier runs) first, unknown ones first of all
+            self.assertEqual(test_run.schedule_test_modules(), all_modules)
+            durations = {'vsctestjobs.mod_ok': 1, 'vsctestjobs.mod_fail': 5, 'vsctestjobs.mod_broken': 3}
+            test_run.save_test_durations(durations)
+            self.assertEqual(test_run.schedule_test_modules(), ['vsctestjobs.sub.mod_sub', 'vsctestjobs.mod_fail',
+                                                           'vsctestjobs.mod_broken', 'vsctestjobs.mod_ok'])
+
+            self.mock_stdout(True)
+            self.mock_stderr(True)
+            result = test_run.run_tests_parallel()
+            stdout = self.get_stdout()
+            stderr = self.get_stderr()
+
+            # an outcome that is put on the queue right before the worker exits is not lost
+            orig_get = multiprocessing.queues.Queue.get
+
+            def late_get(done, block=True, timeout=None):
+                if block:
+                    raise queue.Empty
+                return orig_get(done, block, timeout)
+
+            cmd.test_jobs = 1
+            with patch.object(multiprocessing.queues.Queue, 'get', late_get):
+                outcomes = test_run.run_test_workers(iter(['vsctestjobs.sub.mod_sub']))
+            cmd.test_jobs = 3
+            self.mock_stdout(False)
+            self.mock_stderr(False)
+        finally:
+            test_filter.update(orig_test_filter)
+            sys.path.remove(self.tmpdir)
+            for mname in list(sys.modules):
+                if mname.startswith('vsctestjobs'):
+                    del sys.modules[mname]
+
+        self.assertFalse(result.wasSuccessful())
+        # the module that fails to import counts as one test with an error
+        self.assertEqual(result.testsRun, 7)
+        self.assertEqual(len(result.failures), 1)
+        self.assertTrue(str(result.failures[0][0]).startswith('test_fail (vsctestjobs.mod_fail.Test'))
+        self.assertEqual(len(result.errors), 1)
+        self.assertTrue(str(result.errors[0][0]).startswith('mod_broken '))
+        self.assertTrue('nosuchmodule' in result.errors[0][1])
+        self.assertEqual(len(result.skipped), 1)
+
+        # the tests ran in other processes
+        pids = set(Path(pids_fn).read_text(encoding='utf8').split())
+        self.assertEqual(len(pids) > 0, True)
+        self.assertFalse(str(os.getpid()) in pids)
+        self.assertTrue(re.search(r'^INFO: Ran 2 tests of vsctestjobs.sub.mod_sub in ', stdout, re.M), stdout)
+        self.assertTrue(re.search(r'^Ran 7 tests in .* with 3 jobs\n\nFAILED \(failures=1, errors=1, skipped=1\)$',
+                                  stderr, re.M), stderr)
+        self.assertTrue('FAIL: test_fail (vsctestjobs.mod_fail.Test' in stderr)
+        self.assertEqual([(outcome['module'], outcome['testsRun']) for outcome in outcomes],
+                         [('vsctestjobs.sub.mod_sub', 2)])
+
+        # durations of this run are stored
+        self.assertTrue(test_run.test_durations_filename().startswith(self.tmpdir))
+        self.assertEqual(sorted(test_run.load_test_durations()), all_modules)
+
+    def test_test_shard(self):
+        """Test running a shard of the tests"""
+        suite = os.path.join(self.tmpdir, 'vsctestshard')
+        os.makedirs(suite)
+        Path(os.path.join(suite, '__init__.py')).write_text('', encoding='utf8')
+        for mod in ['mod_a', 'mod_b']:
+            txt = 'import unittest\nclass Test(unittest.TestCase):\n'
+            txt += ''.join(f'    def test_{idx}(self):\n        pass\n' for idx in range(10))
+            Path(os.path.join(suite, f'{mod}.py')).write_text(txt, encoding='utf8')
+        durations_fn = os.path.join(self.tmpdir, 'durations.json')
+        Path(durations_fn).write_text('{"vsctestshard.mod_a": 2.5, "vsctestshard.mod_b": 1.5}', encoding='utf8')
+
+        def test_ids(tests):
+            if isinstance(tests, shared_setup.TestSuite):
+                return [tid for test in tests for tid in test_ids(test)]
+            return [tests.id()]
+
+        cmd = vsc_setup.VscTestCommand(setuptools.dist.Distribution())
+        cmd.test_suite = 'vsctestshard'
+        for shard in ['0/3', '4/3', '1', 'one/3']:
+            cmd.test_shard = shard
+            self.assertErrorRegex(DistutilsOptionError, 'test-shard must be INDEX/COUNT', cmd.finalize_options)
+        cmd.test_shard = None
+        cmd.test_shard_durations = durations_fn
+        self.assertErrorRegex(DistutilsOptionError, 'test-shard-durations requires test-shard', cmd.finalize_options)
+
+        test_filter = getattr(builtins, '__test_filter')
+        orig_test_filter = test_filter.copy()
+        test_filter.update({'module': None, 'function': None, 'shard': None})
+
+        sys.path.insert(0, self.tmpdir)
+        try:
+            def load():
+                # the ScanningLoader only loads each module once
+                return test_ids(vsc_setup.VscScanningLoader().loadTestsFromName('vsctestshard'))
+
+            all_tests = load()
+            self.assertEqual(len(all_tests), 20)
+
+            # stable hash of the test ids: all shards together are the complete test suite
+            shards = []
+            for index in range(1, 4):
+                cmd.test_shard = f'{index}/3'
+                cmd.test_shard_durations = None
+                cmd.finalize_options()
+                self.assertEqual(cmd.test_shard, (index - 1, 3))
+                test_filter.update({'shard': cmd.test_shard, 'shard_bins': cmd.test_shard_bins()})
+                shards.append(load())
+                # the same tests each time
+                self.assertEqual(load(), shards[-1])
+            self.assertEqual(sorted(sum(shards, [])), sorted(all_tests))
+            self.assertTrue(all(shards), msg='no empty shard')
+
+            # balanced on the test module durations
+            cmd.test_shard = '1/2'
+            cmd.test_shard_durations = durations_fn
+            cmd.finalize_options()
+            self.assertEqual(cmd.test_shard_bins(), {'vsctestshard.mod_a': 0, 'vsctestshard.mod_b': 1})
+            test_filter.update({'shard': cmd.test_shard, 'shard_bins': cmd.test_shard_bins()})
+            self.assertEqual(load(),
+                             [tid for tid in all_tests if '.mod_a.' in tid])
+        finally:
+            test_filter.update(orig_test_filter)
+            sys.path.remove(self.tmpdir)
+            for mname in list(sys.modules):
+                if mname.startswith('vsctestshard'):
+                    del sys.modules[mname]
+
+        cmd.test_shard_durations = os.path.join(self.tmpdir, 'nosuchfile.json')
+        self.assertErrorRegex(DistutilsOptionError, 'Failed to read test durations', cmd.test_shard_bins)
+
+    def test_test_queue(self):
+        """Test running the test modules from a queue in a shared directory"""
+        suite = os.path.join(self.tmpdir, 'vsctestqueue')
+        os.makedirs(suite)
+        Path(os.path.join(suite, '__init__.py')).write_text('', encoding='utf8')
+        modules = [f'vsctestqueue.mod_{idx}' for idx in range(6)]
+        for idx, mname in enumerate(modules):
+            txt = 'import time\nimport unittest\nclass Test(unittest.TestCase):\n'
+            txt += '    def test_sleep(self):\n        time.sleep(0.1)\n'
+            if idx == 3:
+                txt += '    def test_fail(self):\n        self.assertTrue(False)\n'
+            Path(os.path.join(suite, f"{mname.split('.')[1]}.py")).write_text(txt, encoding='utf8')
+        queue_dir = os.path.join(self.tmpdir, 'queue')
+
+        def new_cmd(coordinator=False, timeout=10):
+            cmd = vsc_setup.VscTestCommand(setuptools.dist.Distribution())
+            cmd.test_suite = 'vsctestqueue'
+            cmd.test_queue = queue_dir
+            cmd.test_queue_coordinator = coordinator
+            cmd.test_queue_timeout = timeout
+            cmd.finalize_options()
+            cmd.setupper.REPO_BASE_DIR = self.tmpdir
+            return cmd
+
+        cmd = vsc_setup.VscTestCommand(setuptools.dist.Distribution())
+        cmd.test_queue_coordinator = True
+        self.assertErrorRegex(DistutilsOptionError, 'test-queue-coordinator requires test-queue', cmd.finalize_options)
+        cmd.test_queue = queue_dir
+        cmd.test_queue_timeout = '1h'
+        self.assertErrorRegex(DistutilsOptionError, 'test-queue-timeout must be a number, got 1h', cmd.finalize_options)
+        # a worker gives up when nobody fills the queue
+        self.assertErrorRegex(shared_setup.DistutilsError, 'No test queue in .* after 0.1s',
+                              VscTestRun(new_cmd(timeout=0.1)).run_tests_queue)
+
+        test_filter = getattr(builtins, '__test_filter')
+        orig_test_filter = test_filter.copy()
+        test_filter.update({'module': None, 'function': None, 'shard': None})
+
+        sys.path.insert(0, self.tmpdir)
+        self.mock_stdout(True)
+        self.mock_stderr(True)
+        try:
+            # a worker (on another node) waits for the coordinator to fill the queue
+            worker = multiprocessing.get_context('fork').Process(target=VscTestRun(new_cmd()).run_tests_queue)
+            worker.start()
+            result = VscTestRun(new_cmd(coordinator=True)).run_tests_queue()
+            worker.join()
+            stderr = self.get_stderr()
+
+            # a coordinator needs a new queue
+            self.assertErrorRegex(DistutilsOptionError, 'Test queue .* is already used',
+                                  VscTestRun(new_cmd(coordinator=True)).run_tests_queue)
+
+            # a module that was claimed, but has no result (e.g. the worker was killed)
+            os.remove(os.path.join(queue_dir, 'results', 'vsctestqueue.mod_2.json'))
+            os.remove(os.path.join(queue_dir, 'modules.json'))
+            broken = VscTestRun(new_cmd(coordinator=True, timeout=0.1)).run_tests_queue()
+        finally:
+            self.mock_stdout(False)
+            self.mock_stderr(False)
+            test_filter.update(orig_test_filter)
+            sys.path.remove(self.tmpdir)
+            for mname in list(sys.modules):
+                if mname.startswith('vsctestqueue'):
+                    del sys.modules[mname]
+
+        self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(sorted(os.listdir(os.path.join(queue_dir, 'claims'))), modules)
+        self.assertEqual(result.testsRun, 7)
+        self.assertEqual(len(result.failures), 1)
+        self.assertTrue(str(result.failures[0][0]).startswith('test_fail (vsctestqueue.mod_3.Test'))
+        self.assertTrue(re.search(r'^Ran 7 tests in .* from test queue .* \(all workers\)\n\nFAILED \(failures=1\)$',
+                                  stderr, re.M), stderr)
+
+        self.assertEqual(broken.testsRun, 6)
+        self.assertEqual([str(test) for test, _ in broken.errors], ['vsctestqueue.mod_2'])
+        self.assertTrue(re.search(r'^No result in test queue .* \(claimed by \S+ \d+\)', broken.errors[0][1]))
+
+    def test_test_timing(self):
+        """Test the timing of the tests, test module imports and setups"""
+        suite = os.path.join(self.tmpdir, 'vsctesttiming')
+        os.makedirs(suite)
+        Path(os.path.join(suite, '__init__.py')).write_text('', encoding='utf8')
+        Path(os.path.join(suite, 'mod.py')).write_text('\n'.join([
+            'import time',
+            'import unittest',
+            'time.sleep(0.1)',
+            'class Test(unittest.TestCase):',
+            '    @classmethod',
+            '    def setUpClass(cls):',
+            '        time.sleep(0.4)',
+            '    def test_sleep(self):',
+            '        time.sleep(0.6)',
+            '    def test_cpu(self):',
+            '        self.data = [str(idx) for idx in range(10**6)]',
+            '',
+        ]), encoding='utf8')
+        json_fn = os.path.join(self.tmpdir, 'timing.json')
+
+        cmd = vsc_setup.VscTestCommand(setuptools.dist.Distribution())
+        cmd.test_suite = 'vsctesttiming'
+        cmd.test_timing = '2'
+        cmd.test_timing_json = json_fn
+        cmd.finalize_options()
+        cmd.setupper.REPO_BASE_DIR = self.tmpdir
+        self.assertEqual(cmd.test_timing, 2)
+        cmd.test_timing = 'all'
+        self.assertErrorRegex(DistutilsOptionError, 'test-timing must be a number, got all', cmd.finalize_options)
+        cmd.test_timing = 2
+        test_run = VscTestRun(cmd)
+
+        test_filter = getattr(builtins, '__test_filter')
+        orig_test_filter = test_filter.copy()
+        test_filter.update({'module': None, 'function': None, 'shard': None})
+        timing = getattr(builtins, '__test_timing')
+        orig_timing = timing.copy()
+
+        sys.path.insert(0, self.tmpdir)
+        try:
+            # in a single process, with the timing test runner
+            timing.update({'enabled': True, 'records': []})
+            tests = vsc_setup.VscScanningLoader().loadTestsFromName('vsctesttiming')
+            runner = TimingTextTestRunner(stream=io.StringIO())
+            self.assertTrue(runner.run(tests).wasSuccessful())
+            records = timing['records']
+
+            self.mock_stdout(True)
+            test_run.report_test_timing()
+            stdout = self.get_stdout()
+            self.mock_stdout(False)
+
+            # with test jobs, the records of the worker processes are merged
+            for mname in list(sys.modules):
+                if mname.startswith('vsctesttiming'):
+                    del sys.modules[mname]
+            timing.update({'enabled': True, 'records': []})
+            cmd.test_jobs = 2
+            self.mock_stderr(True)
+            self.mock_stdout(True)
+            test_run.run_tests_parallel()
+            self.mock_stdout(False)
+            self.mock_stderr(False)
+            parallel_records = timing['records']
+        finally:
+            timing.update(orig_timing)
+            test_filter.update(orig_test_filter)
+            sys.path.remove(self.tmpdir)
+            for mname in list(sys.modules):
+                if mname.startswith('vsctesttiming'):
+                    del sys.modules[mname]
+
+        # the package is imported by the loader, or before the test jobs start
+        self.assertEqual(records[0]['name'], 'vsctesttiming')
+        for recs in (records[1:], parallel_records):
+            names = [(rec['kind'], rec['name']) for rec in recs]
+            self.assertEqual(names, [
+                ('import', 'vsctesttiming.mod'),
+                ('setup', 'vsctesttiming.mod.Test'),
+                ('test', 'vsctesttiming.mod.Test.test_cpu'),
+                ('test', 'vsctesttiming.mod.Test.test_sleep'),
+            ])
+            walls = [rec['wall'] for rec in recs]
+            # only lower bounds: a loaded host (e.g. with test jobs) makes everything slower
+            self.assertTrue(walls[0] >= 0.1 and walls[1] >= 0.4 and walls[3] >= 0.6, walls)
+            # sleeping takes no CPU time, filling memory does
+            self.assertTrue(recs[3]['cpu'] < recs[2]['cpu'], recs)
+            self.assertTrue(recs[2]['cpu'] > 0 and recs[2]['maxrss_delta'] > 0, recs)
+            self.assertTrue(all(rec['maxrss'] > 0 for rec in recs))
+
+        # the 2 records with the longest wall time are reported, in whatever order they ended up
+        self.assertTrue(re.search(r'^INFO: Slowest 2 tests, test module imports and setups:$', stdout, re.M), stdout)
+        reported = re.findall(r'^INFO: .*s wall .* kB maxrss \(\+\d+ kB\) (\w+) +(\S+)$', stdout, re.M)
+        slowest = sorted(records, key=lambda rec: rec['wall'], reverse=True)[:2]
+        self.assertEqual(sorted(reported), sorted((rec['kind'], rec['name']) for rec in slowest), stdout)
+        with open(json_fn, encoding='utf8') as fh:
+            self.assertEqual(json.load(fh), records)
+
+    def test_test_history(self):
+        """Test the test history and the detection of performance regressions"""
+        history_dir = os.path.join(self.tmpdir, 'history')
+        cmd = vsc_setup.VscTestCommand(setuptools.dist.Distribution())
+        cmd.test_suite = 'test'
+        cmd.test_regression = '0.5'
+        msg = 'test-regression factor must be larger than 1'
+        self.assertErrorRegex(DistutilsOptionError, msg, cmd.finalize_options)
+        cmd.test_regression = 'x2'
+        self.assertErrorRegex(DistutilsOptionError, 'test-regression must be a number, got x2', cmd.finalize_options)
+        cmd.test_regression = '2'
+        cmd.test_history_dir = history_dir
+        cmd.finalize_options()
+        test_run = VscTestRun(cmd)
+        history_fn = os.path.join(history_dir, 'test-history.jsonl')
+        self.assertEqual(test_run.test_history_filename(), history_fn)
+        self.assertEqual(test_run.load_test_history(), [])
+
+        # a slower earlier run, and 3 runs on this host
+        test_run.append_test_history({'a': 0.1, 'b': 0.01, 'c': 1.0})
+        for _ in range(3):
+            test_run.append_test_history({'a': 1.0, 'b': 0.01, 'c': 1.0, 'e': 1.0})
+        # runs on other hosts are ignored, and so are unreadable lines
+        with open(history_fn, 'a', encoding='utf8') as fh:
+            fh.write('garbage\n')
+            fh.write(json.dumps({'host': 'otherhost', 'python': '3.0', 'durations': {'a': 10, 'c': 10}}) + '\n')
+        self.assertEqual(len(test_run.load_test_history()), 5)
+
+        durations = {'a': 2.5, 'b': 0.05, 'c': 1.1, 'd': 10.0, 'e': 3.0}
+        # b is 5 times slower, but that's only noise; d is a new test
+        self.assertEqual(test_run.test_regressions(durations, test_run.load_test_history()),
+                         [('e', 3.0, 1.0, 3), ('a', 2.5, 1.0, 4)])
+        cmd.test_regression = 2.6
+        self.assertEqual(test_run.test_regressions(durations, test_run.load_test_history()), [('e', 3.0, 1.0, 3)])
+
+        # only the most recent runs are the baseline
+        for _ in range(10):
+            test_run.append_test_history({'e': 2.0})
+        self.assertEqual(test_run.test_regressions(durations, test_run.load_test_history()), [])
+
+        timing = getattr(builtins, '__test_timing')
+        orig_timing = timing.copy()
+        timing['records'] = [
+            {'kind': 'import', 'name': 'e', 'wall': 100.0},
+            {'kind': 'test', 'name': 'e', 'wall': 6.0},
+        ]
+        self.mock_stderr(True)
+        self.mock_stdout(True)
+        try:
+            test_run.report_test_history()
+        finally:
+            timing.update(orig_timing)
+            stderr = self.get_stderr()
+            stdout = self.get_stdout()
+            self.mock_stdout(False)
+            self.mock_stderr(False)
+
+        regex = r'^WARN: Performance regression of test e: 6.000s is 3.0 times the median 2.000s of 10 earlier runs$'
+        self.assertTrue(re.search(regex, stderr, re.M), stderr)
+        self.assertTrue(re.search(r'^INFO: 1 of 1 tests regressed more than 2.6 times in test history ', stdout, re.M))
+        last_run = test_run.load_test_history()[-1]
+        self.assertEqual(last_run['durations'], {'e': 6.0})
+        self.assertEqual(sorted(last_run), ['durations', 'host', 'python', 'time'])
+
     def test_import(self):
         """Test importing things from shared_setup.py, these should not be broken for backward compatibility."""
         from vsc.install.shared_setup import SHARED_TARGET
@@ -173,6 +847,75 @@ class TestSetup(TestCase):
         # this doesn't seem to test what you think it does? stdout is nog mocked correctly
         # self.assertTrue(re.search(r"^kwargs:\s*\{.*'url':\s*'http://example.com/vsc-test'", txt, re.M))
 
+    def test_files_in_packages_memoized(self):
+        """Test that the package index is only rebuilt when the lib tree changes"""
+        libdir = os.path.join(self.tmpdir, 'lib')
+        shutil.copytree(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testdata', 'vsc'),
+                        os.path.join(libdir, 'vsc'))
+        setup = vsc_setup()
+        setup.REPO_LIB_DIR = libdir
+
+        res = setup.files_in_packages()
+        self.assertEqual(sorted(res['packages']), ['vsc', 'vsc.test'])
+        self.assertTrue(setup.files_in_packages() is res, msg='second call returns memoized index')
+        self.assertTrue(setup.package_files is res, msg='package_files uses the same index')
+
+        # excluded_pkgs has its own index
+        res_excl = setup.files_in_packages(excluded_pkgs=['vsc.other'])
+        self.assertFalse(res_excl is res)
+        self.assertTrue(setup.files_in_packages(excluded_pkgs=['vsc.other']) is res_excl)
+
+        # adding a module to a package changes the index
+        Path(os.path.join(libdir, 'vsc', 'test', 'mod.py')).write_text('', encoding='utf8')
+        res_mod = setup.files_in_packages()
+        self.assertFalse(res_mod is res, msg='index rebuilt after adding a module')
+        self.assertEqual(list(res_mod['modules']), ['vsc.test.mod'])
+
+        # so does adding a new package (in a new subdirectory)
+        os.mkdir(os.path.join(libdir, 'vsc', 'other'))
+        Path(os.path.join(libdir, 'vsc', 'other', '__init__.py')).write_text(
+            Path(os.path.join(libdir, 'vsc', '__init__.py')).read_text(encoding='utf8'), encoding='utf8')
+        self.assertEqual(sorted(setup.files_in_packages()['packages']), ['vsc', 'vsc.other', 'vsc.test'])
+
+    def test_scan_tree(self):
+        """Test the scandir based tree walker"""
+        for path in ['a/b/c', 'a/skip/d', 'e']:
+            os.makedirs(os.path.join(self.tmpdir, path))
+        for path in ['top.py', 'a/one.py', 'a/b/c/two.py', 'a/skip/d/three.py']:
+            Path(os.path.join(self.tmpdir, path)).write_text('', encoding='utf8')
+        os.symlink(os.path.join(self.tmpdir, 'a'), os.path.join(self.tmpdir, 'e', 'link'))
+
+        def walked(res):
+            return [(os.path.relpath(root, self.tmpdir), dirs, files) for root, dirs, files in res]
+
+        expected = [
+            ('.', ['a', 'e'], ['top.py']),
+            ('a', ['b', 'skip'], ['one.py']),
+            ('e', ['link'], []),
+            ('a/b', ['c'], []),
+            ('a/skip', ['d'], []),
+            ('a/b/c', [], ['two.py']),
+            ('a/skip/d', [], ['three.py']),
+        ]
+        self.assertEqual(walked(shared_setup.scan_tree(self.tmpdir)), expected)
+        self.assertEqual(walked(shared_setup.scan_tree(self.tmpdir, workers=4)), expected)
+
+        # same content as os.walk
+        self.assertEqual(sorted((root, sorted(dirs), sorted(files)) for root, dirs, files in os.walk(self.tmpdir)),
+                         sorted(shared_setup.scan_tree(self.tmpdir, workers=3)))
+
+        pruned = [
+            ('.', ['a', 'e'], ['top.py']),
+            ('a', ['b'], ['one.py']),
+            ('e', ['link'], []),
+            ('a/b', ['c'], []),
+            ('a/b/c', [], ['two.py']),
+        ]
+        self.assertEqual(walked(shared_setup.scan_tree(self.tmpdir, prune=lambda root, name: name == 'skip')), pruned)
+
+        # missing directory yields nothing
+        self.assertEqual(list(shared_setup.scan_tree(os.path.join(self.tmpdir, 'nosuchdir'))), [])
+
     def test_prepare_rpm(self):
         """
         Test the prepare rpm function
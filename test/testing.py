@@ -56,6 +56,19 @@ class TestTesting(TestCase):
             err = exception(msg)
             self.assertEqual(self.convert_exception_to_str(err), msg)
 
+    def test_assertequal(self):
+        """Tests for assertEqual method."""
+        lines = [f'line {idx}\n' for idx in range(100000)]
+        changed = lines[:]
+        changed[50000] = 'changed\n'
+        self.assertErrorRegex(AssertionError, r'DIFF:\n(  line 4999[5-9]\n){5}- line 50000\n\+ changed\n',
+                              self.assertEqual, ''.join(lines), ''.join(changed))
+
+        # only the first lines of big diffs are reported
+        changed = [f'changed {idx}\n' for idx in range(100000)]
+        regex = r'DIFF \(first 100 lines\):\n- line 0\n\+ changed 0\n(.*\n){97}\+ changed 49\n$'
+        self.assertErrorRegex(AssertionError, regex, self.assertEqual, ''.join(lines), ''.join(changed))
+
     def test_asserterrorregex(self):
         """Tests for assertErrorRegex method."""
         testfile = '/no/such/file'